@@ -300,4 +300,149 @@ USIM_app_FS = {
 
 EMV_AID = {
 (160, 0, 0, 0, 3, 16, 16) : 'VISA credit / debit',
-}
\ No newline at end of file
+}
+
+#################################
+# indexed file-system model     #
+# built once from the above     #
+# dictionnaries                 #
+#################################
+
+class FS_node(object):
+    '''
+    file (MF, ADF, DF or EF) of a file-system tree
+    
+    path: path tuple of the file, as used in the FS dictionnaries
+          (empty tuple for the root MF / ADF)
+    name: name of the file, e.g. 'EF_IMSI'
+    fid: file identifier, 2-tuple
+    parent: FS_node of the parent DF (None for the root)
+    children: list of FS_node
+    pmf: list of bytes for a single SELECT by path from MF (UICC)
+    fids: list of file identifiers to SELECT one by one from MF (SIM)
+    '''
+    
+    def __init__(self, path, name, fid, parent=None):
+        self.path = path
+        self.name = name
+        self.fid = fid
+        self.parent = parent
+        self.children = []
+        if parent is None:
+            self.type = name[:3] == 'ADF' and 'ADF' or 'MF'
+            self.lineage = [self]
+            self.fids = [list(fid)]
+            # MF is selected by its FID, current ADF by its reserved FID
+            self.pmf = self.type == 'ADF' and list(fid) or []
+        else:
+            self.type = name[:3] == 'EF_' and 'EF' or 'DF'
+            self.lineage = parent.lineage + [self]
+            self.fids = parent.fids + [list(fid)]
+            self.pmf = parent.pmf + list(fid)
+    
+    def __repr__(self):
+        return 'FS_node(%s: %s)' % (self.name, 
+                                    ' '.join(['%02X' % b for b in self.path]))
+
+
+class FS_tree(object):
+    '''
+    tree-shaped model of one of the (U)SIM file-system dictionnaries
+    
+    indexes are built once, at initialization:
+        by_path: path tuple -> FS_node
+        by_name: file name -> list of FS_node (shallowest first)
+        by_fid: FID 2-tuple -> list of FS_node (shallowest first)
+        by_parent: parent path tuple -> list of children FS_node
+    '''
+    
+    def __init__(self, fs_dict, root_fid=(0x3F, 0x00), root_name='MF'):
+        self.root = FS_node((), root_name, root_fid)
+        self.by_path = {(): self.root}
+        self.by_name = {root_name: [self.root]}
+        self.by_fid = {root_fid: [self.root]}
+        self.by_parent = {(): []}
+        # parents need to be built before their children
+        paths = fs_dict.keys()
+        paths.sort(key=lambda p: (len(p), p))
+        for path in paths:
+            if path == root_fid:
+                # root is already there, only add its alias
+                self.by_path[path] = self.root
+            else:
+                self._add(path, fs_dict[path])
+    
+    def _add(self, path, name):
+        ppath = path[:-2]
+        if ppath not in self.by_path:
+            # DF missing from the dictionnary: reference it by its FID
+            self._add(ppath, 'DF_%02X%02X' % ppath[-2:])
+        parent = self.by_path[ppath]
+        node = FS_node(path, name, path[-2:], parent)
+        parent.children.append(node)
+        self.by_path[path] = node
+        self.by_name.setdefault(name, []).append(node)
+        self.by_fid.setdefault(node.fid, []).append(node)
+        self.by_parent.setdefault(ppath, []).append(node)
+        if node.type == 'DF':
+            self.by_parent.setdefault(path, [])
+        return node
+    
+    def get(self, name):
+        '''
+        get('EF_IMSI') -> FS_node or None
+        
+        returns the shallowest file with the given name
+        '''
+        if name in self.by_name:
+            return self.by_name[name][0]
+        return None
+    
+    def select_sequence(self, node, cur=None):
+        '''
+        select_sequence(FS_node, cur=FS_node of the current DF or None)
+            -> list of FID to select one after the other
+        
+        follows SIM (TS 51.011) selection rules: from the current DF, 
+        its children, its parent, and DF children of its parent 
+        are directly selectable; otherwise, starts again from MF
+        '''
+        lineage = node.lineage
+        if cur is None:
+            return node.fids
+        if cur in lineage:
+            i = lineage.index(cur) + 1
+        elif cur.parent is not None and cur.parent in lineage:
+            i = lineage.index(cur.parent) + 1
+            # the parent itself (i is past the lineage) is selectable,
+            # but only DF are selectable as a sibling of the current DF
+            if i < len(lineage) and lineage[i].type == 'EF':
+                i -= 1
+        else:
+            return node.fids
+        return node.fids[i:] or [list(node.fid)]
+
+
+class lazy_FS_tree(object):
+    '''
+    stands for an FS_tree, which is only built when first used
+    (building the indexes of all trees at import slows down every
+    program importing card)
+    '''
+    
+    def __init__(self, fs_dict, **kwargs):
+        self._fs_dict, self._kwargs = fs_dict, kwargs
+        self._tree = None
+    
+    def __getattr__(self, attr):
+        # only called for attributes the proxy does not have
+        if self._tree is None:
+            self._tree = FS_tree(self._fs_dict, **self._kwargs)
+        return getattr(self._tree, attr)
+
+
+# built once, when first used
+SIM_FS_tree = lazy_FS_tree(SIM_FS)
+USIM_FS_tree = lazy_FS_tree(USIM_FS)
+USIM_app_FS_tree = lazy_FS_tree(USIM_app_FS, root_fid=(0x7F, 0xFF), 
+                                root_name='ADF_USIM')
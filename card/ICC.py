@@ -31,16 +31,18 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 # classic python modules
 import os
 import re
+from logging import INFO
+from time import sleep
 
-# smartcard python modules from pyscard
-from smartcard.CardType import AnyCardType
-from smartcard.CardRequest import CardRequest
-from smartcard.CardConnection import CardConnection
-from smartcard.ATR import ATR
-from smartcard.Exceptions import CardConnectionException
-from smartcard.util import toHexString
+# smartcard python modules from pyscard are imported when first needed
+# (connection to a card, ATR analysis), so that importing card is fast
 
 from card.utils import *
+from card.FS import USIM_FS_tree
+from card.codec import decode_iccid
+from card.sat import proactive_handler
+from card.trace import apdu_recorder
+from card.log import log, timed
         
 ###########################################################
 # ISO7816 class with attributes and methods as defined 
@@ -57,6 +59,20 @@ class ISO7816(object):
     '''
     
     dbg = 0
+    # apdu_recorder instance, when tracing APDU, see start_trace()
+    trace = None
+    # card ICCID, once read, for logging
+    ICCID = None
+    # SW returned when reading a file without the required access rights
+    denied_sw = ((0x69, 0x82), )
+    # image_writer instance, when scanning to a card image, see scan_fs()
+    image = None
+    # CLA of the toolkit commands (FETCH, TERMINAL RESPONSE / PROFILE)
+    CLA_SAT = None
+    # retries of a command, and wait between them in seconds,
+    # when the toolkit is busy (93 00)
+    busy_retries = 3
+    busy_wait = 0.1
     
     INS_dic = {
         0x04 : 'DEACTIVATE FILE',
@@ -137,23 +153,47 @@ class ISO7816(object):
         0xAB : 'Security Attribute expanded',
         }     
                
-    def __init__(self, CLA=0x00):
+    def __init__(self, CLA=0x00, cardservice=None, trace=None):
         '''
         connect smartcard and defines class CLA code for communication
         uses "pyscard" library services
         
+        cardservice: use this card service instead of waiting for a card
+            (e.g. card.trace.replay_cardservice to replay a recorded trace)
+        trace: filename of a trace to record all APDU to, from the first 
+            one (see start_trace())
+        
         creates self.CLA attribute with CLA code
         and self.coms attribute with associated "apdu_stack" instance
         '''
-        cardtype = AnyCardType()
-        cardrequest = CardRequest(timeout=1, cardType=cardtype)
-        self.cardservice = cardrequest.waitforcard()
+        if cardservice is None:
+            from smartcard.CardType import AnyCardType
+            from smartcard.CardRequest import CardRequest
+            cardtype = AnyCardType()
+            cardrequest = CardRequest(timeout=1, cardType=cardtype)
+            cardservice = cardrequest.waitforcard()
+        self.cardservice = cardservice
         self.cardservice.connection.connect()
         self.reader = self.cardservice.connection.getReader()
         self.ATR = self.cardservice.connection.getATR()
+        if trace is not None:
+            self.start_trace(trace)
         
         self.CLA = CLA
         self.coms = apdu_stack()
+        # current DF, as an FS_node, when known from a selection by name
+        self.cur_DF = None
+        # codes verified in this session (e.g. 'CHV1'), and read access
+        # conditions found denied by the card, see read_allowed()
+        self.verified = set()
+        self.denied = set()
+        # codes to verify again after a reconnection, kept on reconnection
+        if 'pins' not in self.__dict__:
+            self.pins = {}
+        # proactive commands handling (see card.sat), kept on reconnection
+        if 'sat' not in self.__dict__:
+            self.sat = proactive_handler()
+        self._in_sat = False
     
     def disconnect(self):
         '''
@@ -179,6 +219,7 @@ class ISO7816(object):
         
         check also the more complete "parseATR" tool
         '''
+        from smartcard.ATR import ATR
         print '\nsmartcard reader: ', self.reader
         if self.ATR != None:
             print "\nsmart card ATR is: %s" % toHexString(self.ATR)
@@ -323,39 +364,102 @@ class ISO7816(object):
         generic function to send apdu, receive and interpret response
         force: force card reconnection if pyscard transmission fails
         '''
-        if force:
-            try: 
-                data, sw1, sw2 = self.cardservice.connection.transmit(apdu)
-            except CardConnectionException:
-                ISO7816.__init__(self, CLA = self.CLA)
-                data, sw1, sw2 = self.cardservice.connection.transmit(apdu)
-        else:
-            data, sw1, sw2 = self.cardservice.connection.transmit(apdu)
+        data, sw1, sw2 = self._transmit(apdu, force)
+        # toolkit busy: the command can be retried later
+        retries = self.busy_retries
+        while (sw1, sw2) == (0x93, 0x00) and retries > 0:
+            sleep(self.busy_wait)
+            data, sw1, sw2 = self._transmit(apdu, force)
+            retries -= 1
         # replaces INS code by strings when available
         if apdu[1] in self.INS_dic.keys(): 
             apdu_name =  self.INS_dic[apdu[1]] + ' '
         else: 
             apdu_name = ''
         sw_stat = self.sw_status(sw1, sw2)
+        # command ended normally, with proactive command(s) pending:
+        # they are handled, and the command ends as 90 00 when the
+        # proactive session ended normally, or with its last SW
+        if sw1 == 0x91 and self.sat is not None and not self._in_sat:
+            self._in_sat = True
+            try:
+                num, (sw1, sw2) = self.sat.session(self, sw2)
+            finally:
+                self._in_sat = False
+            sw_stat = '%s (%d proactive command(s) handled)' \
+                      % (self.sw_status(sw1, sw2), num)
         return ['%sapdu: %s' % (apdu_name, toHexString(apdu)),
                 'sw1, sw2: %s - %s' % ( toHexString([sw1, sw2]), sw_stat ),
                 (sw1, sw2),
                 data ]
     
-    def bf_cla(self, start=0, param=[0xA4, 0x00, 0x00, 0x02, 0x3F, 0x00]):
+    def _transmit(self, apdu, force=False):
+        # sends the apdu, reconnecting the card on failure when forced
+        if force:
+            from smartcard.Exceptions import CardConnectionException
+            try: 
+                data, sw1, sw2 = self.cardservice.connection.transmit(apdu)
+            except CardConnectionException:
+                ISO7816.__init__(self, CLA = self.CLA)
+                self.reconnected()
+                data, sw1, sw2 = self.cardservice.connection.transmit(apdu)
+        else:
+            data, sw1, sw2 = self.cardservice.connection.transmit(apdu)
+        if self.trace is not None:
+            self.trace.record(apdu, data, sw1, sw2)
+        return data, sw1, sw2
+    
+    def reconnected(self):
+        '''
+        called after the card was reconnected (and so reset), 
+        with the selection and verification states lost;
+        card classes can override it to restore them
+        '''
+        pass
+    
+    def start_trace(self, filename='card_trace'):
+        '''
+        starts recording all command / response pairs exchanged 
+        with the card, in a binary trace file (see card.trace)
+        the trace can be replayed with card.trace.replay_cardservice
+        when it starts with the card class initialization: pass the
+        trace filename to the constructor, e.g. USIM(trace='usim.trc')
+        '''
+        self.stop_trace()
+        self.trace = apdu_recorder(filename, self.ATR, str(self.reader))
+    
+    def stop_trace(self):
+        '''
+        stops recording APDU, and closes the trace file
+        '''
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+    
+    def bf_cla(self, start=0, param=[0xA4, 0x00, 0x00, 0x02, 0x3F, 0x00],
+               cache=None):
         '''
         bf_cla( start=int(starting CLA), 
-                param=list(bytes for selecting file 0x3F, 0x00) ) ->
+                param=list(bytes for selecting file 0x3F, 0x00),
+                cache=None ) ->
             list( CLA which could be supported )
             
         tries all classes CLA codes to check the possibly supported ones
         prints CLA suspected to be supported
         returns the list of those CLA codes
         
+        with cache (JSON filename, or card.probe.capability_cache), 
+        results are kept per ATR and per command (param), and only CLA 
+        codes not probed yet with the same command on the same card model 
+        are tried (nothing is printed)
+        
         WARNING: 
         can block the card definitively
         Do not do it with your own VISA / MASTERCARD
         '''
+        if cache is not None:
+            from card.probe import capability_probe
+            return capability_probe(self, cache).probe_cla(start, param)
         clist = []
         for i in range(start, 256):
             ret = self.sr_apdu([i] + param)
@@ -364,19 +468,26 @@ class ISO7816(object):
                 clist.append(i)
         return clist
     
-    def bf_ins(self, start=0):
+    def bf_ins(self, start=0, cache=None):
         '''
-        bf_cla( start=int(starting INS) ) 
+        bf_ins( start=int(starting INS), cache=None ) 
             -> list( INS which could be supported )
             
         tries all instructions INS codes to check the supported ones
         prints INS suspected to be supported
         returns the list of those INS codes
         
+        with cache (JSON filename, or card.probe.capability_cache), 
+        results are kept per ATR and CLA, and only INS codes not probed yet 
+        on the same card model are tried (nothing is printed)
+        
         WARNING: 
         can block the card definitively
         Do not do it with your own VISA / MASTERCARD
         '''
+        if cache is not None:
+            from card.probe import capability_probe
+            return capability_probe(self, cache).probe_ins(self.CLA, start)
         ilist = []
         for i in range(start, 256):
             if self.dbg > 1: 
@@ -521,6 +632,8 @@ class ISO7816(object):
         Data: list of bytes describing the file identifier or address
         call sr_apdu method
         '''
+        # current DF is not known anymore
+        self.cur_DF = None
         if with_length:
             Data = [min(len(Data), 255)] + Data
         SELECT_FILE = [self.CLA, 0xA4, P1, P2] + Data
@@ -663,6 +776,54 @@ class ISO7816(object):
             UNBLOCK_CHV = [self.CLA, 0x2C, 0x00, P2, 0x10] + Data
         return self.sr_apdu(UNBLOCK_CHV) 
     
+    def STATUS(self, P1=0x00, P2=0x00, Le=0x00):
+        '''
+        APDU command to retrieve information on the current DF / application
+        
+        P1, P2: see ETSI TS 102.221 (not used by SIM)
+        Le: expected length of data
+        call sr_apdu method
+        '''
+        STATUS = [self.CLA, 0xF2, P1, P2, Le]
+        return self.sr_apdu(STATUS)
+    
+    def _CLA_SAT(self):
+        if self.CLA_SAT is None:
+            return self.CLA
+        return self.CLA_SAT
+    
+    def TERMINAL_PROFILE(self, Data=[]):
+        '''
+        APDU command to send the toolkit facilities supported by the terminal
+        
+        Data: list of bytes (see ETSI TS 102.223, section 5.2)
+        call sr_apdu method
+        '''
+        TERMINAL_PROFILE = [self._CLA_SAT(), 0x10, 0x00, 0x00, len(Data)] \
+                           + Data
+        return self.sr_apdu(TERMINAL_PROFILE)
+    
+    def FETCH(self, Le=0x00):
+        '''
+        APDU command to retrieve a proactive command, after 91 XX
+        
+        Le: length of the command (XX)
+        call sr_apdu method
+        '''
+        FETCH = [self._CLA_SAT(), 0x12, 0x00, 0x00, Le]
+        return self.sr_apdu(FETCH)
+    
+    def TERMINAL_RESPONSE(self, Data=[]):
+        '''
+        APDU command to send the result of a proactive command
+        
+        Data: list of bytes (see card.sat.terminal_response())
+        call sr_apdu method
+        '''
+        TERMINAL_RESPONSE = [self._CLA_SAT(), 0x14, 0x00, 0x00, len(Data)] \
+                            + Data
+        return self.sr_apdu(TERMINAL_RESPONSE)
+    
     ##########################
     # evolved "macro" method for ISO7816 card
     # need the "coms" attribute being an apdu_stack()
@@ -931,43 +1092,99 @@ class ISO7816(object):
         - list of bytes for EF transparent
         - list of list of bytes for cyclic or linear EF
         '''
+        # do not send READ commands which are known to fail
+        if not self.read_allowed(fil):
+            fil['Read Status'] = 'access denied (not attempted)'
+            return fil
+        
         # read EF transparent data
         if fil['Structure'] == 'transparent':
             self.coms.push( self.READ_BINARY(Le=fil['Size']) )
             if self.coms()[2] != (0x90, 0x00):
                 if self.dbg > 1: 
                     print '[DBG] %s' % self.coms()
+                self.read_denied(fil)
                 return fil
             fil['Data'] = self.coms()[3]
         
         # read EF cyclic / linear all records data
         elif fil['Structure'] != 'transparent':
             fil['Data'] = []
-            # for record data: need to check the number of recordings
-            # stored in the file, and iterate for each
-            for i in range( (fil['Size'] / fil['Record Length']) ):
-                self.coms.push( self.READ_RECORD(P1=i+1, P2=0x04, \
-                    Le=fil['Record Length']) )
-                if self.coms()[2] != (0x90, 0x00):
-                    # should mean there is an issue 
-                    # somewhere in the file parsing process
-                    if self.dbg:
-                        print '[WNG] error in iterating the RECORD parsing at' \
-                              ' iteration %s\n%s' % (i, self.coms())
-                    return fil
-                if self.coms()[3][1:] == len(self.coms()[3][1:]) * [255]:
+            for i, rec in self.iter_records(fil):
+                if rec[1:] == len(rec[1:]) * [255]:
                     # record is empty, contains padding only
                     pass
                 else: 
-                    fil['Data'].append(self.coms()[3])
+                    fil['Data'].append(rec)
+            if self.coms()[2] != (0x90, 0x00):
+                self.read_denied(fil)
         
         # return the [Data] for transparent or 
         # [[Record1],[Record2]...] for cyclic / linear
         return fil
     
-    def select(self, Data=[0x3F, 0x00], typ="fid", with_length=True):
+    def access_key(self, fil):
+        '''
+        access_key(fil) -> READ access condition of the file, or None
+        
+        to be overridden by the card classes which parse access conditions
+        '''
+        return None
+    
+    def read_allowed(self, fil):
+        '''
+        read_allowed(fil) -> bool
+        
+        tells if reading the EF can succeed, from its access condition
+        and the current verification state;
+        here, only the access conditions the card already denied
+        in this session are checked
+        '''
+        key = self.access_key(fil)
+        return key is None or key not in self.denied
+    
+    def read_denied(self, fil):
+        '''
+        records the file access condition as denied, when the last
+        READ command failed for a security reason
+        '''
+        if self.coms()[2] in self.denied_sw:
+            fil['Read Status'] = 'access denied'
+            key = self.access_key(fil)
+            if key is not None:
+                self.denied.add(key)
+    
+    def iter_records(self, fil):
+        '''
+        iter_records(fil) -> generator of (record number, list of bytes)
+        
+        reads the records of the currently selected EF 
+        with cyclic / linear structure, one by one, 
+        fil being its file dictionnary (e.g. from select(..., read=False))
+        
+        records are read in absolute mode, so other files can be selected 
+        between 2 iterations, as long as the EF is selected again
+        stops at the first reading error
+        '''
+        # for record data: need to check the number of recordings
+        # stored in the file, and iterate for each
+        for i in range( (fil['Size'] / fil['Record Length']) ):
+            self.coms.push( self.READ_RECORD(P1=i+1, P2=0x04, \
+                Le=fil['Record Length']) )
+            if self.coms()[2] != (0x90, 0x00):
+                # should mean there is an issue 
+                # somewhere in the file parsing process
+                if self.dbg:
+                    print '[WNG] error in iterating the RECORD parsing at' \
+                          ' iteration %s\n%s' % (i, self.coms())
+                return
+            yield i+1, self.coms()[3]
+    
+    @timed('select')
+    def select(self, Data=[0x3F, 0x00], typ="fid", with_length=True, 
+               read=True):
         '''
-        self.select(Data=[0x.., 0x..], typ="fid", with_length=True) 
+        self.select(Data=[0x.., 0x..], typ="fid", with_length=True, read=True) 
             -> dict(file) on success, None on error
         
         selects the file
@@ -975,6 +1192,7 @@ class ISO7816(object):
         if processing correct: gets response with info on the file
         if processing correct and EF file: reads the data in the file
             works in USIM fashion
+            (with read=False, the data is not read: see iter_records())
         else returns the data dictionnary: check parse_file_(U)SIM methods
         last apdu available from the attribute self.coms
         
@@ -1030,59 +1248,91 @@ class ISO7816(object):
         # take the `parse_file()' method from the instance:
         # ISO7816, UICC or SIM
         fil = self.parse_file(data)
-        if fil['Type'][0:2] == 'EF':
+        if read and fil['Type'][0:2] == 'EF':
             fil = self.read_EF(fil)
         
         # finally returns the whole file dictionnary, 
         # containing the ['Data'] key for EF file
         return fil
 
-    # TO BE TESTED #
-    # TO BE TESTED #
-    # TO BE TESTED #
-    # TO BE TESTED #
-    def update(self, file_record=[0x3F, 0x00], Data=[0x3F, 0x00], typ="fid", with_length=True):
-        # get the UICC trigger
-        is_UICC = isinstance(self, UICC)
-        
-        # handle type of selection:
-        if   typ == "pmf": P1 = 0x08
-        elif typ == "pdf": P1 = 0x09
-        elif typ == "aid": P1 = 0x04
-        # the case of selection by "fid":
-        else: P1 = 0x00 
+    def update(self, file_record=[0x3F, 0x00], Data=[], typ="fid", 
+               with_length=True, offset=0, record=None, select=True):
+        '''
+        self.update(file_record=[0x.., 0x..], Data=[0x.., ...], typ="fid", 
+                    with_length=True, offset=0, record=None, select=True)
+            -> list of (offset or record number, length, (sw1, sw2)),
+               or None if the file selection fails
+        
+        selects the EF file_record (see select() for typ and with_length),
+        unless select=False when the EF is already selected, 
+        and updates it with Data:
+        - transparent EF (record=None): Data is written from offset,
+          split in as many UPDATE BINARY as needed (255 bytes max each)
+        - linear fixed / cyclic EF: Data is written in the record number 
+          record; Data can also be a list of records, written in 
+          consecutive records from record on
+        the EF is selected once only, and writing stops at the first error
+        returns the status of each UPDATE command sent
+        '''
+        if select:
+            # get the UICC trigger
+            is_UICC = isinstance(self, UICC)
+            
+            # handle type of selection:
+            if   typ == "pmf": P1 = 0x08
+            elif typ == "pdf": P1 = 0x09
+            elif typ == "aid": P1 = 0x04
+            # the case of selection by "fid":
+            else: P1 = 0x00 
+            
+            # for UICC instance
+            # ask the return of the FCP template for the selected file:
+            if is_UICC:
+                P2 = 0x04
+            else:
+                P2 = 0x00
+            
+            # select file and check SW; if error, returns None
+            self.coms.push(self.SELECT_FILE(P1=P1, P2=P2, Data=file_record, \
+                with_length=with_length))
+            
+            # different SW codes for UICC and old ISO card (e.g. SIM)
+            if is_UICC and self.coms()[2][0] != 0x61 \
+            or not is_UICC and self.coms()[2][0] != 0x9F:
+                if self.dbg > 1: 
+                    print '[DBG] %s' % self.coms()
+                return None
         
-        # for UICC instance
-        # ask the return of the FCP template for the selected file:
-        if is_UICC:
-            P2 = 0x04
-        else:
-            P2 = 0x00
+        ret = []
+        # record-oriented update, in absolute mode
+        if record is not None:
+            if len(Data) > 0 and type(Data[0]) is list:
+                records = Data
+            else:
+                records = [Data]
+            for i in range(len(records)):
+                self.coms.push(self.UPDATE_RECORD(P1=record+i, P2=0x04, \
+                    Data=records[i]))
+                ret.append( (record+i, len(records[i]), self.coms()[2]) )
+                if self.coms()[2] != (0x90, 0x00):
+                    break
+        
+        # transparent update, offset is coded on 15 bits in P1-P2
+        elif offset + len(Data) <= 0x8000:
+            for i in range(0, len(Data), 255):
+                off = offset + i
+                self.coms.push(self.UPDATE_BINARY(P1=off >> 8, P2=off & 0xFF, \
+                    Data=Data[i:i+255]))
+                ret.append( (off, len(Data[i:i+255]), self.coms()[2]) )
+                if self.coms()[2] != (0x90, 0x00):
+                    break
         
-        # used to get back to MF without getting MF attributes:
-        if len(Data) == 0: 
-            P1, P2 = 0x00, 0x0C
-
-        # select file and check SW; if error, returns None, else get response
-        self.coms.push(self.SELECT_FILE(P1=P1, P2=P2, Data=file_record, \
-            with_length=with_length))
+        elif self.dbg:
+            print '[WNG] offset out of range: %s' % offset
         
-        # different SW codes for UICC and old ISO card (e.g. SIM)
-        if is_UICC and self.coms()[2][0] != 0x61 \
-        or not is_UICC and self.coms()[2][0] != 0x9F:
-            if self.dbg > 1: 
-                print '[DBG] %s' % self.coms()
-            return None
-
-        # get response and check SW: 
-        # if error, return None, else parse file info
-        self.coms.push(self.UPDATE_BINARY(Data=Data))
-        if self.coms()[2] != (0x90, 0x00):
-            if self.dbg > 1: 
-                print '[DBG] %s' % self.coms()
-            return None
-
-        return None
+        if self.dbg > 1 and len(ret) > 0 and ret[-1][2] != (0x90, 0x00):
+            print '[DBG] %s' % self.coms()
+        return ret
     
     #
     ###############
@@ -1177,6 +1427,8 @@ class ISO7816(object):
                               '%s %s' % (path, [i, j])
                     if 'File Identifier' in fil.keys():
                         fil['Absolut Path'] = path+fil['File Identifier']
+                        if self.image is not None:
+                            self.image.add(fil['Absolut Path'], fil)
                     FS.append(fil)
                     if 'Type' in fil.keys() and fil['Type'] == 'DF':
                         reinit()
@@ -1210,7 +1462,7 @@ class ISO7816(object):
         # recursive method call
         # DF contains absolut path
         for addr in DF:
-            print '[DBG] path: %s' % addr
+            log.debug('path: %s', addr)
             self.recu_files_bf(path=addr, under_AID=under_AID)
     
     @staticmethod
@@ -1222,13 +1474,15 @@ class ISO7816(object):
             fd.write('%s: %s\n' % (k, dict[k]))
         
         
-    def scan_fs(self, filename='card_fs', stdout=False):
+    def scan_fs(self, filename='card_fs', stdout=False, image=None):
         '''
-        bf_files_under_MF(self, output='card_fs', stdout=True)
+        bf_files_under_MF(self, output='card_fs', stdout=True, image=None)
             -> void
         
         filename: file to write found information in
         stdout: print information on stdout too
+        image: binary card image file (see card.image) to write found 
+            files in, as soon as they are found
         
         brute force all file addresses from MF and found AID
         recursively (until no more DF are found)
@@ -1237,9 +1491,17 @@ class ISO7816(object):
         WARNING: not very tested either...
         '''
         fd = open(filename, 'w')
+        if image is not None:
+            from card.image import image_writer
+            self.image = image_writer(image, self.ATR, self.reader)
         
         self.init_FS()
-        self.recu_files_bf()
+        try:
+            self.recu_files_bf()
+        finally:
+            if self.image is not None:
+                self.image.close()
+                self.image = None
         fd.write('\n### MF ###\n')
         for f in self.FS:
             self.__write_dict(f, fd)
@@ -1268,6 +1530,8 @@ class UICC(ISO7816):
     inherits (eventually overrides) methods and objects from ISO7816 class
     use self.dbg = 1 or more to print live debugging information
     '''
+    CLA_SAT = 0x80
+    
     AID_RID = {
         (0xA0, 0x00, 0x00, 0x00, 0x09): 'ETSI',
         (0xA0, 0x00, 0x00, 0x00, 0x87): '3GPP',
@@ -1355,15 +1619,28 @@ class UICC(ISO7816):
         ([0x7F, 0x90], 'DF', 'DF_TETRA'),
         ([0x7F, 0x31], 'DF', 'DF_iDEN'),
         ]
+    files_by_name = dict((f[2], f) for f in files)
+    files_by_fid = dict((tuple(f[0]), f[2]) for f in files)
     
-    def __init__(self):
+    # file-system trees used by select_by_name(), in lookup order
+    FS_trees = (USIM_FS_tree, )
+    
+    # key references of the user PIN (application, universal and second
+    # application PIN), as opposed to ADM codes
+    user_pins = tuple(range(0x01, 0x09)) + (0x11, ) + \
+                tuple(range(0x81, 0x89))
+    # PIN enabled, by key reference, from the PIN status of the last DF
+    # selected, see parse_pin_status()
+    PIN_enabled = None
+    
+    def __init__(self, cardservice=None, trace=None):
         '''
         initializes like an ISO7816-4 card with CLA=0x00
         and check available AID (Application ID) read from EF_DIR
         
         initializes on the MF
         '''
-        ISO7816.__init__(self, CLA=0x00)
+        ISO7816.__init__(self, CLA=0x00, cardservice=cardservice, trace=trace)
         self.AID = []
         
         if self.dbg:
@@ -1388,15 +1665,124 @@ class UICC(ISO7816):
         if 0xC6 in fil.keys():
             fil = self.parse_pin_status(fil[0xC6], fil)
             del fil[0xC6]
+            self.PIN_enabled = fil['PIN Enabled']
         
-        if 'File Identifier' in fil.keys():
-            for ref in self.files:
-                if fil['File Identifier'] == ref[0]:
-                    fil['Name'] = ref[2]
+        if 'File Identifier' in fil.keys() \
+        and tuple(fil['File Identifier']) in self.files_by_fid:
+            fil['Name'] = self.files_by_fid[tuple(fil['File Identifier'])]
         
         # return the enriched file 
         return fil
     
+    def access_key(self, fil):
+        '''
+        access_key(fil) -> security attributes of the file, or None
+        '''
+        for tag in ('Security Attributes compact',
+                    'Security Attributes ref to expanded'):
+            if tag in fil:
+                return (tag, tuple(fil[tag]))
+        return None
+    
+    def read_allowed(self, fil):
+        '''
+        read_allowed(fil) -> bool
+        
+        denies reading EF whose compact security attributes 
+        say READ is never allowed, or requires a user PIN while none
+        is verified in this session (unless the PIN status of the DF
+        tells all user PIN are disabled), or whose access condition 
+        was already denied in this session
+        '''
+        SA = fil.get('Security Attributes compact')
+        if SA and SA[0] & 0x01 and len(SA) > 1:
+            # the READ condition is the last one, for access mode bit 1
+            if SA[-1] == 0xFF:
+                return False
+            # security condition byte, bit 5: user authentication
+            if SA[-1] & 0x10 and not self.user_verified():
+                return False
+        return ISO7816.read_allowed(self, fil)
+    
+    def user_verified(self):
+        '''
+        user_verified() -> bool
+        
+        True when a user PIN is verified in this session, when all user 
+        PIN of the last DF selected are disabled, or when their status 
+        is not known
+        '''
+        for key_ref in self.user_pins:
+            if self.pin_status[key_ref] in self.verified:
+                return True
+        if self.PIN_enabled is None:
+            return True
+        return not [ k for (k, e) in self.PIN_enabled.items() \
+                     if e and k in self.user_pins ]
+    
+    def pin_attempts(self, key_ref=0x01):
+        '''
+        pin_attempts(key_ref=0x01) -> number of attempts remaining 
+            for the PIN, 0 if it does not need to be verified (disabled 
+            or already verified), or None on error
+        
+        uses VERIFY without data, which does not change the PIN state
+        '''
+        self.coms.push( self.VERIFY(P2=key_ref) )
+        sw1, sw2 = self.coms()[2]
+        if (sw1, sw2) == (0x90, 0x00):
+            return 0
+        if sw1 == 0x63 and sw2 & 0xF0 == 0xC0:
+            return sw2 & 0x0F
+        if self.dbg:
+            print '[DBG] %s' % self.coms()
+        return None
+    
+    def verify_pin(self, pin='', key_ref=0x01, force=False):
+        '''
+        verify_pin(pin='1234', key_ref=0x01, force=False) -> bool
+        
+        verifies the PIN (4 to 8 digits) with the given key reference 
+        (0x01: PIN of application 1, 0x11: universal PIN, see pin_status)
+        
+        like SIM.verify_pin(): the PIN is verified once per session,
+        VERIFY is not sent with a single attempt left unless force is
+        set, and the PIN is kept to verify it again after a reconnection
+        returns True when the PIN is verified
+        '''
+        if not (type(pin) is str and 4 <= len(pin) <= 8 and pin.isdigit()):
+            if self.dbg: 
+                print '[WNG] bad parameters'
+            return False
+        name = self.pin_status.get(key_ref, 'PIN %02X' % key_ref)
+        if name in self.verified:
+            return True
+        attempts = self.pin_attempts(key_ref)
+        if attempts == 0:
+            return True
+        if attempts is not None and attempts <= 1 and not force:
+            log.warning('%s: %s attempt(s) remaining, ' \
+                        'VERIFY not sent', name, attempts)
+            return False
+        PIN = [ord(i) for i in pin] + (8 - len(pin)) * [0xFF]
+        self.coms.push( self.VERIFY(P2=key_ref, Data=PIN) )
+        if self.coms()[2] != (0x90, 0x00):
+            if self.dbg: 
+                print '[DBG] %s' % self.coms()
+            return False
+        self.verified.add(name)
+        self.pins[key_ref] = pin
+        # access conditions may now be fulfilled
+        self.denied.clear()
+        return True
+    
+    def reconnected(self):
+        '''
+        verifies again the PIN verified before the card reconnection
+        '''
+        for key_ref, pin in self.pins.items():
+            self.verify_pin(pin, key_ref)
+    
     @staticmethod
     def parse_pin_status(Data, fil):
         '''
@@ -1407,6 +1793,9 @@ class UICC(ISO7816):
         PS_DO = Data[2:2+Data[1]]
         Data = Data[2+len(PS_DO):]
         PIN_status = ''
+        # PIN enabled, by key reference: the PS_DO bits (from the MSB)
+        # follow the order of the key references
+        PIN_enabled = {}
         while len(Data) > 0:
             [T, L, V] = first_TLV_parser(Data)
             assert( T in (0x83, 0x95) )
@@ -1428,6 +1817,9 @@ class UICC(ISO7816):
                 elif  V[0] == 0: 
                     PIN_status += '#verification not required: '
             elif T == 0x83: # PIN status
+                i = len(PIN_enabled)
+                if i < 8*len(PS_DO):
+                    PIN_enabled[V[0]] = bool(PS_DO[i/8] & (0x80 >> (i%8)))
                 if len(PIN_status) == 0: PIN_status = '#'
                 if 0x00 <  V[0] < 0x12 or   0x81 <= V[0] < 0x90: 
                     PIN_status += UICC.pin_status[V[0]] + '#'
@@ -1441,6 +1833,7 @@ class UICC(ISO7816):
             #    print '[DBG] %s: %s; PIN status: %s' % (T, V, PIN_status)
             Data = Data[L+2:]
         fil['PIN Status'] = PIN_status
+        fil['PIN Enabled'] = PIN_enabled
         return fil
     
     def get_AID(self):
@@ -1468,6 +1861,9 @@ class UICC(ISO7816):
             and rec[4:4+rec[3]] not in self.AID:
                 self.AID.append( rec[4:4+rec[3]] )
         
+        # interpreting the AID is only needed for logging them
+        if not log.isEnabledFor(INFO):
+            return
         i = 1
         for aid in self.AID:
             aid_rid = tuple(aid[0:5])
@@ -1490,9 +1886,9 @@ class UICC(ISO7816):
             if aid_country in self.AID_country_code.keys(): 
                 aid_country = self.AID_country_code[aid_country]
             
-            print 'found [AID %s] %s || %s || %s || %s || %s' \
-                  % (i, aid_rid, aid_app, aid_country, \
-                     aid_provider, tuple(aid[11:]) )
+            log.info('found [AID %s] %s || %s || %s || %s || %s',
+                     i, aid_rid, aid_app, aid_country,
+                     aid_provider, tuple(aid[11:]))
             i += 1
     
     def get_ICCID(self):
@@ -1509,15 +1905,27 @@ class UICC(ISO7816):
             print '[DBG] EF_ICCID: %s' % EF_ICCID
         if EF_ICCID is None: 
             return None
+        self.ICCID = decode_iccid( EF_ICCID['Data'] )
         return decode_BCD( EF_ICCID['Data'] )
     
-    def select_by_name(self, name=''):
-        '''
-        AID selection by name taken from UICC.files
-        '''
-        for i in range(len(self.files)):
-            if name == self.files[i][2]:
-                return self.select( self.files[i][0], 'pmf' )
+    def select_by_name(self, name='', read=True):
+        '''
+        file selection by name taken from UICC.files, 
+        or else from the file-system trees in self.FS_trees
+        
+        uses a single SELECT by path from MF
+        '''
+        if name in self.files_by_name:
+            return self.select( self.files_by_name[name][0], 'pmf', read=read )
+        for tree in self.FS_trees:
+            node = tree.get(name)
+            if node is None:
+                continue
+            if node.type == 'MF':
+                return self.select( list(node.fid), read=read )
+            return self.select( node.pmf, 'pmf', read=read )
+        if self.dbg:
+            print '[WNG] unknown file name: %s' % name
     
     def select_by_aid(self, aid_num=1):
         '''
@@ -28,8 +28,12 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 
 from binascii import *
 from card.ICC import ISO7816
-from card.FS import SIM_FS
+from card.FS import SIM_FS, SIM_FS_tree
+from card.codec import decode_iccid, decode_imsi, decode_lai, \
+     decode_number, decode_plmn_list
+from card.provision import provision
 from card.utils import *
+from card.log import log, timed
 from time import sleep
 
 
@@ -43,13 +47,23 @@ class SIM(ISO7816):
     '''
 
     caller = None
+    # SW returned when an access condition is not fulfilled
+    denied_sw = ((0x98, 0x04), (0x98, 0x40))
+    # CHV1 enabled, from the last DF characteristics read, None if unknown
+    CHV1_enabled = None
     
-    def __init__(self):
+    # file-system trees used for selection by name
+    FS_trees = (SIM_FS_tree, )
+    
+    def __init__(self, cardservice=None, trace=None):
         '''
         initialize like an ISO7816-4 card with CLA=0xA0
         can also be used for USIM working in SIM mode,
         '''
-        ISO7816.__init__(self, CLA=0xA0)
+        ISO7816.__init__(self, CLA=0xA0, cardservice=cardservice,
+                         trace=trace)
+        # codes verified in this session, by CHV number, see verify_pin()
+        self.pins = {}
         if self.dbg:
             print '[DBG] type definition: %s' % type(self)
             print '[DBG] CLA definition: %s' % hex(self.CLA)
@@ -119,18 +133,96 @@ class SIM(ISO7816):
             elif sw2 == 0x63: status += ': security session expired'
         return status
     
-    def verify_pin(self, pin='', pin_type=1):
+    def access_key(self, fil):
+        return fil.get('READ')
+    
+    def read_allowed(self, fil):
+        '''
+        read_allowed(fil) -> bool
+        
+        checks the READ access condition of the EF against 
+        the codes verified in this session:
+            ALW: allowed, NEW: never allowed,
+            CHV1: allowed if verified, or CHV1 is known to be disabled,
+            CHV2 / ADM_x: allowed if verified
+        and against the access conditions already denied by the card
+        '''
+        cond = fil.get('READ')
+        if cond == 'NEW':
+            return False
+        if cond in ('CHV2', 'ADM_4', 'ADM_5', 'ADM_6', 'ADM_7', 'ADM_8', 
+                    'ADM_9', 'ADM_A', 'ADM_B', 'ADM_C', 'ADM_D', 'ADM_E') \
+        and cond not in self.verified:
+            return False
+        if cond == 'CHV1' and self.CHV1_enabled \
+        and cond not in self.verified:
+            return False
+        return ISO7816.read_allowed(self, fil)
+    
+    def pin_attempts(self, pin_type=1):
+        '''
+        pin_attempts(pin_type=1) -> number of attempts remaining 
+            for CHV1 or CHV2, or None on error
+        
+        reads them from the current DF characteristics, with STATUS
+        (which does not change the selection)
+        '''
+        self.coms.push( self.STATUS(Le=0x16) )
+        data = self.coms()[3]
+        if self.coms()[2] != (0x90, 0x00) or len(data) < 21:
+            if self.dbg: 
+                print '[DBG] %s' % self.coms()
+            return None
+        self.CHV1_enabled = not data[13] & 0x80
+        return data[16 + 2*pin_type] & 0x0F
+    
+    def verify_pin(self, pin='', pin_type=1, force=False):
         '''
+        verify_pin(pin='1234', pin_type=1, force=False) -> bool
+        
         verify CHV1 (PIN code) or CHV2 with VERIFY APDU command
         call ISO7816 VERIFY method
+        
+        the code is verified once per session: VERIFY is not sent again 
+        once it succeeded (nor for CHV1 when it is disabled)
+        the remaining attempts are checked before: with a single one 
+        left, VERIFY is not sent (a wrong code would block the card), 
+        unless force is set
+        the code is kept to verify it again after a reconnection
+        returns True when the code is verified
         '''
-        if pin_type in [1, 2] and type(pin) is str and \
-        len(pin) == 4 and 0 <= int(pin) < 10000:
-            PIN = [ord(i) for i in pin] + [0xFF, 0xFF, 0xFF, 0xFF]
-            self.coms.push( self.VERIFY(P2=pin_type, Data=PIN) )
-        else: 
+        if not (pin_type in [1, 2] and type(pin) is str and \
+        len(pin) == 4 and pin.isdigit()):
             if self.dbg: 
                 print '[WNG] bad parameters'
+            return False
+        if 'CHV%d' % pin_type in self.verified:
+            return True
+        attempts = self.pin_attempts(pin_type)
+        if pin_type == 1 and self.CHV1_enabled is False:
+            return True
+        if attempts is not None and attempts <= 1 and not force:
+            log.warning('CHV%d: %s attempt(s) remaining, ' \
+                        'VERIFY not sent', pin_type, attempts)
+            return False
+        PIN = [ord(i) for i in pin] + [0xFF, 0xFF, 0xFF, 0xFF]
+        self.coms.push( self.VERIFY(P2=pin_type, Data=PIN) )
+        if self.coms()[2] != (0x90, 0x00):
+            if self.dbg: 
+                print '[DBG] %s' % self.coms()
+            return False
+        self.verified.add('CHV%d' % pin_type)
+        self.pins[pin_type] = pin
+        # access conditions may now be fulfilled
+        self.denied.clear()
+        return True
+    
+    def reconnected(self):
+        '''
+        verifies again the codes verified before the card reconnection
+        '''
+        for pin_type, pin in self.pins.items():
+            self.verify_pin(pin, pin_type)
     
     def disable_pin(self, pin='', pin_type=1):
         '''
@@ -143,6 +235,8 @@ class SIM(ISO7816):
         len(pin) == 4 and 0 <= int(pin) < 10000:
             PIN = [ord(i) for i in pin] + [0xFF, 0xFF, 0xFF, 0xFF]
             self.coms.push( self.DISABLE_CHV(P2=pin_type, Data=PIN) )
+            if self.coms()[2] == (0x90, 0x00) and pin_type == 1:
+                self.CHV1_enabled = False
         else:
             if self.dbg: 
                 print '[WNG] bad parameters'
@@ -172,6 +266,31 @@ class SIM(ISO7816):
                 print '[WNG] bad parameters'
             #return self.UNBLOCK_CHV(P2=pin_type)
     
+    def select_by_name(self, name='', read=True):
+        '''
+        self.select_by_name('EF_IMSI', read=True) 
+            -> dict(file) on success, None on error
+        
+        selects a file by its name taken from SIM_FS, 
+        with the shortest chain of SELECT commands from the current DF
+        with read=False, the content of the EF is not read
+        '''
+        node = SIM_FS_tree.get(name)
+        if node is None:
+            if self.dbg:
+                print '[WNG] unknown file name: %s' % name
+            return None
+        for fid in SIM_FS_tree.select_sequence(node, self.cur_DF):
+            fil = self.select(fid, read=read)
+            if fil is None:
+                return None
+        # the DF stays current after selecting an EF
+        if node.type == 'EF':
+            self.cur_DF = node.parent
+        else:
+            self.cur_DF = node
+        return fil
+    
     def parse_file(self, Data=[]):
         '''
         parse_file(Data=[0x12, 0x34, 0x56, 0x89]) -> dict(file)
@@ -204,6 +323,9 @@ class SIM(ISO7816):
                                 + ': %d attempts remain' % (Data[21] & 0x0F)
             if len(Data) > 23: 
                 fil['Adm'] = Data[23:]
+            # file characteristics, bit 8: CHV1 disabled
+            fil['CHV1 enabled'] = not Data[13] & 0x80
+            self.CHV1_enabled = fil['CHV1 enabled']
         elif fil['Type'] == 'EF':
             cond = ('ALW', 'CHV1', 'CHV2', 'RFU', 'ADM_4', 'ADM_5', 
                     'ADM_6', 'ADM_7', 'ADM_8', 'ADM_9', 'ADM_A',
@@ -226,6 +348,7 @@ class SIM(ISO7816):
                 fil['Record Length'] = Data[14]
         return fil
     
+    @timed('run_gsm_alg')
     def run_gsm_alg(self, RAND=16*[0x00]):
         '''
         self.run_gsm_alg( RAND ) -> ( SRES, Kc )
@@ -242,9 +365,9 @@ class SIM(ISO7816):
             if self.dbg: 
                 print '[WNG] needs a 16 bytes input RAND value'
             return None
-        # select DF_GSM directory
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
+        # select DF_GSM directory, if not already there
+        if self.cur_DF is not SIM_FS_tree.get('DF_GSM') \
+        and self.select_by_name('DF_GSM') is None:
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -263,6 +386,7 @@ class SIM(ISO7816):
         SRES, Kc = self.coms()[3][0:4], self.coms()[3][4:]
         return [ SRES, Kc ]
     
+    @timed('get_imsi')
     def get_imsi(self):
         '''
         self.get_imsi() -> string(IMSI)
@@ -270,16 +394,9 @@ class SIM(ISO7816):
         reads IMSI value at address [0x6F, 0x07]
         returns IMSI string on success or None on error
         '''
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select IMSI file
-        imsi = self.select([0x6F, 0x07])
-        if self.coms()[2] != (0x90, 0x00): 
+        imsi = self.select_by_name('EF_IMSI')
+        if imsi is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -294,16 +411,9 @@ class SIM(ISO7816):
         return None
 
     def get_Kc(self):
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select Kc file
-        Kc = self.select([0x6F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
+        Kc = self.select_by_name('EF_Kc')
+        if Kc is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -313,16 +423,9 @@ class SIM(ISO7816):
         return None
 
     def get_loci(self):
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select TMSI, MCC, MNC, LAC from file which is 11 bytes = loci
-        loci = self.select([0x6F, 0x7E])
-        if self.coms()[2] != (0x90, 0x00): 
+        loci = self.select_by_name('EF_LOCI')
+        if loci is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -333,15 +436,8 @@ class SIM(ISO7816):
             return None
 
     def get_subscr_sim_plmnsel(self):
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
-        plmnsel = self.select([0x6F, 0x30])      
-        if self.coms()[2] != (0x90, 0x00): 
+        plmnsel = self.select_by_name('EF_PLMNsel')
+        if plmnsel is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -352,16 +448,9 @@ class SIM(ISO7816):
             return None    
 
     def get_subscr_sim_hplmn(self):
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select hplmn = 1 byte
-        hplmn = self.select([0x6F, 0x31])     
-        if self.coms()[2] != (0x90, 0x00): 
+        hplmn = self.select_by_name('EF_HPPLMN')
+        if hplmn is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -372,33 +461,22 @@ class SIM(ISO7816):
             return None
 
     def get_subscr_iccid(self):
-        self.select([0x3F, 0x00])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
         # select iccid = 10 bytes
-        iccid = self.select([0x2F, 0xE2])
-        if self.coms()[2] != (0x90, 0x00): 
+        iccid = self.select_by_name('EF_ICCID')
+        if iccid is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
 
         if 'Data' in iccid.keys() and len(iccid['Data']) == 10:
+            self.ICCID = decode_iccid(iccid['Data'])
             return iccid['Data']
         else:
             return None
 
     def get_subscr_sim_spn(self):
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select spn = 17 bytes 0x6f46
-        spn = self.select([0x6F, 0x46])
+        spn = self.select_by_name('EF_SPN')
         if spn == None: 
             return []
 
@@ -408,16 +486,9 @@ class SIM(ISO7816):
             return []
 
     def get_subscr_sim_acc(self):
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select acc = 17 bytes 0x6f78 2 bytes
-        acc = self.select([0x6F, 0x78])
-        if self.coms()[2] != (0x90, 0x00): 
+        acc = self.select_by_name('EF_ACC')
+        if acc is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -428,16 +499,9 @@ class SIM(ISO7816):
             return None
 
     def get_subscr_sim_fplmn(self):
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select fplmn = 17 bytes 0x6f7b 2 bytes
-        fplmn = self.select([0x6F, 0x7b])
-        if self.coms()[2] != (0x90, 0x00): 
+        fplmn = self.select_by_name('EF_FPLMN')
+        if fplmn is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -448,16 +512,9 @@ class SIM(ISO7816):
             return None
 
     def get_subscr_sim_msisdn(self):
-        # select DF_TELECOM for SIM card = 0x7f10
-        self.select([0x7F, 0x10])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select msisdn = 17 bytes 0x6f40 2 bytes
-        msisdn = self.select([0x6F, 0x40])
-        if self.coms()[2] != (0x90, 0x00): 
+        msisdn = self.select_by_name('EF_MSISDN')
+        if msisdn is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -468,16 +525,9 @@ class SIM(ISO7816):
             return None
 
     def get_subscr_smsp(self):
-        # select DF_TELECOM for SIM card = 0x7f10
-        self.select([0x7F, 0x10])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
         # select smsp = 0x6f42 = (28 + n) bytes n+14 to n+24 = 12 bytes
-        smsp = self.select([0x6F, 0x42])
-        if self.coms()[2] != (0x90, 0x00): 
+        smsp = self.select_by_name('EF_SMSP')
+        if smsp is None or self.coms()[2] != (0x90, 0x00): 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None        
@@ -488,40 +538,23 @@ class SIM(ISO7816):
             return None
 
     def run_gsm_algorithm(self, RAND):
-        print RAND
-        print "We are going to wait for 2 seconds===================="
+        log.debug('RAND: %s', RAND)
+        log.debug('waiting for 2 seconds')
         sleep(2)
-        print "Done waiting========================================"
         response = self.run_gsm_alg(stringToByte(a2b_hex(RAND)))
         SRES = response[0]
         Kc = response[1]
-        print Kc
         Kc.append(0)
-        print Kc
-        print b2a_hex(byteToString(Kc))
+        log.debug('Kc: %s', Kc)
         ALGO_RESP = SRES + Kc
-        print ALGO_RESP
+        log.debug('SRES || Kc: %s', ALGO_RESP)
         return ALGO_RESP
 
     def write_subscr_Kc(self, Data):
         Data =  stringToByte(a2b_hex(Data))
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-
-        # select Kc to write
-        self.select([0x6F, 0x20])        
-        if self.coms()[2] != (0x90, 0x00):
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
-        # update Kc
-        self.update([0x6F, 0x20], Data)
-        if self.coms()[2] != (0x90, 0x00): 
+        # update Kc, only the bytes which differ are written
+        report = provision(self, {'EF_Kc': Data})[0]
+        if report['status'] == 'error': 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -530,23 +563,10 @@ class SIM(ISO7816):
 
     def write_subscr_loci(self, Data):
         Data = stringToByte(a2b_hex(Data))
-        # select DF_GSM for SIM card
-        self.select([0x7F, 0x20])
-        if self.coms()[2] != (0x90, 0x00): 
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-
-        # select TMSI, MCC, MNC, LAC from file which is 11 bytes = loci to write
-        self.select([0x6F, 0x7E])        
-        if self.coms()[2] != (0x90, 0x00):
-            if self.dbg: 
-                print '[DBG] %s' % self.coms()
-            return None
-        
-        # update TMSI, MCC, MNC, LAC from file which is 11 bytes = loci
-        self.update([0x6F, 0x7E], Data)
-        if self.coms()[2] != (0x90, 0x00): 
+        # update TMSI, MCC, MNC, LAC from file which is 11 bytes = loci,
+        # only the bytes which differ are written
+        report = provision(self, {'EF_LOCI': Data})[0]
+        if report['status'] == 'error': 
             if self.dbg: 
                 print '[DBG] %s' % self.coms()
             return None
@@ -563,16 +583,14 @@ class SIM(ISO7816):
         print loci
         TMSI, LAI, TMSI_TIME, LOC_UPDATE_STATUS = loci[0:4], loci[4:9], loci[9], loci[10]        
         print "Stored TMSI:\t\t\t\t%s \n" % b2a_hex(byteToString(TMSI))
-        MCC = ((LAI[0] & 0x0f) << 8) | (LAI[0] & 0xf0) | (LAI[1] & 0x0f)
-        MNC = ((LAI[2] & 0x0f) << 8) | (LAI[2] & 0xf0) | ((LAI[1] & 0xf0) >> 4)
-        LAC = LAI[3:5]
-        print "Stored LAI (MCC, MNC, LAC):\t\t(%s, %s, %s) \n" % (format(int(hex(MCC),16),"x"), format(int(hex(MNC),16),"x"), b2a_hex(byteToString(LAC)))
+        MCC, MNC, LAC = decode_lai(LAI)
+        print "Stored LAI (MCC, MNC, LAC):\t\t(%s, %s, %04x) \n" % (MCC, MNC, LAC)
         print "Stored TMSI time:\t\t\t%s\n" % b2a_hex(byteToString([TMSI_TIME]))
         print "Location Update Status:\t\t\t%s\n" % b2a_hex(byteToString([LOC_UPDATE_STATUS]))
 
         imsi = self.get_imsi()
         print imsi
-        print "Stored IMSI:\t\t\t\t%s\n" % decode_BCD(imsi)[3:]
+        print "Stored IMSI:\t\t\t\t%s\n" % decode_imsi(imsi)
 
         hplmn = self.get_subscr_sim_hplmn()
         print hplmn
@@ -581,23 +599,12 @@ class SIM(ISO7816):
         plmnsel = self.get_subscr_sim_plmnsel()
         print plmnsel
         print "Stored PLMN selector:\t\t\tMCC | MNC\n"
-        index = 0
-        while len(plmnsel) > 3 and index < len(plmnsel):
-            if plmnsel[index] == 0xFF and plmnsel[index+1] == 0xFF and plmnsel[index+2] == 0xFF:
-                break
-            else:
-                MCC = ((plmnsel[index] & 0x0f) << 8) | (plmnsel[index] & 0xf0) | (plmnsel[index+1] & 0x0f)
-                MNC = ((plmnsel[index+2] & 0x0f) << 8) | (plmnsel[index+2] & 0xf0) | ((plmnsel[index+1] & 0xf0) >> 4)
-                if (MNC & 0x000f) == 0x000f:
-                    MNC = MNC >> 4
-                    print "\t\t\t\t\t%03x   %02x" %(MCC, MNC)
-                else:                   
-                    print "\t\t\t\t\t%03x   %03x" %(MCC, MNC)
-                index +=3
+        for MCC, MNC in decode_plmn_list(plmnsel):
+            print "\t\t\t\t\t%s   %s" %(MCC, MNC)
 
         iccid = self.get_subscr_iccid()
         print iccid
-        print "\nICCID:\t\t\t\t\t%s\n" % decode_BCD(iccid)[:-2]
+        print "\nICCID:\t\t\t\t\t%s\n" % decode_iccid(iccid)
 
         spn = self.get_subscr_sim_spn()
         print spn
@@ -609,21 +616,20 @@ class SIM(ISO7816):
 
         fplmn = self.get_subscr_sim_fplmn()
         print fplmn
-        fplmn_str = b2a_hex(byteToString(fplmn))
-        fplmn_str = ' '.join(fplmn_str[i:i+6] for i in xrange(0,len(fplmn_str),6))
-        print "Forbidden PLMN (FFFFFF => not used):\t%s\n" %fplmn_str
+        fplmn_str = ' '.join(['%s-%s' % plmn for plmn in decode_plmn_list(fplmn)])
+        print "Forbidden PLMN (MCC-MNC):\t\t%s\n" %fplmn_str
 
         smsp = self.get_subscr_smsp()
         print smsp
-        length = len(smsp) - 28
-        start = length + 15
-        end = start + 6
-        smsp_str = decode_BCD(smsp[start:end])[:-2]
-        print "SMSP: \t\t\t\t\t+%s\n" %smsp_str
+        # service centre address, after the alpha identifier and TP-DA
+        start = len(smsp) - 28 + 13
+        sca = decode_number(smsp[start:start+12])
+        print "SMSP: \t\t\t\t\t%s\n" % (sca and sca[2] or '')
 
         msisdn = self.get_subscr_sim_msisdn()
         name_len = len(msisdn) - 14
-        print "MSISDN phone number \t\t\t+%s\n" % decode_BCD(msisdn[name_len+2:name_len+8])[:-2]
+        number = decode_number(msisdn[name_len:name_len+12])
+        print "MSISDN phone number \t\t\t%s\n" % (number and number[2] or '')
 
 
         print "Running GSM Algorithm:"
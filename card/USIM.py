@@ -31,6 +31,8 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 from card.ICC import UICC, ISO7816
 from card.FS import *
 from card.utils import *
+from card.codec import decode_imsi
+from card.log import log, timed
 
 
 class USIM(UICC):
@@ -42,7 +44,10 @@ class USIM(UICC):
     use self.dbg = 1 or more to print live debugging information
     '''
     
-    def __init__(self):
+    # USIM application files are looked up first, under the current ADF
+    FS_trees = (USIM_app_FS_tree, USIM_FS_tree)
+    
+    def __init__(self, cardservice=None, trace=None):
         '''
         initializes like an ISO7816-4 card with CLA=0x00
         and checks available AID (Application ID) read from EF_DIR
@@ -50,24 +55,28 @@ class USIM(UICC):
         initializes on the MF
         '''
         # initialize like a UICC
-        ISO7816.__init__(self, CLA=0x00)
+        ISO7816.__init__(self, CLA=0x00, cardservice=cardservice,
+                         trace=trace)
         self.AID = []
+        # parsed EF_GBABP / EF_GBANL, filled by load_GBA()
+        self.GBA_index = None
         if self.dbg:
             print '[DBG] type definition: %s' % type(self)
             print '[DBG] CLA definition: %s' % hex(self.CLA)
         
         # USIM selection from AID
-        print '[+] UICC AID found:'
+        log.info('[+] UICC AID found:')
         self.get_AID()
         for aid in self.AID:
             if  tuple(aid[0:5]) == (0xA0, 0x00, 0x00, 0x00, 0x87) \
             and tuple(aid[5:7]) == (0x10, 0x02) :
                 usim = self.select( Data=aid, typ='aid')
                 if usim is None: 
-                    print '[+] USIM AID selection failed'
+                    log.warning('[+] USIM AID selection failed')
                 else: 
-                    print '[+] USIM AID selection succeeded\n'
+                    log.info('[+] USIM AID selection succeeded')
         
+    @timed('get_imsi')
     def get_imsi(self):
         '''
         get_imsi() -> string(IMSI)
@@ -81,7 +90,7 @@ class USIM(UICC):
             return None
         # and parse the received data into the IMSI structure
         if 'Data' in imsi.keys() and len(imsi['Data']) == 9:
-            return decode_BCD(imsi['Data'])[3:]
+            return decode_imsi(imsi['Data'])
         
         # if issue with the content of the DF_IMSI file
         if self.dbg: 
@@ -103,7 +112,8 @@ class USIM(UICC):
                 KSI, CK, IK = ( EF_KEYS['Data'][0:1],
                                 EF_KEYS['Data'][1:17],
                                 EF_KEYS['Data'][17:33])
-                print '[+] Successful CS keys selection: Get [KSI, CK, IK]'
+                log.debug('[+] Successful CS keys selection: '
+                          'Get [KSI, CK, IK]')
                 return [KSI, CK, IK]
             else: 
                 return EF_KEYS
@@ -124,7 +134,8 @@ class USIM(UICC):
                 KSI, CK, IK = ( EF_KEYSPS['Data'][0:1], 
                                 EF_KEYSPS['Data'][1:17], 
                                 EF_KEYSPS['Data'][17:33] )
-                print '[+] Successful PS keys selection: Get [KSI, CK, IK]'
+                log.debug('[+] Successful PS keys selection: '
+                          'Get [KSI, CK, IK]')
                 return [KSI, CK, IK]
             else: 
                 return EF_KEYSPS
@@ -145,8 +156,8 @@ class USIM(UICC):
         if self.coms()[2] == (0x90, 0x00):
             if len(EF_GBABP['Data']) > 2:
                 #RAND, B_TID, Lifetime = LV_parser( EF_GBABP['Data'] )
-                print '[+] Successful GBA_BP selection: Get list of ' \
-                      '[RAND, B-TID, KeyLifetime]'
+                log.debug('[+] Successful GBA_BP selection: Get list of '
+                          '[RAND, B-TID, KeyLifetime]')
                 #return (RAND, B_TID, Lifetime)
                 return LV_parser( EF_GBABP['Data'] )
             else: 
@@ -167,7 +178,7 @@ class USIM(UICC):
         GBA_BP = self.get_GBA_BP()
         for i in GBA_BP:
             if i == RAND:
-                print '[+] RAND found in GBA_BP'
+                log.debug('[+] RAND found in GBA_BP')
                 # update transparent file with B_TID and key lifetime
                 self.coms.push( self.UPDATE_BINARY( P2=len(RAND)+1,
                                 Data=[len(B_TID)] + B_TID + \
@@ -202,27 +213,61 @@ class USIM(UICC):
                 values = []
                 
                 for rec in EF_GBANL['Data']:
-                    NAF_ID, B_TID = [], []
-                    while len(rec) > 0:
-                        tlv = first_TLV_parser( rec )
-                        if tlv[1] > 0xFF:
-                            rec = rec[ tlv[1]+4 : ]
-                        else:
-                            rec = rec[ tlv[1]+2 : ]
-                        if tlv[0] == 0x80: 
-                            NAF_ID = tlv[2]
-                        elif tlv[0] == 0x81: 
-                            B_TID = tlv[2]
-                    values.append( [NAF_ID, B_TID] )
+                    tlv = dict( (T, V) for (T, L, V) in TLV_parser(rec) )
+                    values.append( [tlv.get(0x80, []), tlv.get(0x81, [])] )
                 
-                print '[+] Successful GBA_NL selection: ' \
-                      'Get list of [NAF_ID, B-TID]'
+                log.debug('[+] Successful GBA_NL selection: '
+                          'Get list of [NAF_ID, B-TID]')
                 #return (NAF_ID, B_TID)
                 return values
             else: 
                 return EF_GBANL
         return None
     
+    def load_GBA(self):
+        '''
+        load_GBA() -> dict(GBA index) or None on error
+        
+        reads EF_GBABP and EF_GBANL once, and keeps them parsed in memory
+        in self.GBA_index:
+            'BP': [RAND, B-TID, KeyLifetime]
+            'NL': {tuple(NAF_ID): B-TID}
+        further lookups with lookup_GBA_NL() do not re-read the card
+        '''
+        BP = self.get_GBA_BP()
+        NL = self.get_GBA_NL()
+        if type(BP) is not list or type(NL) is not list:
+            return None
+        self.GBA_index = {
+            'BP': BP,
+            'NL': dict( (tuple(NAF_ID), B_TID) for (NAF_ID, B_TID) in NL ),
+            }
+        return self.GBA_index
+    
+    def lookup_GBA_NL(self, NAF_ID=[]):
+        '''
+        lookup_GBA_NL(NAF_ID) -> B-TID (list of bytes) or None
+        
+        looks up the B-TID associated with NAF_ID in the in-memory index
+        of EF_GBANL; the card is read only once, on the first lookup
+        '''
+        if self.GBA_index is None and self.load_GBA() is None:
+            return None
+        return self.GBA_index['NL'].get(tuple(NAF_ID))
+    
+    def _internal_auth(self, P2, inp):
+        '''
+        runs INTERNAL AUTHENTICATE and the following GET RESPONSE
+        returns the response bytes on success, or None on error
+        '''
+        self.coms.push( self.INTERNAL_AUTHENTICATE(P2=P2, Data=inp) )
+        if self.coms()[2][0] in (0x9F, 0x61):
+            self.coms.push( self.GET_RESPONSE(Le=self.coms()[2][1]) )
+            if self.coms()[2] == (0x90, 0x00):
+                return self.coms()[3]
+        return None
+    
+    @timed('authenticate')
     def authenticate(self, RAND=[], AUTN=[], ctx='3G'):
         '''
         self.authenticate(RAND, AUTN, ctx='3G') -> [key1, key2...], 
@@ -251,10 +296,10 @@ class USIM(UICC):
             P2 = 0x81
         elif ctx == 'VGCS':
             P2 = 0x82
-            print '[+] Not implemented. Exit.'
+            log.warning('[+] Not implemented. Exit.')
             return None
         elif ctx == 'MBMS':
-            print '[+] Not implemented. Exit.'
+            log.warning('[+] Not implemented. Exit.')
             return None
         elif ctx == 'GBA': 
             P2 = 0x84
@@ -271,32 +316,29 @@ class USIM(UICC):
             # override input value for 2G authent
             inp = [len(RAND)] + RAND
             
-        self.coms.push( self.INTERNAL_AUTHENTICATE(P2=P2, Data=inp) )
-        if self.coms()[2][0] in (0x9F, 0x61):
-            self.coms.push( self.GET_RESPONSE(Le=self.coms()[2][1]) )
-            if self.coms()[2] == (0x90, 0x00):
-                val = self.coms()[3]
-                if P2 == 0x80:
-                    if self.dbg: 
-                        print '[+] Successful 2G authentication. Get [RES, Kc]'
-                    values = LV_parser(val)
-                    # returned values are (RES, Kc)
-                    return values
-                # not adapted to 2G context with Kc, RES: to be confirmed...
-                if val[0] == 0xDB:
-                    if P2 == 0x81 and self.dbg: 
-                        print '[+] Successful 3G authentication. ' \
-                              'Get [RES, CK, IK(, Kc)]' 
-                    elif P2 == 0x84 and self.dbg: 
-                        print '[+] Successful GBA authentication. Get [RES]'
-                    values = LV_parser(val[1:])
-                    # returned values can be (RES, CK, IK) or (RES, CK, IK, Kc)
-                    return values
-                elif val[0] == 0xDC:
-                    if self.dbg: 
-                        print '[+] Synchronization failure. Get [AUTS]'
-                    values = LV_parser(val[1:])
-                    return values
+        val = self._internal_auth(P2, inp)
+        if val is not None:
+            if P2 == 0x80:
+                if self.dbg: 
+                    print '[+] Successful 2G authentication. Get [RES, Kc]'
+                values = LV_parser(val)
+                # returned values are (RES, Kc)
+                return values
+            # not adapted to 2G context with Kc, RES: to be confirmed...
+            if val[0] == 0xDB:
+                if P2 == 0x81 and self.dbg: 
+                    print '[+] Successful 3G authentication. ' \
+                          'Get [RES, CK, IK(, Kc)]' 
+                elif P2 == 0x84 and self.dbg: 
+                    print '[+] Successful GBA authentication. Get [RES]'
+                values = LV_parser(val[1:])
+                # returned values can be (RES, CK, IK) or (RES, CK, IK, Kc)
+                return values
+            elif val[0] == 0xDC:
+                if self.dbg: 
+                    print '[+] Synchronization failure. Get [AUTS]'
+                values = LV_parser(val[1:])
+                return values
         #else:
         if self.dbg: 
             print '[+] authentication error: %s' % self.coms()
@@ -327,33 +369,60 @@ class USIM(UICC):
         P2 = 0x84
         inp = [0xDE] + [len(NAF_ID)] + NAF_ID + [len(IMPI)] + IMPI
         
-        self.coms.push( self.INTERNAL_AUTHENTICATE(P2=P2, Data=inp) )
-        if self.coms()[2][0] in (0x9F, 0x61):
-            self.coms.push( self.GET_RESPONSE(Le=self.coms()[2][1]) )
-            if self.coms()[2] == (0x90, 0x00):
-                val = self.coms()[3]
-                if val[0] == 0xDB: # not adapted to 2G context with Kc, RES
-                    if self.dbg: 
-                        print '[+] Successful GBA derivation. Get [Ks_EXT_NAF]'
-                    values = LV_parser(val[1:])
-                    return values
+        val = self._internal_auth(P2, inp)
+        if val is not None and val[0] == 0xDB:
+            if self.dbg: 
+                print '[+] Successful GBA derivation. Get [Ks_EXT_NAF]'
+            values = LV_parser(val[1:])
+            return values
         if self.dbg: 
             print '[DBG] authentication failure: %s' % self.coms()
         return None
     
+    def GBA_batch_derivation(self, NAF_IDs=[], IMPI=[], RAND=None, AUTN=[]):
+        '''
+        self.GBA_batch_derivation([NAF_ID1, NAF_ID2, ...], IMPI, RAND, AUTN)
+            -> generator of (NAF_ID, [Ks_ext_naf] or None)
+        
+        runs a single GBA bootstrap (authenticate with 'GBA' context) 
+        with RAND and AUTN, then the GBA derivation for each NAF_ID
+        in the same session, yielding results as they complete
+        
+        with RAND=None, no bootstrap is run: the keys already available 
+        in the USIM from a previous bootstrap are used
+        if the bootstrap fails (error or AUTS), nothing is yielded
+        '''
+        if RAND is not None:
+            if self.authenticate(RAND, AUTN, ctx='GBA') is None \
+            or self.coms()[3][0] != 0xDB:
+                if self.dbg:
+                    print '[WNG] GBA bootstrap failure: %s' % self.coms()
+                return
+            # EF_GBABP / EF_GBANL content may change with a new bootstrap
+            self.GBA_index = None
+        for NAF_ID in NAF_IDs:
+            yield NAF_ID, self.GBA_derivation(NAF_ID, IMPI)
+    
     def bf_FS_from_init( self, filename='bf_USIM', file_dict=USIM_app_FS, 
-                         init_method='select_by_aid', init_args=[1] ):
+                         init_method='select_by_aid', init_args=[1],
+                         image=None ):
         '''
         bruteforces the USIM filesystem at the application initialization level:
             thanks to UICC.select_by_aid(1)
             could be used another way...
         stores the result in the file passed in argument 
         (file will be overwritten)
+        and in the binary card image file "image" if given (see card.image), 
+        with paths under the ADF (7F FF)
         
         TODO: does not manage file recursivity (when entering DF)
         only scan 1st level files
         '''
         fd = open(filename, 'w')
+        img = None
+        if image is not None:
+            from card.image import image_writer
+            img = image_writer(image, self.ATR, self.reader)
         # loop on all possible addresses
         for i in range(0x00, 0xff):
             for j in range(0x00, 0xff):
@@ -374,6 +443,8 @@ class USIM(UICC):
                     fd.write('\n')
                     for key in k:
                         fd.write('%s: %s\n' % (key, fil[key]))
+                    if img is not None:
+                        img.add([0x7F, 0xFF, i, j], fil)
                 # if file exists but special conditions are returned
                 if self.coms()[2] not in ((0x6A, 0x82), (0x90, 0x00)):
                     if self.dbg:
@@ -390,6 +461,8 @@ class USIM(UICC):
         
         fd.write('\n')
         fd.close()
+        if img is not None:
+            img.close()
 
     def bf_FS_from_MF(self, filename):
         '''
@@ -22,6 +22,6 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 # specificities of SIM and USIM card available
 
 
-__all__ = ['utils', 'ICC', 'SIM', 'USIM', 'FS']
+__all__ = ['utils', 'ICC', 'SIM', 'USIM', 'FS', 'export', 'provision', 'trace', 'fleet', 'milenage', 'sqn', 'pool', 'hlr', 'log', 'session', 'watch', 'image', 'diff', 'codec', 'sat', 'scheduler', 'probe']
 __version__ = '0.1.0'
 
@@ -0,0 +1,359 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# encoding / decoding of (U)SIM #
+# identities and numbers:       #
+# BCD, PLMN, LAI, TON / NPI     #
+#################################
+#
+# digits are stored as swapped nibbles (low nibble first), the 0xF
+# nibble being the filler (TS 51.011, TS 31.102, TS 24.008)
+# decoding goes through tables built once, with one lookup per byte
+# the *_batch functions decode many files or records at once, with
+# numpy when it is installed (imported when first needed, so that
+# importing card stays fast)
+#
+
+# digits for identities (IMSI, ICCID), and for dialling numbers
+# (0xA '*', 0xB '#', 0xC DTMF pause, 0xD wild, 0xE expansion)
+HEX_DIGITS = '0123456789abcde'
+NUMBER_DIGITS = '0123456789*#pwe'
+
+# type of number (TON) and numbering plan (NPI) byte
+TON = {
+    0 : 'unknown',
+    1 : 'international',
+    2 : 'national',
+    3 : 'network specific',
+    4 : 'dedicated access',
+    }
+NPI = {
+    0 : 'unknown',
+    1 : 'ISDN / telephony',
+    3 : 'data',
+    4 : 'telex',
+    8 : 'national',
+    9 : 'private',
+    }
+
+
+def _table(digits):
+    # byte -> 2 digits string, ending at the first filler
+    table = []
+    for B in range(256):
+        lo, hi = B & 0x0F, B >> 4
+        if lo == 0x0F:
+            table.append('')
+        elif hi == 0x0F:
+            table.append(digits[lo])
+        else:
+            table.append(digits[lo] + digits[hi])
+    return table
+
+_hex_table = _table(HEX_DIGITS)
+_number_table = _table(NUMBER_DIGITS)
+
+
+def decode_digits(data=[], digits=HEX_DIGITS):
+    '''
+    decode_digits([0x21, 0x43, 0xF5]) -> '12345'
+
+    decodes swapped nibbles BCD, up to the first filler nibble
+    '''
+    if digits == HEX_DIGITS:
+        table = _hex_table
+    elif digits == NUMBER_DIGITS:
+        table = _number_table
+    else:
+        table = _table(digits)
+    ret = []
+    for B in data:
+        d = table[B]
+        ret.append(d)
+        if len(d) < 2:
+            break
+    return ''.join(ret)
+
+def encode_digits(string='', length=None, digits=HEX_DIGITS):
+    '''
+    encode_digits('12345') -> [0x21, 0x43, 0xF5]
+
+    encodes digits as swapped nibbles BCD, padded with 0xF
+    (up to length bytes, when given)
+    '''
+    nib = [ digits.index(c) for c in string.lower() ]
+    if len(nib) % 2:
+        nib.append(0x0F)
+    data = [ nib[i] | (nib[i+1] << 4) for i in range(0, len(nib), 2) ]
+    if length is not None:
+        data.extend( (length - len(data)) * [0xFF] )
+    return data
+
+def decode_iccid(data=[]):
+    '''
+    decode_iccid(EF_ICCID content) -> ICCID string
+    '''
+    return decode_digits(data)
+
+def encode_iccid(iccid=''):
+    '''
+    encode_iccid(ICCID string) -> EF_ICCID content (10 bytes)
+    '''
+    return encode_digits(iccid, 10)
+
+def decode_imsi(data=[]):
+    '''
+    decode_imsi(EF_IMSI content) -> IMSI string, or None
+
+    EF_IMSI: length, then identity type / parity nibble and IMSI digits
+    '''
+    if len(data) < 2 or data[0] in (0x00, 0xFF):
+        return None
+    # the 1st nibble is the identity type and parity
+    return decode_digits(data[1:1+data[0]])[1:]
+
+def encode_imsi(imsi=''):
+    '''
+    encode_imsi(IMSI string) -> EF_IMSI content (9 bytes)
+    '''
+    # identity type IMSI (1), odd number of digits indication (0x8)
+    parity = len(imsi) % 2 and 0x9 or 0x1
+    data = encode_digits(HEX_DIGITS[parity] + imsi)
+    return [len(data)] + data + (8 - len(data)) * [0xFF]
+
+def decode_plmn(data=[]):
+    '''
+    decode_plmn([0x02, 0xF8, 0x01]) -> ('208', '10'), or None if unused
+
+    3 bytes PLMN: MCC digit 2|1, MNC digit 3|MCC digit 3, MNC digit 2|1
+    MNC has 2 digits when its 3rd digit is the filler
+    '''
+    if data[0:3] == [0xFF, 0xFF, 0xFF]:
+        return None
+    MCC = '%x%x%x' % (data[0] & 0x0F, data[0] >> 4, data[1] & 0x0F)
+    if data[1] >> 4 == 0x0F:
+        MNC = '%x%x' % (data[2] & 0x0F, data[2] >> 4)
+    else:
+        MNC = '%x%x%x' % (data[2] & 0x0F, data[2] >> 4, data[1] >> 4)
+    return MCC, MNC
+
+def encode_plmn(MCC='', MNC=''):
+    '''
+    encode_plmn('208', '10') -> [0x02, 0xF8, 0x01]
+    '''
+    mcc = [ int(c, 16) for c in MCC ]
+    mnc = [ int(c, 16) for c in MNC ] + (3 - len(MNC)) * [0x0F]
+    return [ mcc[0] | (mcc[1] << 4), mcc[2] | (mnc[2] << 4),
+             mnc[0] | (mnc[1] << 4) ]
+
+def decode_plmn_list(data=[]):
+    '''
+    decode_plmn_list(EF_PLMNsel / EF_FPLMN content) -> list of (MCC, MNC)
+
+    unused entries (FF FF FF) are skipped
+    '''
+    ret = []
+    for i in range(0, len(data) - 2, 3):
+        plmn = decode_plmn(data[i:i+3])
+        if plmn is not None:
+            ret.append(plmn)
+    return ret
+
+def encode_plmn_list(plmns=[], length=None):
+    '''
+    encode_plmn_list([(MCC, MNC), ...], length=None) -> list of bytes
+
+    padded with unused entries up to length bytes, when given
+    '''
+    data = []
+    for MCC, MNC in plmns:
+        data.extend( encode_plmn(MCC, MNC) )
+    if length is not None:
+        data.extend( (length - len(data)) * [0xFF] )
+    return data
+
+def decode_lai(data=[]):
+    '''
+    decode_lai(5 bytes) -> (MCC, MNC, LAC integer)
+
+    location area identification: PLMN, then LAC
+    '''
+    MCC, MNC = decode_plmn(data[0:3]) or ('', '')
+    return MCC, MNC, (data[3] << 8) | data[4]
+
+def encode_lai(MCC='', MNC='', LAC=0):
+    '''
+    encode_lai(MCC, MNC, LAC integer) -> 5 bytes
+    '''
+    return encode_plmn(MCC, MNC) + [LAC >> 8, LAC & 0xFF]
+
+def decode_number(data=[]):
+    '''
+    decode_number(BCD number) -> (TON, NPI, number string), or None
+
+    BCD number, as in EF_ADN / EF_MSISDN records (after the alpha
+    identifier) and EF_SMSP service centre address:
+        length (of TON / NPI and digits), TON / NPI, digits
+    an international number (TON 1) gets a '+' prefix
+    '''
+    if len(data) < 2 or data[0] in (0x00, 0xFF) or data[0] > len(data) - 1:
+        return None
+    TON, NPI = (data[1] >> 4) & 0x07, data[1] & 0x0F
+    number = decode_digits(data[2:1+data[0]], NUMBER_DIGITS)
+    if TON == 1:
+        number = '+' + number
+    return TON, NPI, number
+
+def encode_number(number='', TON=None, NPI=1, length=None):
+    '''
+    encode_number('+33612345678', TON=None, NPI=1, length=None)
+        -> BCD number
+
+    a '+' prefix sets the international TON, when TON is not given
+    the digits are padded with 0xFF up to length bytes, when given
+    '''
+    if number[0:1] == '+':
+        number = number[1:]
+        if TON is None:
+            TON = 1
+    if TON is None:
+        TON = 0
+    digits = encode_digits(number, digits=NUMBER_DIGITS)
+    data = [len(digits) + 1, 0x80 | (TON << 4) | NPI] + digits
+    if length is not None:
+        data.extend( (length - len(data)) * [0xFF] )
+    return data
+
+
+#################################
+# batch decoding                #
+#################################
+
+# numpy module once imported, False when not installed
+_numpy_module = None
+
+def _numpy():
+    # numpy module, or None when not installed
+    global _numpy_module
+    if _numpy_module is None:
+        try:
+            import numpy
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = False
+    return _numpy_module or None
+
+def _numpy_digits(numpy, data, digits):
+    # data: 2 dimensions uint8 array
+    num, length = data.shape
+    nib = numpy.empty((num, 2*length), dtype=numpy.uint8)
+    nib[:, 0::2] = data & 0x0F
+    nib[:, 1::2] = data >> 4
+    # the filler ends the string
+    nib[numpy.maximum.accumulate(nib == 0x0F, axis=1)] = 0x0F
+    chars = numpy.frombuffer(digits + '\x00', dtype='S1')[nib]
+    # trailing null characters are dropped by numpy strings
+    return [ str(s) for s in chars.view('S%d' % (2*length)).ravel() ]
+
+def decode_digits_batch(records=[], digits=HEX_DIGITS):
+    '''
+    decode_digits_batch([list of bytes, ...]) -> list of strings
+
+    decode_digits() on each record; with numpy, records of equal length
+    are decoded at once
+    '''
+    numpy = _numpy()
+    if numpy is None or len(records) == 0 \
+    or len(set(map(len, records))) != 1:
+        return [ decode_digits(r, digits) for r in records ]
+    return _numpy_digits(numpy, numpy.array(records, dtype=numpy.uint8),
+                         digits)
+
+def decode_iccid_batch(records=[]):
+    '''
+    decode_iccid_batch([EF_ICCID content, ...]) -> list of ICCID strings
+    '''
+    return decode_digits_batch(records)
+
+def decode_imsi_batch(records=[]):
+    '''
+    decode_imsi_batch([EF_IMSI content, ...]) -> list of IMSI strings
+        (None for invalid content)
+    '''
+    numpy = _numpy()
+    if numpy is None or len(records) == 0 \
+    or len(set(map(len, records))) != 1 or len(records[0]) < 2:
+        return [ decode_imsi(r) for r in records ]
+    data = numpy.array(records, dtype=numpy.uint8)
+    # digits beyond the IMSI length are made fillers
+    length = data[:, 0:1].astype(numpy.int32)
+    body = data[:, 1:].copy()
+    body[numpy.arange(body.shape[1]) >= length] = 0xFF
+    ret = []
+    for l, imsi in zip(data[:, 0], _numpy_digits(numpy, body, HEX_DIGITS)):
+        ret.append( l not in (0x00, 0xFF) and imsi[1:] or None )
+    return ret
+
+def decode_plmn_batch(data=[]):
+    '''
+    decode_plmn_batch(PLMN list, or list of PLMN lists) -> list of (MCC, MNC)
+
+    decode_plmn_list() on the concatenated content (e.g. EF_FPLMN of many
+    cards); with numpy, all PLMN are decoded at once
+    '''
+    if len(data) and isinstance(data[0], list):
+        data = [ B for d in data for B in d[:len(d)-len(d)%3] ]
+    numpy = _numpy()
+    if numpy is None or len(data) < 3:
+        return decode_plmn_list(data)
+    plmn = numpy.array(data[:len(data)-len(data)%3],
+                       dtype=numpy.uint8).reshape(-1, 3)
+    used = ~(plmn == 0xFF).all(axis=1)
+    return _numpy_plmn(numpy, plmn[used])
+
+def _numpy_plmn(numpy, plmn):
+    # plmn: 2 dimensions uint8 array, 3 bytes per row
+    # MCC digits 1, 2, 3, MNC digits 1, 2, 3
+    nib = numpy.empty((plmn.shape[0], 6), dtype=numpy.uint8)
+    nib[:, 0] = plmn[:, 0] & 0x0F
+    nib[:, 1] = plmn[:, 0] >> 4
+    nib[:, 2] = plmn[:, 1] & 0x0F
+    nib[:, 3] = plmn[:, 2] & 0x0F
+    nib[:, 4] = plmn[:, 2] >> 4
+    nib[:, 5] = plmn[:, 1] >> 4
+    # unused PLMN (FF FF FF) give empty strings
+    chars = numpy.frombuffer(HEX_DIGITS + '\x00', dtype='S1')[nib]
+    return [ (str(s)[:3], str(s)[3:]) for s in chars.view('S6').ravel() ]
+
+def decode_lai_batch(records=[]):
+    '''
+    decode_lai_batch([LAI, ...]) -> list of (MCC, MNC, LAC integer)
+
+    decode_lai() on each LAI (5 bytes, e.g. from EF_LOCI); with numpy,
+    all LAI are decoded at once
+    '''
+    numpy = _numpy()
+    if numpy is None or len(records) == 0 \
+    or min(map(len, records)) < 5:
+        return [ decode_lai(r) for r in records ]
+    data = numpy.array([ r[:5] for r in records ], dtype=numpy.uint8)
+    LAC = (data[:, 3].astype(numpy.int32) << 8) | data[:, 4]
+    return [ (MCC, MNC, int(l)) for ((MCC, MNC), l) in \
+             zip(_numpy_plmn(numpy, data[:, 0:3]), LAC) ]
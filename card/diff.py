@@ -0,0 +1,219 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# comparison of cards and card  #
+# images against a reference    #
+#################################
+#
+# files are compared by the SHA-1 of their content first (the one stored
+# in the card image index, see card.image): the full content is only
+# decoded, and the differences computed, for the files whose digest
+# differ
+# a reference image is best for checking many cards: its digests are
+# read from the index, and the content of a card is hashed as it is read
+#
+
+from hashlib import sha1
+
+from card.ICC import UICC
+from card.FS import SIM_FS, USIM_FS, USIM_app_FS
+from card.image import image_reader, encode_content
+from card.provision import diff_binary
+from card.utils import byteToString
+
+# USIM application files are stored under the current ADF
+ADF_PATH = [0x7F, 0xFF]
+
+
+def path_name(path):
+    '''
+    path_name([0x7F, 0x20, 0x6F, 0x07]) -> 'EF_IMSI'
+
+    name of the file from the card/FS.py dictionnaries,
+    or its path in hex when unknown
+    '''
+    path = tuple(path)
+    if list(path[:2]) == ADF_PATH and path[2:] in USIM_app_FS:
+        return USIM_app_FS[path[2:]]
+    if path in SIM_FS:
+        return SIM_FS[path]
+    if path in USIM_FS:
+        return USIM_FS[path]
+    return ''.join(['%02X' % b for b in path])
+
+def content_digest(fil):
+    '''
+    content_digest(file dict) -> SHA-1 of the file content (string)
+
+    same digest as the one in the card image index
+    '''
+    return sha1(encode_content(fil)[2]).digest()
+
+def record_digests(fil):
+    '''
+    record_digests(file dict) -> list of SHA-1 of each record
+    '''
+    return [ sha1(byteToString(rec)).digest() for rec in fil.get('Data', []) ]
+
+
+class card_source(object):
+    '''
+    gives access to the files of a card like an image_reader does:
+    each file is selected and read once, when first requested, and its
+    content hashed when read
+
+    paths: paths under MF of the files to compare, by default the ones
+        found by scan_fs() or else the ones from the card/FS.py
+        dictionnaries
+    '''
+
+    def __init__(self, card, paths=None):
+        self.card = card
+        self.is_UICC = isinstance(card, UICC)
+        if paths is None:
+            paths = self._default_paths()
+        self._paths = [ list(p) for p in paths ]
+        # path string -> (content SHA-1, file dict), None if not found
+        self.files = {}
+        # DF currently selected on a SIM
+        self._cur_DF = None
+
+    def _default_paths(self):
+        if getattr(self.card, 'FS', None):
+            return [ f['Absolut Path'] for f in self.card.FS \
+                     if 'Absolut Path' in f ]
+        if self.is_UICC:
+            return sorted(USIM_FS.keys()) + \
+                   [ tuple(ADF_PATH) + p for p in sorted(USIM_app_FS.keys()) ]
+        return sorted(SIM_FS.keys())
+
+    def _select(self, path):
+        if self.is_UICC:
+            return self.card.select(path, 'pmf')
+        # SIM: stay in the current DF when possible
+        DF, fid = path[:-2], path[-2:]
+        if DF != self._cur_DF:
+            self._cur_DF = None
+            if self.card.select([0x3F, 0x00], read=False) is None:
+                return None
+            for i in range(0, len(DF), 2):
+                if self.card.select(DF[i:i+2], read=False) is None:
+                    return None
+            self._cur_DF = DF
+        fil = self.card.select(fid)
+        if fil is not None and fil.get('Type') == 'DF':
+            # a DF was entered
+            self._cur_DF = None
+        return fil
+
+    def _read(self, path):
+        key = byteToString(path)
+        if key not in self.files:
+            fil = self._select(path)
+            if fil is None:
+                self.files[key] = None
+            else:
+                self.files[key] = (content_digest(fil), fil)
+        return self.files[key]
+
+    def paths(self):
+        return self._paths
+
+    def digest(self, path):
+        ent = self._read(path)
+        if ent is None:
+            return None
+        return ent[0]
+
+    def get(self, path):
+        ent = self._read(path)
+        if ent is None:
+            return None
+        return ent[1]
+
+
+def _source(obj):
+    if isinstance(obj, (image_reader, card_source)):
+        return obj
+    return card_source(obj)
+
+def _details(ref, tgt):
+    # differences in content between 2 files with different digests
+    diff = {}
+    if 'Data' not in ref or 'Data' not in tgt:
+        diff['unread'] = [ n for (n, f) in (('reference', ref),
+                           ('target', tgt)) if 'Data' not in f ]
+        return diff
+    if ref.get('Structure') == 'transparent':
+        diff['ranges'] = [ (off, len(d)) for (off, d) in \
+                           diff_binary(ref['Data'], tgt['Data'], gap=0) ]
+        if len(tgt['Data']) != len(ref['Data']):
+            diff['size'] = (len(ref['Data']), len(tgt['Data']))
+    else:
+        # non-empty records, as read
+        r, t = record_digests(ref), record_digests(tgt)
+        diff['records'] = [ i+1 for i in range(max(len(r), len(t))) \
+                            if i >= len(r) or i >= len(t) or r[i] != t[i] ]
+    return diff
+
+def compare(reference, target, paths=None):
+    '''
+    compare(reference, target, paths=None) -> list of differences
+
+    reference and target are each a card (SIM / USIM instance),
+    a card_source or a card.image.image_reader; the files compared are
+    the ones of the reference (or the given list of paths under MF)
+
+    each difference is a dict with the file 'path' (hex) and 'name',
+    and its 'status':
+        'missing': the file is not in the target
+        'extra': the file is only in the target (image targets only)
+        'differ': content differs, with details:
+            'ranges': list of (offset, length) changed, and 'size'
+                (reference, target) when it changed, for transparent EF
+            'records': list of changed records (numbered as read,
+                empty records being skipped), for record EF
+            'unread': which side has no content (e.g. access denied)
+    '''
+    ref, tgt = _source(reference), _source(target)
+    if paths is None:
+        paths = ref.paths()
+    diffs = []
+    for path in paths:
+        d_ref = ref.digest(path)
+        if d_ref is None:
+            continue
+        d_tgt = tgt.digest(path)
+        if d_tgt == d_ref:
+            continue
+        diff = {'path' : ''.join(['%02X' % b for b in path]),
+                'name' : path_name(path)}
+        if d_tgt is None:
+            diff['status'] = 'missing'
+        else:
+            diff['status'] = 'differ'
+            diff.update( _details(ref.get(path), tgt.get(path)) )
+        diffs.append(diff)
+    if isinstance(tgt, image_reader):
+        for path in tgt.paths():
+            if ref.digest(path) is None:
+                diffs.append( {'path' : ''.join(['%02X' % b for b in path]),
+                               'name' : path_name(path), 'status' : 'extra'} )
+    return diffs
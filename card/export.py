@@ -0,0 +1,242 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# streaming export of phonebook #
+# and SMS files                 #
+# see TS 51.011 and TS 31.102   #
+# for records coding            #
+#################################
+
+import csv
+import json
+from binascii import b2a_hex
+from card.codec import decode_digits, decode_number, NUMBER_DIGITS
+from card.utils import byteToString
+
+# GSM 7 bit default alphabet, TS 23.038
+GSM_alphabet = u'@\xa3$\xa5\xe8\xe9\xf9\xec\xf2\xc7\n\xd8\xf8\r\xc5\xe5' \
+               u'\u0394_\u03a6\u0393\u039b\u03a9\u03a0\u03a8' \
+               u'\u03a3\u0398\u039e\x1b\xc6\xe6\xdf\xc9' \
+               u' !"#\xa4%&\'()*+,-./0123456789:;<=>?' \
+               u'\xa1ABCDEFGHIJKLMNOPQRSTUVWXYZ\xc4\xd6\xd1\xdc\xa7' \
+               u'\xbfabcdefghijklmnopqrstuvwxyz\xe4\xf6\xf1\xfc\xe0'
+
+# SMS record status, TS 51.011 section 10.5.3
+SMS_status = {
+    0x01 : 'received read',
+    0x03 : 'received unread',
+    0x05 : 'sent',
+    0x07 : 'unsent',
+    }
+
+# files handled, with their record decoder and extension file
+export_files = {
+    'EF_ADN' : ('number', 'EF_EXT1'),
+    'EF_FDN' : ('number', 'EF_EXT2'),
+    'EF_LND' : ('number', 'EF_EXT1'),
+    'EF_MSISDN' : ('number', 'EF_EXT1'),
+    'EF_SMS' : ('sms', None),
+    'EF_SMSR' : ('smsr', None),
+    }
+
+# CSV columns, for all kinds of records
+export_fields = ['file', 'record', 'alpha', 'ton_npi', 'number',
+                 'status', 'sc_address', 'tpdu', 'sms_record']
+
+
+def decode_alpha(data=[]):
+    '''
+    decode_alpha([0x41, 0x42, 0xFF]) -> u'AB'
+
+    decodes an alpha identifier, coded with the GSM default alphabet
+    or one of the 3 UCS2 codings of TS 51.011 annex B
+    '''
+    if len(data) == 0:
+        return u''
+    if data[0] == 0x80:
+        # UCS2, 2 bytes per character
+        chars = []
+        for i in range(1, len(data)-1, 2):
+            if data[i:i+2] == [0xFF, 0xFF]:
+                break
+            chars.append( unichr(data[i]*0x100 + data[i+1]) )
+        return u''.join(chars)
+    if data[0] in (0x81, 0x82) and len(data) > 3:
+        # UCS2 with a base pointer, 1 byte per character
+        if data[0] == 0x81:
+            num, base, chars = data[1], data[2] << 7, data[3:]
+        else:
+            num, base, chars = data[1], data[2]*0x100 + data[3], data[4:]
+        return u''.join( [c & 0x80 and unichr(base + (c & 0x7F)) \
+                          or GSM_alphabet[c] for c in chars[:num]] )
+    return u''.join( [GSM_alphabet[c] for c in data if c < 0x80] )
+
+def decode_adn(rec=[], ext=None):
+    '''
+    decode_adn(record of EF_ADN, ext=function) -> dict(entry) or None
+
+    decodes an EF_ADN / FDN / LND / MSISDN record:
+        alpha identifier, TON / NPI and dialling number (see
+        card.codec.decode_number())
+    ext is called with an extension record number and returns
+    the corresponding extension record (or None):
+        it is used to chain additional digits, for each extension record
+        referred to by the record (or by the previous extension record)
+    returns None for empty records
+    '''
+    if rec == len(rec) * [0xFF]:
+        return None
+    X = len(rec) - 14
+    entry = {'alpha' : decode_alpha(rec[:X]), 'ton_npi' : rec[X+1]}
+    number = decode_number(rec[X:X+12])
+    if number is None:
+        entry['number'] = ''
+        return entry
+    number = number[2]
+    # additional digits in extension records
+    ext_id, hops = rec[X+13], 0
+    while ext is not None and ext_id != 0xFF and hops < 10:
+        ext_rec = ext(ext_id)
+        if ext_rec is None or len(ext_rec) < 13:
+            break
+        if ext_rec[0] == 0x02:
+            number += decode_digits(ext_rec[2:2+ext_rec[1]], NUMBER_DIGITS)
+        ext_id, hops = ext_rec[12], hops+1
+    entry['number'] = number
+    return entry
+
+def decode_sms(rec=[]):
+    '''
+    decode_sms(record of EF_SMS) -> dict(entry) or None
+
+    decodes the status byte, service center address and TPDU
+    of an EF_SMS record
+    returns None for free records
+    '''
+    if len(rec) < 2 or rec[0] & 0x01 == 0:
+        return None
+    entry = {'status' : SMS_status.get(rec[0] & 0x07, 'RFU %s' % rec[0])}
+    sc_len, sc_address = rec[1], decode_number(rec[1:13])
+    if sc_len < 12 and sc_address is not None:
+        entry['sc_address'] = sc_address[2]
+        tpdu = rec[2+sc_len:]
+    else:
+        entry['sc_address'] = ''
+        tpdu = rec[2:]
+    # strip padding
+    while len(tpdu) > 0 and tpdu[-1] == 0xFF:
+        tpdu = tpdu[:-1]
+    entry['tpdu'] = b2a_hex(byteToString(tpdu))
+    return entry
+
+def decode_smsr(rec=[]):
+    '''
+    decode_smsr(record of EF_SMSR) -> dict(entry) or None
+
+    decodes the SMS record identifier and the status report TPDU
+    of an EF_SMSR record
+    returns None for empty records
+    '''
+    if len(rec) < 2 or rec[0] in (0x00, 0xFF):
+        return None
+    tpdu = rec[1:]
+    while len(tpdu) > 0 and tpdu[-1] == 0xFF:
+        tpdu = tpdu[:-1]
+    return {'sms_record' : rec[0], 'tpdu' : b2a_hex(byteToString(tpdu))}
+
+def iter_export(card, name='EF_ADN'):
+    '''
+    iter_export(card, name) -> generator of dict(entry)
+
+    selects the EF by name on the SIM / USIM card instance,
+    then reads its records one by one, and yields each non-empty record
+    decoded (see decode_adn(), decode_sms() and decode_smsr());
+    nothing but the current record is kept in memory
+
+    for cyclic files (e.g. EF_LND), records are filled in order, so
+    reading stops at the first empty record
+    extension records (EXT1 / EXT2) are read one by one, only when
+    a record refers to them
+    '''
+    kind, ext_name = export_files[name]
+    fil = card.select_by_name(name, read=False)
+    if fil is None or 'Record Length' not in fil:
+        return
+    # extension records already read, by record number
+    ext_recs = {}
+    def ext(num):
+        if num not in ext_recs:
+            ext_recs[num] = None
+            ext_fil = card.select_by_name(ext_name, read=False)
+            if ext_fil is not None and 'Record Length' in ext_fil \
+            and 0 < num <= ext_fil['Size'] / ext_fil['Record Length']:
+                card.coms.push( card.READ_RECORD(P1=num, P2=0x04,
+                                Le=ext_fil['Record Length']) )
+                if card.coms()[2] == (0x90, 0x00):
+                    ext_recs[num] = card.coms()[3]
+            # back to the exported file, for the next records
+            card.select_by_name(name, read=False)
+        return ext_recs[num]
+    cyclic = fil['Structure'][:6] == 'cyclic'
+    for num, rec in card.iter_records(fil):
+        if kind == 'number':
+            entry = decode_adn(rec, ext)
+        elif kind == 'sms':
+            entry = decode_sms(rec)
+        else:
+            entry = decode_smsr(rec)
+        if entry is None:
+            if cyclic:
+                break
+            continue
+        entry['file'], entry['record'] = name, num
+        yield entry
+
+def export_jsonl(card, names=['EF_ADN', 'EF_SMS'], fd=None):
+    '''
+    export_jsonl(card, [file names], fd=file object) -> number of records
+
+    writes all decoded records of the given files, one JSON object
+    per line, as they are read from the card
+    '''
+    count = 0
+    for name in names:
+        for entry in iter_export(card, name):
+            fd.write(json.dumps(entry, sort_keys=True) + '\n')
+            count += 1
+    return count
+
+def export_csv(card, names=['EF_ADN', 'EF_SMS'], fd=None):
+    '''
+    export_csv(card, [file names], fd=file object) -> number of records
+
+    writes all decoded records of the given files as CSV rows
+    (with export_fields columns), as they are read from the card
+    '''
+    writer = csv.DictWriter(fd, export_fields, restval='')
+    writer.writeheader()
+    count = 0
+    for name in names:
+        for entry in iter_export(card, name):
+            if 'alpha' in entry:
+                entry['alpha'] = entry['alpha'].encode('utf-8')
+            writer.writerow(entry)
+            count += 1
+    return count
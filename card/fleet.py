@@ -0,0 +1,164 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# fleet inventory: read plans   #
+# run on all readers at once    #
+#################################
+#
+# one process per reader: each process waits for the cards inserted
+# in its reader, runs the read plan on them, and sends the results
+# back to the parent process, which merges them in a single output
+#
+
+import csv
+import json
+import sys
+from binascii import b2a_hex
+from multiprocessing import Process, Queue
+from time import time
+
+from card.SIM import SIM
+from card.codec import decode_iccid, decode_imsi
+from card.utils import byteToString
+
+# parameters which can be part of a read plan, from SIM.caller
+plan_params = ['ICCID', 'IMSI', 'SPN', 'LOCI', 'FPLMN', 'Kc', 'HPLMN',
+               'PLMN_SEL', 'ACC', 'MSISDN', 'SMSP']
+
+# readable form of some parameters, in addition to the hex one
+decoders = {
+    'IMSI' : decode_imsi,
+    'ICCID' : decode_iccid,
+    }
+
+
+def run_plan(card, plan=['ICCID', 'IMSI']):
+    '''
+    run_plan(SIM instance, [param, ...]) -> dict(card inventory)
+
+    runs each getter of the read plan on the card, and returns
+    the hex values (and readable ones for IMSI / ICCID),
+    with the time spent on each of them
+    '''
+    inv = {'reader' : str(card.reader),
+           'ATR' : b2a_hex(byteToString(card.ATR)),
+           'values' : {}, 'timing' : {}}
+    start = time()
+    for param in plan:
+        t = time()
+        val = card.caller[param]()
+        inv['timing'][param] = round(time() - t, 4)
+        if type(val) is list:
+            inv['values'][param] = b2a_hex(byteToString(val))
+            if param in decoders and len(val) > 0:
+                inv['values'][param + '_decoded'] = decoders[param](val)
+        else:
+            inv['values'][param] = val
+    inv['total'] = round(time() - start, 4)
+    return inv
+
+def reader_worker(reader, plan, queue, wait=10):
+    '''
+    runs in its own process: waits for cards in the given reader,
+    and runs the read plan on each card inserted
+    the card already present is processed first, then new cards,
+    until none is inserted for wait seconds
+    errors are put in the queue as records, with an 'error' key,
+    and the worker always ends with None
+    '''
+    try:
+        from smartcard.CardRequest import CardRequest
+        from smartcard.CardType import AnyCardType
+        from smartcard.Exceptions import CardRequestTimeoutException
+        newcardonly = False
+        while True:
+            request = CardRequest(timeout=wait, cardType=AnyCardType(),
+                                  readers=[reader], newcardonly=newcardonly)
+            newcardonly = True
+            try:
+                cardservice = request.waitforcard()
+            except CardRequestTimeoutException:
+                break
+            try:
+                card = SIM(cardservice=cardservice)
+                queue.put( run_plan(card, plan) )
+                card.disconnect()
+            except Exception as err:
+                queue.put( {'reader' : str(reader), 'error' : str(err)} )
+    except Exception as err:
+        # the reader itself failed (e.g. unplugged)
+        queue.put( {'reader' : str(reader), 'error' : str(err)} )
+    finally:
+        # run_fleet() waits for one None per worker
+        queue.put( None )
+
+def run_fleet(plan=['ICCID', 'IMSI'], out=sys.stdout, fmt='jsonl', wait=10):
+    '''
+    run_fleet([param, ...], out=file object, fmt='jsonl' or 'csv', wait=10)
+        -> list of per-card timing
+
+    discovers all readers, starts one worker process per reader
+    (see reader_worker()), and writes each card inventory to out
+    as soon as it is received
+    prints a timing summary on stderr at the end
+    '''
+    for param in plan:
+        if param not in plan_params:
+            raise ValueError('%s cannot be part of a read plan' % param)
+    from smartcard.System import readers
+    queue = Queue()
+    workers = [ Process(target=reader_worker, args=(r, plan, queue, wait)) \
+                for r in readers() ]
+    for w in workers:
+        w.start()
+
+    if fmt == 'csv':
+        fields = ['reader', 'ATR'] + plan \
+               + [p + '_decoded' for p in plan if p in decoders] \
+               + ['total', 'error']
+        writer = csv.DictWriter(out, fields, restval='')
+        writer.writeheader()
+    timing = []
+    running = len(workers)
+    while running > 0:
+        inv = queue.get()
+        if inv is None:
+            running -= 1
+            continue
+        if 'total' in inv:
+            timing.append( inv['total'] )
+        if fmt == 'csv':
+            row = dict(inv.get('values', {}))
+            for key in ('reader', 'ATR', 'total', 'error'):
+                if key in inv:
+                    row[key] = inv[key]
+            writer.writerow(row)
+        else:
+            out.write(json.dumps(inv, sort_keys=True) + '\n')
+        out.flush()
+    for w in workers:
+        w.join()
+
+    if timing:
+        sys.stderr.write('%d cards on %d readers, per card: ' \
+                         'min %.3fs, mean %.3fs, max %.3fs\n' \
+                         % (len(timing), len(workers), min(timing),
+                            sum(timing) / len(timing), max(timing)))
+    return timing
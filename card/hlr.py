@@ -0,0 +1,258 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# hlr_auc_gw compatible server  #
+# (hostapd EAP-SIM / EAP-AKA)   #
+# backed by physical cards      #
+#################################
+#
+# text messages, one per datagram:
+#   SIM-REQ-AUTH <IMSI> <max_chal>
+#       -> SIM-RESP-AUTH <IMSI> Kc:SRES:RAND [Kc:SRES:RAND ...]
+#   AKA-REQ-AUTH <IMSI>
+#       -> AKA-RESP-AUTH <IMSI> <RAND> <AUTN> <IK> <CK> <RES>
+#   AKA-AUTS <IMSI> <AUTS> <RAND>
+#       -> no response
+# on error, the response is: <type>-RESP-AUTH <IMSI> FAILURE
+#
+
+import os
+import socket
+import threading
+import SocketServer
+from binascii import b2a_hex
+
+from card.codec import decode_imsi
+from card.utils import byteToString, stringToByte
+from card.session import card_session
+
+# number of triplets when the request does not tell
+SIM_CHAL = 3
+MAX_CHAL = 5
+
+
+def _hex(data):
+    return b2a_hex(byteToString(data))
+
+def card_imsi(card):
+    '''
+    card_imsi(SIM or USIM instance) -> IMSI string or None
+    '''
+    imsi = card.get_imsi()
+    if type(imsi) is list:
+        # SIM returns the raw EF_IMSI content
+        imsi = decode_imsi(imsi)
+    return imsi
+
+def open_cards(cls, wait=1):
+    '''
+    open_cards(SIM or USIM class, wait=1) -> list of card instances
+
+    connects to the card in each reader
+    '''
+    from smartcard.CardRequest import CardRequest
+    from smartcard.CardType import AnyCardType
+    from smartcard.Exceptions import CardRequestTimeoutException
+    from smartcard.System import readers
+    cards = []
+    for r in readers():
+        request = CardRequest(timeout=wait, cardType=AnyCardType(),
+                              readers=[r])
+        try:
+            cards.append( cls(cardservice=request.waitforcard()) )
+        except CardRequestTimeoutException:
+            pass
+    return cards
+
+
+class hlr_backend(object):
+    '''
+    answers hlr_auc_gw requests from the attached cards, found by IMSI
+
+    GSM triplets are computed by the SIM (GSM algorithm) or USIM
+    (GSM context authentication);
+    AKA quintuplets need the subscriber keys: keys is a dict
+        {IMSI: card.milenage.milenage instance}
+    and tracker a card.sqn.sqn_tracker, for the SQN of each card
+
+    each card is used by a single request at a time (see
+    card.session), requests to different cards are served concurrently
+    '''
+
+    def __init__(self, cards=[], keys={}, tracker=None):
+        self.cards = {}
+        for card in cards:
+            self.cards[card_imsi(card)] = card_session(card)
+        self.keys = keys
+        self.tracker = tracker
+
+    def triplets(self, imsi, num=SIM_CHAL):
+        '''
+        triplets(IMSI, num) -> list of (Kc, SRES, RAND) or None
+        '''
+        ret = []
+        # all triplets in one pass on the card
+        with self.cards[imsi].transaction() as card:
+            for i in range(num):
+                RAND = map(ord, os.urandom(16))
+                if hasattr(card, 'run_gsm_alg'):
+                    res = card.run_gsm_alg(RAND)
+                else:
+                    res = card.authenticate(RAND, ctx='2G')
+                if res is None or len(res) != 2:
+                    return None
+                SRES, Kc = res
+                ret.append( (Kc, SRES, RAND) )
+        return ret
+
+    def quintuplet(self, imsi):
+        '''
+        quintuplet(IMSI) -> (RAND, AUTN, IK, CK, RES) or None
+        '''
+        from card.sqn import authenticate_sync
+        if imsi not in self.keys or self.tracker is None:
+            return None
+        with self.cards[imsi].transaction() as card:
+            vec, ret = authenticate_sync(card, self.keys[imsi], self.tracker,
+                                         card_id=imsi)
+        if ret is None:
+            return None
+        return (vec[0], vec[1], ret[2], ret[1], ret[0])
+
+    def resync(self, imsi, AUTS, RAND):
+        '''
+        resync(IMSI, AUTS, RAND) -> bool
+
+        resynchronises the SQN of the card from AUTS
+        '''
+        if imsi not in self.keys or self.tracker is None:
+            return False
+        SQN_MS = self.keys[imsi].resync(RAND, AUTS)
+        if SQN_MS is None:
+            return False
+        self.tracker.resync(imsi, SQN_MS)
+        return True
+
+    def handle(self, msg=''):
+        '''
+        handle(request message) -> response message or None
+        '''
+        fields = msg.split()
+        if len(fields) < 2:
+            return None
+        cmd, imsi = fields[0], fields[1]
+        if cmd == 'SIM-REQ-AUTH':
+            num = SIM_CHAL
+            if len(fields) > 2 and fields[2].isdigit():
+                num = max(1, min(int(fields[2]), MAX_CHAL))
+            trip = None
+            if imsi in self.cards:
+                trip = self.triplets(imsi, num)
+            if trip is None:
+                return 'SIM-RESP-AUTH %s FAILURE' % imsi
+            return 'SIM-RESP-AUTH %s %s' % (imsi, ' '.join( \
+                   ['%s:%s:%s' % (_hex(Kc), _hex(SRES), _hex(RAND)) \
+                    for (Kc, SRES, RAND) in trip]))
+        elif cmd == 'AKA-REQ-AUTH':
+            quin = None
+            if imsi in self.cards:
+                quin = self.quintuplet(imsi)
+            if quin is None:
+                return 'AKA-RESP-AUTH %s FAILURE' % imsi
+            return 'AKA-RESP-AUTH %s %s' % (imsi,
+                   ' '.join([_hex(v) for v in quin]))
+        elif cmd == 'AKA-AUTS' and len(fields) == 4:
+            try:
+                AUTS = stringToByte(fields[2].decode('hex'))
+                RAND = stringToByte(fields[3].decode('hex'))
+            except TypeError:
+                return None
+            if len(AUTS) == 14 and len(RAND) == 16:
+                self.resync(imsi, AUTS, RAND)
+        return None
+
+
+class hlr_request_handler(SocketServer.BaseRequestHandler):
+    '''
+    one datagram, one request
+    '''
+
+    def handle(self):
+        data, sock = self.request
+        resp = self.server.backend.handle(data.strip())
+        if resp is not None:
+            sock.sendto(resp, self.client_address)
+
+
+class hlr_unix_server(SocketServer.ThreadingMixIn,
+                      SocketServer.UnixDatagramServer):
+    daemon_threads = True
+
+
+class hlr_udp_server(SocketServer.ThreadingMixIn, SocketServer.UDPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(backend, address='/tmp/hlr_auc_gw.sock'):
+    '''
+    make_server(hlr_backend instance, address) -> server instance
+
+    address is a UNIX socket path (string), or a (host, port) tuple
+    for UDP; call serve_forever() on the returned server
+    '''
+    if isinstance(address, tuple):
+        server = hlr_udp_server(address, hlr_request_handler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = hlr_unix_server(address, hlr_request_handler)
+    server.backend = backend
+    return server
+
+def hlr_request(msg, address='/tmp/hlr_auc_gw.sock', timeout=5):
+    '''
+    hlr_request('SIM-REQ-AUTH 001010000000001 3', address) -> response or None
+
+    client side: sends the request to the server (UNIX socket path or
+    (host, port) tuple), and waits for the response up to timeout seconds
+    (AKA-AUTS has no response: None is returned after timeout)
+    '''
+    if isinstance(address, tuple):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        path = None
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # the server answers to the client socket path
+        path = '%s.client.%d.%d' % (address, os.getpid(),
+                                    threading.current_thread().ident)
+        if os.path.exists(path):
+            os.unlink(path)
+        sock.bind(path)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(msg, address)
+        return sock.recv(4096)
+    except socket.timeout:
+        return None
+    finally:
+        sock.close()
+        if path is not None:
+            os.unlink(path)
@@ -0,0 +1,244 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# binary card image:            #
+# file attributes and contents  #
+#################################
+#
+# little endian format:
+#   header: magic (8 bytes), ATR length (2 bytes), ATR,
+#           reader name length (2 bytes), reader name
+#   entries, written as files are found during a scan:
+#           path length (2 bytes), path,
+#           attributes length (4 bytes), attributes (JSON),
+#           kind (1 byte: 0 no content, 1 transparent, 2 records),
+#           record length (2 bytes), content length (4 bytes), content
+#   index, written when the image is closed:
+#           for each entry: path length (2 bytes), path,
+#           entry offset (8 bytes), SHA-1 of the content (20 bytes)
+#   footer: index offset (8 bytes), number of entries (4 bytes),
+#           index magic (8 bytes)
+#
+# an image without index (interrupted scan) is still readable:
+# its entries are then indexed by reading them in sequence
+#
+
+import json
+import mmap
+import struct
+from hashlib import sha1
+
+from card.utils import byteToString, stringToByte
+
+IMAGE_MAGIC = 'CARDIMG\x01'
+INDEX_MAGIC = 'CARDIDX\x01'
+
+_H = struct.Struct('<H')
+_I = struct.Struct('<I')
+_content = struct.Struct('<BHI')
+_index = struct.Struct('<Q20s')
+_footer = struct.Struct('<QI8s')
+
+KIND_NONE, KIND_TRANSPARENT, KIND_RECORDS = 0, 1, 2
+
+
+def encode_content(fil):
+    '''
+    encode_content(file dict) -> (kind, record length, content string)
+    '''
+    data = fil.get('Data')
+    if data is None:
+        return KIND_NONE, 0, ''
+    if fil.get('Structure') == 'transparent':
+        return KIND_TRANSPARENT, 0, byteToString(data)
+    rec_len = fil.get('Record Length', 0)
+    return KIND_RECORDS, rec_len, ''.join([byteToString(r) for r in data])
+
+def decode_content(kind, rec_len, content):
+    '''
+    decode_content(kind, record length, content string)
+        -> list of bytes, list of records, or None
+    '''
+    if kind == KIND_NONE:
+        return None
+    data = stringToByte(content)
+    if kind == KIND_TRANSPARENT:
+        return data
+    if rec_len == 0:
+        return []
+    return [ data[i:i+rec_len] for i in range(0, len(data), rec_len) ]
+
+
+def _str(obj):
+    # JSON decoding returns unicode strings, file dicts have str
+    if isinstance(obj, unicode):
+        return str(obj)
+    elif isinstance(obj, list):
+        return [ _str(o) for o in obj ]
+    elif isinstance(obj, dict):
+        return dict( (_str(k), _str(v)) for (k, v) in obj.items() )
+    return obj
+
+
+class image_writer(object):
+    '''
+    writes a card image incrementally: each file is appended
+    as soon as it is added, the index is written by close()
+    '''
+
+    def __init__(self, filename, ATR=[], reader=''):
+        self.fd = open(filename, 'wb')
+        self.fd.write(IMAGE_MAGIC)
+        self.fd.write(_H.pack(len(ATR)) + byteToString(ATR))
+        reader = str(reader)
+        self.fd.write(_H.pack(len(reader)) + reader)
+        self.index = []
+
+    def add(self, path, fil):
+        '''
+        add(path under MF ('Absolut Path'), file dict)
+
+        appends the file attributes and content ('Data') to the image
+        '''
+        attrs = dict( (k, v) for (k, v) in fil.items() if k != 'Data' )
+        attrs = json.dumps(attrs, sort_keys=True)
+        kind, rec_len, content = encode_content(fil)
+        path = byteToString(path)
+        self.index.append( (path, self.fd.tell(), sha1(content).digest()) )
+        self.fd.write(_H.pack(len(path)) + path + _I.pack(len(attrs)) + attrs \
+                      + _content.pack(kind, rec_len, len(content)) + content)
+        self.fd.flush()
+
+    def close(self):
+        '''
+        writes the index and footer, and closes the image
+        '''
+        offset = self.fd.tell()
+        for path, off, digest in self.index:
+            self.fd.write(_H.pack(len(path)) + path + _index.pack(off, digest))
+        self.fd.write(_footer.pack(offset, len(self.index), INDEX_MAGIC))
+        self.fd.close()
+
+
+class image_reader(object):
+    '''
+    reads a card image through mmap: only the index is parsed
+    when opening it, each file is decoded when requested
+        img = image_reader('card.img')
+        img.get([0x7F, 0x20, 0x6F, 0x07]) -> file dict
+    '''
+
+    def __init__(self, filename):
+        self.fd = open(filename, 'rb')
+        self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(IMAGE_MAGIC)] != IMAGE_MAGIC:
+            self.close()
+            raise ValueError('%s is not a card image' % filename)
+        pos = len(IMAGE_MAGIC)
+        l, = _H.unpack_from(self.map, pos)
+        self.ATR = stringToByte(self.map[pos+2:pos+2+l])
+        pos += 2 + l
+        l, = _H.unpack_from(self.map, pos)
+        self.reader = self.map[pos+2:pos+2+l]
+        self._entries = pos + 2 + l
+        # path string -> (entry offset, content SHA-1)
+        self.index = {}
+        if not self._read_index():
+            self._scan_entries()
+
+    def _read_index(self):
+        if len(self.map) < self._entries + _footer.size:
+            return False
+        offset, count, magic = _footer.unpack_from(self.map,
+                                                   len(self.map)-_footer.size)
+        if magic != INDEX_MAGIC:
+            return False
+        pos = offset
+        for i in range(count):
+            l, = _H.unpack_from(self.map, pos)
+            path = self.map[pos+2:pos+2+l]
+            self.index[path] = _index.unpack_from(self.map, pos+2+l)
+            pos += 2 + l + _index.size
+        self._end = offset
+        return True
+
+    def _scan_entries(self):
+        # no index: walk through the entries, and hash their content
+        pos, end = self._entries, len(self.map)
+        while pos < end:
+            try:
+                path, attrs, kind, rec_len, content, nxt = \
+                    self._entry(pos)
+            except (struct.error, IndexError):
+                # truncated last entry
+                break
+            if nxt > end:
+                break
+            self.index[path] = (pos, sha1(content).digest())
+            pos = nxt
+        self._end = pos
+
+    def _entry(self, pos):
+        l, = _H.unpack_from(self.map, pos)
+        path = self.map[pos+2:pos+2+l]
+        pos += 2 + l
+        l, = _I.unpack_from(self.map, pos)
+        attrs = self.map[pos+4:pos+4+l]
+        pos += 4 + l
+        kind, rec_len, l = _content.unpack_from(self.map, pos)
+        pos += _content.size
+        content = self.map[pos:pos+l]
+        return path, attrs, kind, rec_len, content, pos + l
+
+    def paths(self):
+        '''
+        paths() -> list of paths (lists of bytes) in the image
+        '''
+        return [ stringToByte(p) for p in sorted(self.index) ]
+
+    def __contains__(self, path):
+        return byteToString(path) in self.index
+
+    def digest(self, path):
+        '''
+        digest(path) -> SHA-1 of the file content (string), or None
+        '''
+        ent = self.index.get(byteToString(path))
+        if ent is None:
+            return None
+        return ent[1]
+
+    def get(self, path):
+        '''
+        get(path) -> file dict (with 'Data' when content was read), or None
+        '''
+        ent = self.index.get(byteToString(path))
+        if ent is None:
+            return None
+        p, attrs, kind, rec_len, content, nxt = self._entry(ent[0])
+        fil = _str(json.loads(attrs))
+        data = decode_content(kind, rec_len, content)
+        if data is not None:
+            fil['Data'] = data
+        return fil
+
+    def close(self):
+        self.map.close()
+        self.fd.close()
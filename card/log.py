@@ -0,0 +1,114 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# logging of the card library   #
+#################################
+#
+# the library logs to the "card" logger, which has no output
+# unless the application enables one:
+#   enable_console() for text messages
+#   enable_json(fd) for JSON events, with reader, ICCID, operation
+#   and duration of the timed operations (see timed())
+# messages are formatted only when they are output
+#
+
+import json
+import logging
+import sys
+from functools import wraps
+from time import time
+
+log = logging.getLogger('card')
+log.addHandler(logging.NullHandler())
+
+
+class json_handler(logging.Handler):
+    '''
+    writes one JSON object per event, with the time, level and message,
+    and the reader, ICCID, op and duration when available
+    '''
+
+    fields = ('reader', 'ICCID', 'op', 'duration')
+
+    def __init__(self, fd=sys.stdout):
+        logging.Handler.__init__(self)
+        self.fd = fd
+
+    def emit(self, record):
+        try:
+            event = {'time' : round(record.created, 3),
+                     'level' : record.levelname,
+                     'msg' : record.getMessage()}
+            for f in self.fields:
+                if hasattr(record, f):
+                    event[f] = getattr(record, f)
+            self.fd.write(json.dumps(event, sort_keys=True) + '\n')
+            self.fd.flush()
+        except Exception:
+            self.handleError(record)
+
+
+def enable_console(level=logging.INFO, fd=sys.stdout):
+    '''
+    enable_console(level=logging.INFO, fd=sys.stdout) -> handler
+
+    outputs the library messages as text lines
+    '''
+    handler = logging.StreamHandler(fd)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(handler)
+    log.setLevel(level)
+    return handler
+
+def enable_json(fd=sys.stdout, level=logging.DEBUG):
+    '''
+    enable_json(fd=file object, level=logging.DEBUG) -> handler
+
+    outputs the library messages and timed operations as JSON events;
+    timed operations are logged at DEBUG level
+    '''
+    handler = json_handler(fd)
+    log.addHandler(handler)
+    log.setLevel(level)
+    return handler
+
+def timed(op):
+    '''
+    method decorator, logs the duration of each call as the
+    given operation, when DEBUG level is enabled:
+        @timed('authenticate')
+        def authenticate(self, ...):
+    '''
+    def decorator(meth):
+        @wraps(meth)
+        def wrapper(self, *args, **kwargs):
+            if not log.isEnabledFor(logging.DEBUG):
+                return meth(self, *args, **kwargs)
+            start = time()
+            try:
+                return meth(self, *args, **kwargs)
+            finally:
+                duration = round(time() - start, 6)
+                log.debug('%s: %.6fs', op, duration,
+                          extra={'reader' : str(self.reader),
+                                 'ICCID' : self.ICCID,
+                                 'op' : op, 'duration' : duration})
+        return wrapper
+    return decorator
@@ -0,0 +1,179 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# pool of pre-computed          #
+# authentication vectors        #
+#################################
+#
+# a background thread runs the authentications on the card while it is
+# idle, and keeps a bounded queue of ready vectors: consumers get them
+# without waiting for the card
+#
+
+import os
+import threading
+from Queue import Queue, Empty, Full
+from time import time
+
+from card.log import log
+from card.sqn import authenticate_sync
+
+
+def sim_triplet(card):
+    '''
+    sim_triplet(SIM instance) -> dict(RAND, SRES, Kc) or None
+
+    runs the GSM algorithm with a random RAND
+    '''
+    RAND = map(ord, os.urandom(16))
+    ret = card.run_gsm_alg(RAND)
+    if ret is None:
+        return None
+    return {'RAND' : RAND, 'SRES' : ret[0], 'Kc' : ret[1]}
+
+def usim_quintuplet(card, mil, tracker, card_id):
+    '''
+    usim_quintuplet(USIM instance, milenage instance, sqn_tracker instance,
+                    card_id) -> dict(RAND, AUTN, RES, CK, IK) or None
+
+    runs the 3G authentication with a fresh vector, the SQN being
+    tracked under card_id, see card.sqn.authenticate_sync()
+    '''
+    vec, ret = authenticate_sync(card, mil, tracker, card_id)
+    if ret is None:
+        return None
+    return {'RAND' : vec[0], 'AUTN' : vec[1], 'RES' : ret[0],
+            'CK' : ret[1], 'IK' : ret[2]}
+
+def usim_producer(card, mil, tracker):
+    '''
+    usim_producer(USIM instance, milenage instance, sqn_tracker instance)
+        -> producer of quintuplets for a vector_pool, or None
+
+    reads the IMSI of the card once, to track the SQN under it
+    (None when the IMSI cannot be read)
+    '''
+    imsi = card.get_imsi()
+    if imsi is None:
+        return None
+    return lambda card: usim_quintuplet(card, mil, tracker, imsi)
+
+
+class vector_pool(object):
+    '''
+    keeps up to size vectors ready, produced by producer(card)
+    (sim_triplet() by default, or e.g.
+        usim_producer(card, mil, tracker) )
+
+    the pool is refilled up to size as soon as it holds low_watermark
+    vectors or less
+    with single_use=False, a vector is put back in the pool after use
+
+    while the pool runs, its thread is the only user of the card
+    '''
+
+    # consecutive card errors after which the filler stops
+    max_errors = 3
+    # interval at which get() checks that the filler still runs (seconds)
+    poll_interval = 0.1
+
+    def __init__(self, card, size=32, low_watermark=8, single_use=True,
+                 producer=sim_triplet):
+        self.card = card
+        self.size = size
+        self.low_watermark = low_watermark
+        self.single_use = single_use
+        self.producer = producer
+        self.queue = Queue(size)
+        self.errors = 0
+        self._refill = threading.Event()
+        self._stop = threading.Event()
+        self._refill.set()
+        self._filler = threading.Thread(target=self._fill)
+        self._filler.daemon = True
+        self._filler.start()
+
+    def _fill(self):
+        while not self._stop.is_set():
+            if not self._refill.wait(1.0) \
+            and self.queue.qsize() > self.low_watermark:
+                continue
+            while not self._stop.is_set() and not self.queue.full():
+                vec = self.producer(self.card)
+                if vec is None:
+                    self.errors += 1
+                    if self.errors >= self.max_errors:
+                        log.error('vector pool: card errors, stopping')
+                        self._stop.set()
+                    continue
+                self.errors = 0
+                try:
+                    # vectors put back by get() may have filled the pool
+                    self.queue.put_nowait(vec)
+                except Full:
+                    pass
+            self._refill.clear()
+
+    def get(self, timeout=None):
+        '''
+        get(timeout=None) -> dict(vector)
+
+        returns the next ready vector (tagged with its RAND),
+        waiting for it up to timeout seconds when the pool is empty
+        raises Queue.Empty on timeout, or as soon as the pool is empty
+        with its filler stopped (see stop() and max_errors)
+        '''
+        if timeout is not None:
+            end = time() + timeout
+        while True:
+            wait = self.poll_interval
+            if timeout is not None:
+                wait = max(0, min(wait, end - time()))
+            try:
+                vec = self.queue.get(timeout=wait)
+                break
+            except Empty:
+                if not self.running() and self.queue.empty():
+                    raise
+                if timeout is not None and time() >= end:
+                    raise
+        if not self.single_use:
+            try:
+                self.queue.put_nowait(vec)
+            except Full:
+                pass
+        if self.queue.qsize() <= self.low_watermark:
+            self._refill.set()
+        return vec
+
+    def running(self):
+        '''
+        running() -> bool, True while the pool is being filled
+        '''
+        return self._filler.is_alive()
+
+    def stop(self):
+        '''
+        stops the filler thread, once its current authentication is over
+        the card can then be used directly again
+        '''
+        self._stop.set()
+        self._refill.set()
+        self._filler.join()
@@ -0,0 +1,277 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# card capabilities probing,    #
+# cached per card model (ATR)   #
+#################################
+#
+# the SW returned for each CLA and INS probed are stored in a JSON file,
+# under the ATR of the card (or a given model name):
+#   a card of a known model is only probed for the values not tried yet
+#   the cache is saved regularly while probing, so that an interrupted
+#   probing goes on from where it stopped
+# logical channels and extended length support are read from the card
+# capabilities in the ATR historical bytes (ISO 7816-4, section 8.1.1.2.7)
+# and, for logical channels, checked with MANAGE CHANNEL when missing
+#
+
+import json
+import os
+from binascii import b2a_hex
+
+from card.log import log
+from card.utils import byteToString, toHexString
+
+# SW telling that the CLA / INS is not supported
+CLA_unsupported = (0x6E, 0x00)
+INS_unsupported = (0x6D, 0x00)
+# command sent with each CLA by default: SELECT MF
+CLA_command = [0xA4, 0x00, 0x00, 0x02, 0x3F, 0x00]
+
+
+def historical_bytes(ATR=[]):
+    '''
+    historical_bytes(ATR) -> list of historical bytes
+    '''
+    if len(ATR) < 2:
+        return []
+    K, Y, i = ATR[1] & 0x0F, ATR[1] >> 4, 2
+    # interface bytes: TA, TB, TC present when their bit in Y is set,
+    # TD giving the next Y
+    while True:
+        i += bin(Y & 0x07).count('1')
+        if not Y & 0x08 or i >= len(ATR):
+            break
+        Y = ATR[i] >> 4
+        i += 1
+    return ATR[i:i+K]
+
+def card_capabilities(ATR=[]):
+    '''
+    card_capabilities(ATR) -> dict
+
+    reads the card capabilities compact-TLV object (tag 7) in the
+    historical bytes; the dict contains, when given by the card:
+        'channels': maximum number of logical channels
+        'extended_length': extended Lc / Le support
+        'chaining': command chaining support
+    '''
+    hist = historical_bytes(ATR)
+    caps = {}
+    if len(hist) == 0 or hist[0] not in (0x00, 0x80):
+        return caps
+    # 0x00: compact-TLV objects, then 3 status bytes
+    data = hist[0] == 0x00 and hist[1:-3] or hist[1:]
+    while len(data) > 0:
+        T, L = data[0] >> 4, data[0] & 0x0F
+        V, data = data[1:1+L], data[1+L:]
+        if T == 0x7 and len(V) >= 3:
+            caps['chaining'] = bool(V[2] & 0x80)
+            caps['extended_length'] = bool(V[2] & 0x40)
+            if V[2] & 0x18:
+                # logical channels assigned by the card or the terminal
+                caps['channels'] = (V[2] & 0x07) + 1
+            else:
+                caps['channels'] = 1
+    return caps
+
+def supported(known, unsupported, start=0):
+    '''
+    supported({'a0': '9f16', ...}, (0x6E, 0x00), start=0) -> list of values
+
+    values (from start) for which the card did not answer unsupported
+    '''
+    unsupported = '%02x%02x' % unsupported
+    return sorted( int(v, 16) for (v, sw) in known.items() \
+                   if sw != unsupported and int(v, 16) >= start )
+
+
+class capability_cache(object):
+    '''
+    JSON file of the capabilities probed, per card model:
+        {model: {'CLA': {'command': {'cla': 'sw', ...}, ...},
+                 'INS': {'cla': {'ins': 'sw', ...}, ...},
+                 'channels': int or None,
+                 'extended_length': bool or None}}
+    CLA are probed with a command (INS, P1, P2 and data, in hex) which
+    changes the SW, so their results are kept per command
+    CLA, INS and SW are in hex; model is the ATR in hex by default
+    '''
+
+    def __init__(self, filename='card_caps.json'):
+        self.filename = filename
+        self.models = {}
+        if os.path.exists(filename):
+            self.models = json.load(open(filename))
+
+    def get(self, model):
+        '''
+        get(model) -> dict(capabilities), created when unknown
+        '''
+        caps = self.models.setdefault(model, {'CLA' : {}, 'INS' : {},
+                                      'channels' : None,
+                                      'extended_length' : None})
+        if [ v for v in caps['CLA'].values() if not isinstance(v, dict) ]:
+            # CLA probed with the default command, before they were
+            # kept per command
+            caps['CLA'] = {b2a_hex(byteToString(CLA_command)) : caps['CLA']}
+        return caps
+
+    def save(self):
+        '''
+        writes the cache in the JSON file
+        (through a temporary file, so that it is never left truncated)
+        '''
+        tmp = self.filename + '.tmp'
+        fd = open(tmp, 'w')
+        json.dump(self.models, fd, sort_keys=True, indent=1)
+        fd.close()
+        os.rename(tmp, self.filename)
+
+
+class capability_probe(object):
+    '''
+    probes the CLA, INS and logical channels supported by a card,
+    and keeps the results in a capability_cache:
+        probe = capability_probe(card, 'card_caps.json')
+        probe.probe_all() -> dict(capability map)
+
+    WARNING:
+    probing CLA and INS can block the card definitively
+    Do not do it with your own VISA / MASTERCARD
+    '''
+
+    # number of probes between 2 saves of the cache
+    save_every = 16
+
+    def __init__(self, card, cache='card_caps.json', model=None):
+        self.card = card
+        if not isinstance(cache, capability_cache):
+            cache = capability_cache(cache)
+        self.cache = cache
+        if model is None:
+            model = b2a_hex(byteToString(card.ATR))
+        self.model = model
+        self.caps = cache.get(model)
+        self._probes = 0
+
+    def _probed(self):
+        self._probes += 1
+        if self._probes % self.save_every == 0:
+            self.cache.save()
+
+    def _probe(self, known, values, apdu):
+        # probes the values not in known, saving the cache on the way
+        try:
+            for v in values:
+                key = '%02x' % v
+                if key in known:
+                    continue
+                ret = self.card.sr_apdu(apdu(v))
+                known[key] = '%02x%02x' % ret[2]
+                log.debug('%s: %s', toHexString(apdu(v)), ret[1])
+                self._probed()
+        finally:
+            self.cache.save()
+
+    def probe_cla(self, start=0, param=CLA_command):
+        '''
+        probe_cla(start=0, param=[SELECT MF]) -> list of CLA supported
+
+        sends the command with each CLA not probed yet with this command
+        '''
+        known = self.caps['CLA'].setdefault(b2a_hex(byteToString(param)), {})
+        self._probe(known, range(start, 256), lambda i: [i] + param)
+        return supported(known, CLA_unsupported, start)
+
+    def probe_ins(self, CLA=None, start=0):
+        '''
+        probe_ins(CLA=None, start=0) -> list of INS supported
+
+        sends a command without data with each INS not probed yet,
+        with the card CLA by default
+        '''
+        if CLA is None:
+            CLA = self.card.CLA
+        known = self.caps['INS'].setdefault('%02x' % CLA, {})
+        self._probe(known, range(start, 256), lambda i: [CLA, i, 0x00, 0x00])
+        return supported(known, INS_unsupported, start)
+
+    def probe_channels(self):
+        '''
+        probe_channels() -> maximum number of logical channels
+
+        from the ATR card capabilities, or by opening logical channels
+        with MANAGE CHANNEL (and closing them) when the ATR does not tell
+        '''
+        if self.caps['channels'] is not None:
+            return self.caps['channels']
+        caps = card_capabilities(self.card.ATR)
+        self.caps['extended_length'] = caps.get('extended_length')
+        if 'channels' in caps:
+            self.caps['channels'] = caps['channels']
+        else:
+            opened = []
+            while len(opened) < 19:
+                ret = self.card.sr_apdu([self.card.CLA, 0x70, 0x00, 0x00, 0x01])
+                if ret[2] != (0x90, 0x00) or len(ret[3]) != 1:
+                    break
+                opened.append(ret[3][0])
+            for ch in opened:
+                self.card.sr_apdu([self.card.CLA, 0x70, 0x80, ch, 0x00])
+            self.caps['channels'] = len(opened) + 1
+        self.cache.save()
+        return self.caps['channels']
+
+    def probe_all(self, CLA=None):
+        '''
+        probe_all(CLA=None) -> dict(capability map)
+
+        probes CLA, INS (with the card CLA by default) and logical channels
+        '''
+        self.probe_cla()
+        self.probe_ins(CLA)
+        self.probe_channels()
+        return self.capabilities()
+
+    def capabilities(self):
+        '''
+        capabilities() -> dict(capability map)
+
+        'CLA': list of CLA supported (with any of the commands probed),
+        'INS': {CLA: list of INS supported},
+        'channels' and 'extended_length' (None when not probed),
+        'complete': whether all CLA (with a command), and all INS of each
+        CLA, were probed
+        '''
+        caps = self.caps
+        CLA = set()
+        for known in caps['CLA'].values():
+            CLA.update( supported(known, CLA_unsupported) )
+        return {'model' : self.model,
+                'CLA' : sorted(CLA),
+                'INS' : dict( (int(c, 16), supported(i, INS_unsupported)) \
+                              for (c, i) in caps['INS'].items() ),
+                'channels' : caps['channels'],
+                'extended_length' : caps['extended_length'],
+                'complete' : {'CLA' : 256 in map(len, caps['CLA'].values()),
+                              'INS' : dict( (int(c, 16), len(i) == 256) \
+                                      for (c, i) in caps['INS'].items() )}}
+
@@ -0,0 +1,171 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# diff-based provisioning of EF #
+# content on (U)SIM cards       #
+#################################
+
+# maximum number of bytes in a short APDU
+MAX_LEN = 255
+
+# equal bytes between 2 changed ranges under which both ranges
+# are written with a single UPDATE BINARY (cheaper than 1 more APDU)
+MERGE_GAP = 5
+
+
+def diff_binary(old=[], new=[], gap=MERGE_GAP):
+    '''
+    diff_binary([1, 2, 3, 4], [1, 0, 3, 0]) -> [(1, [0, 3, 0])]
+
+    compares the current and target content of a transparent EF
+    returns the list of (offset, list of bytes) ranges to be written;
+    changed ranges separated by less than gap equal bytes are merged
+    bytes of new beyond the end of old are always written
+    '''
+    ranges = []
+    start, last = None, None
+    for i in range(len(new)):
+        if i < len(old) and old[i] == new[i]:
+            continue
+        if start is not None and i - last <= gap:
+            last = i
+        else:
+            if start is not None:
+                ranges.append( (start, new[start:last+1]) )
+            start, last = i, i
+    if start is not None:
+        ranges.append( (start, new[start:last+1]) )
+    return ranges
+
+def lookup_node(card, name):
+    '''
+    lookup_node(card, 'EF_IMSI') -> (tree index, FS_node) or (None, None)
+
+    finds the file by name in the file-system trees used by the card
+    '''
+    for i, tree in enumerate(card.FS_trees):
+        node = tree.get(name)
+        if node is not None:
+            return i, node
+    return None, None
+
+def read_binary(card, length):
+    '''
+    read_binary(card, length) -> list of bytes or None on error
+
+    reads the first length bytes of the currently selected transparent EF
+    '''
+    data = []
+    for offset in range(0, length, MAX_LEN):
+        card.coms.push( card.READ_BINARY(P1=offset >> 8, P2=offset & 0xFF,
+                                         Le=min(MAX_LEN, length-offset)) )
+        if card.coms()[2] != (0x90, 0x00):
+            return None
+        data.extend( card.coms()[3] )
+    return data
+
+def provision_EF(card, name, target, dry_run=False):
+    '''
+    provision_EF(card, 'EF_Kc', target content, dry_run=False) -> dict(report)
+
+    selects the EF by name, reads its current content (only the part
+    covered by the target), and writes only what differs:
+        transparent EF: target is a list of bytes, written from offset 0,
+            changed ranges are written with UPDATE BINARY at their offset
+        linear fixed / cyclic EF: target is a dict {record number: record},
+            changed records are written with UPDATE RECORD
+    with dry_run=True, nothing is written
+
+    the report contains the file 'name', its 'status' ('unchanged',
+    'updated', 'to update' or 'error'), and the 'writes' list of
+    (offset or record number, length), and after writing, 
+    the 'sw' list of (offset or record number, length, (sw1, sw2)) 
+    for each UPDATE command
+    '''
+    report = {'name' : name, 'writes' : [], 'status' : 'error'}
+    fil = card.select_by_name(name, read=False)
+    if fil is None or fil['Type'][0:2] != 'EF':
+        return report
+
+    if fil['Structure'] == 'transparent':
+        old = read_binary(card, min(len(target), fil['Size']))
+        if old is None:
+            return report
+        writes = diff_binary(old, target)
+    else:
+        writes = []
+        for num in sorted(target):
+            card.coms.push( card.READ_RECORD(P1=num, P2=0x04,
+                                             Le=fil['Record Length']) )
+            if card.coms()[2] != (0x90, 0x00):
+                return report
+            if card.coms()[3] != target[num]:
+                writes.append( (num, target[num]) )
+
+    report['writes'] = [ (ref, len(data)) for (ref, data) in writes ]
+    if not writes:
+        report['status'] = 'unchanged'
+        return report
+    if dry_run:
+        report['status'] = 'to update'
+        return report
+
+    # the EF is already selected, large ranges are split by update()
+    report['sw'] = []
+    for ref, data in writes:
+        if fil['Structure'] == 'transparent':
+            sw = card.update(Data=data, offset=ref, select=False)
+        else:
+            sw = card.update(Data=data, record=ref, select=False)
+        report['sw'].extend(sw)
+        if len(sw) == 0 or sw[-1][2] != (0x90, 0x00):
+            if card.dbg:
+                print '[DBG] %s' % card.coms()
+            return report
+    report['status'] = 'updated'
+    return report
+
+def provision(card, manifest={}, dry_run=False):
+    '''
+    provision(card, {'EF_Kc': [...], 'EF_ADN': {1: [...]}, ...}, dry_run=False)
+        -> list of dict(report)
+
+    brings the card content to the one described in the manifest,
+    files being referenced by name from the card/FS.py trees
+    files are processed grouped by DF, so that each DF is selected
+    only once (with SIM selection by name), and only the ranges / records
+    that differ are written (see provision_EF())
+    '''
+    order = []
+    for name in manifest:
+        i, node = lookup_node(card, name)
+        if node is None:
+            if card.dbg:
+                print '[WNG] unknown file name: %s' % name
+            order.append( ((len(card.FS_trees), ()), name) )
+        else:
+            ppath = node.parent is not None and node.parent.path or ()
+            order.append( ((i, ppath, node.path), name) )
+    order.sort()
+
+    reports = []
+    for key, name in order:
+        reports.append( provision_EF(card, name, manifest[name], dry_run) )
+    return reports
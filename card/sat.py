@@ -0,0 +1,227 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# proactive commands of the     #
+# SIM application toolkit       #
+# GSM 11.14, ETSI TS 102.223    #
+#################################
+#
+# a card with pending proactive commands ends a command with 91 XX
+# instead of 90 00: ISO7816.sr_apdu() then runs the session of the card
+# proactive_handler, which FETCHes each command and sends its TERMINAL
+# RESPONSE (until the card ends with 90 00), and gives back 90 00 to
+# the interrupted operation; when the session stops before (FETCH error,
+# invalid command, too many commands), the last SW of the session is
+# given back instead
+#
+
+from card.log import log
+
+# proactive command types (TS 102.223, section 9.4)
+command_types = {
+    0x01 : 'REFRESH',
+    0x02 : 'MORE TIME',
+    0x03 : 'POLL INTERVAL',
+    0x04 : 'POLLING OFF',
+    0x05 : 'SET UP EVENT LIST',
+    0x10 : 'SET UP CALL',
+    0x11 : 'SEND SS',
+    0x12 : 'SEND USSD',
+    0x13 : 'SEND SHORT MESSAGE',
+    0x14 : 'SEND DTMF',
+    0x15 : 'LAUNCH BROWSER',
+    0x20 : 'PLAY TONE',
+    0x21 : 'DISPLAY TEXT',
+    0x22 : 'GET INKEY',
+    0x23 : 'GET INPUT',
+    0x24 : 'SELECT ITEM',
+    0x25 : 'SET UP MENU',
+    0x26 : 'PROVIDE LOCAL INFORMATION',
+    0x27 : 'TIMER MANAGEMENT',
+    0x28 : 'SET UP IDLE MODE TEXT',
+    0x30 : 'PERFORM CARD APDU',
+    0x31 : 'POWER ON CARD',
+    0x32 : 'POWER OFF CARD',
+    0x33 : 'GET READER STATUS',
+    0x34 : 'RUN AT COMMAND',
+    0x35 : 'LANGUAGE NOTIFICATION',
+    0x40 : 'OPEN CHANNEL',
+    0x41 : 'CLOSE CHANNEL',
+    0x42 : 'RECEIVE DATA',
+    0x43 : 'SEND DATA',
+    0x44 : 'GET CHANNEL STATUS',
+    }
+
+# commands acknowledged as performed successfully by default:
+# they only inform the terminal, or need no action from a card reader
+accepted_commands = (0x02, 0x03, 0x04, 0x05, 0x20, 0x21, 0x25, 0x28, 0x35)
+# commands a card reader cannot perform, answered as such by default
+# (the card may then retry them): REFRESH, SEND SHORT MESSAGE
+unable_commands = (0x01, 0x13)
+
+# general results (TS 102.223, section 8.12)
+RESULT_OK = 0x00
+RESULT_TERMINAL_UNABLE = 0x20
+RESULT_BEYOND_CAPABILITIES = 0x30
+
+# comprehension TLV tags
+TAG_COMMAND_DETAILS = 0x01
+TAG_DEVICE_IDENTITIES = 0x02
+TAG_RESULT = 0x03
+TAG_DURATION = 0x04
+# device identities
+DEV_TERMINAL = 0x82
+DEV_UICC = 0x81
+
+
+def TLV_parser(data=[]):
+    '''
+    TLV_parser([0x81, 0x03, 0x01, 0x21, 0x80]) -> [(0x01, True, [1, 33, 128])]
+
+    parses COMPREHENSION-TLV objects (1 byte tag, length on 1 byte or
+    0x81 and 1 byte); returns a list of (tag without the comprehension
+    required bit, comprehension required, value)
+    '''
+    ret = []
+    while len(data) >= 2 and data[0] not in (0x00, 0xFF):
+        T, L = data[0], data[1]
+        if L == 0x81:
+            L, data = data[2], data[3:]
+        else:
+            data = data[2:]
+        ret.append( (T & 0x7F, bool(T & 0x80), data[:L]) )
+        data = data[L:]
+    return ret
+
+def TLV(tag, value=[]):
+    '''
+    TLV(tag, [value]) -> list of bytes of the COMPREHENSION-TLV object
+    '''
+    if len(value) > 0x7F:
+        return [tag, 0x81, len(value)] + value
+    return [tag, len(value)] + value
+
+def parse_command(data=[]):
+    '''
+    parse_command(FETCH response) -> dict(proactive command), or None
+
+    the dict contains the command 'number', 'type', 'qualifier' and
+    'name', the 'details' (command details object, as received), and
+    all its 'objects' as (tag, comprehension required, value)
+    '''
+    # proactive command BER-TLV
+    if len(data) < 2 or data[0] != 0xD0:
+        return None
+    if data[1] == 0x81:
+        objects = TLV_parser(data[3:3+data[2]])
+    else:
+        objects = TLV_parser(data[2:2+data[1]])
+    cmd = {'objects' : objects}
+    for T, CR, V in objects:
+        if T == TAG_COMMAND_DETAILS and len(V) == 3:
+            cmd['number'], cmd['type'], cmd['qualifier'] = V
+            cmd['details'] = V
+            cmd['name'] = command_types.get(V[1], 'unknown (0x%02X)' % V[1])
+            return cmd
+    return None
+
+def terminal_response(cmd, result=RESULT_OK, objects=[]):
+    '''
+    terminal_response(proactive command dict, result=0x00, objects=[])
+        -> TERMINAL RESPONSE data
+
+    objects: list of bytes of additional COMPREHENSION-TLV objects
+    '''
+    return TLV(0x80 | TAG_COMMAND_DETAILS, cmd['details']) + \
+           TLV(0x80 | TAG_DEVICE_IDENTITIES, [DEV_TERMINAL, DEV_UICC]) + \
+           TLV(0x80 | TAG_RESULT, [result]) + objects
+
+
+class proactive_handler(object):
+    '''
+    FETCHes proactive commands, and answers them:
+        card.sat = proactive_handler(callback=function)
+    callback(card, proactive command dict) returns the TERMINAL RESPONSE
+    data (see terminal_response()), or None to send the default one:
+        commands in accepted_commands are answered as performed
+        successfully, the ones in unable_commands as the terminal being
+        unable to process them, others as beyond the terminal capabilities
+    with card.sat = None, 91 XX is returned to the caller as is
+    '''
+
+    # maximum number of commands fetched in a row, in case the card
+    # never ends its proactive session
+    max_commands = 32
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        # last proactive commands handled, for inspection
+        self.history = []
+
+    def respond(self, card, cmd):
+        '''
+        respond(card, proactive command dict) -> TERMINAL RESPONSE data
+        '''
+        if self.callback is not None:
+            data = self.callback(card, cmd)
+            if data is not None:
+                return data
+        if cmd['type'] in unable_commands:
+            return terminal_response(cmd, RESULT_TERMINAL_UNABLE)
+        if cmd['type'] not in accepted_commands:
+            return terminal_response(cmd, RESULT_BEYOND_CAPABILITIES)
+        objects = []
+        if cmd['type'] == 0x03:
+            # POLL INTERVAL: the requested duration is accepted
+            for T, CR, V in cmd['objects']:
+                if T == TAG_DURATION:
+                    objects = TLV(TAG_DURATION, V)
+        return terminal_response(cmd, RESULT_OK, objects)
+
+    def session(self, card, Le):
+        '''
+        session(card, length of the first proactive command)
+            -> (number of commands handled, (sw1, sw2))
+
+        runs the proactive session until the card has no more command
+        the SW is the one ending the session: 90 00 when all commands
+        were handled, the SW of the failed FETCH or TERMINAL RESPONSE,
+        or 91 XX when a command is left pending
+        '''
+        self.history = []
+        sw = (0x91, Le)
+        while len(self.history) < self.max_commands:
+            ret = card.FETCH(Le)
+            if ret[2][0] not in (0x90, 0x91) or len(ret[3]) == 0:
+                log.debug('FETCH failed: %s', ret[1])
+                sw = ret[2]
+                break
+            cmd = parse_command(ret[3])
+            if cmd is None:
+                log.debug('invalid proactive command: %s', ret[3])
+                break
+            log.debug('proactive command: %s', cmd['name'])
+            self.history.append(cmd)
+            ret = card.TERMINAL_RESPONSE(self.respond(card, cmd))
+            sw = ret[2]
+            if sw[0] != 0x91:
+                break
+            Le = sw[1]
+        return len(self.history), sw
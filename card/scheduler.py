@@ -0,0 +1,318 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# scheduling of urgent calls    #
+# and background jobs on a card #
+#################################
+#
+# a single worker thread sends all commands to the card:
+#   urgent calls (authentication...) are run as soon as the current
+#   unit of work ends
+#   background jobs (reads, scans) are generators: each step runs one
+#   unit of work (a SELECT and READ sequence), and yields the path of
+#   the DF it works in; when an urgent call was run in between, the DF
+#   is selected again before the next step
+# urgent calls work in the application: after background work, the USIM
+# ADF is selected again before the call (files such as EF_IMSI are
+# selected relatively to it, and AUTHENTICATE needs it)
+# an urgent call waits at most for one unit of work
+#
+
+import threading
+from collections import deque
+from time import time
+
+from card.ICC import UICC
+from card.session import card_session
+
+
+def select_context(card, path=[]):
+    '''
+    select_context(card, DF path from MF) -> bool
+
+    selects the DF again, FID by FID from MF (SIM),
+    or by path from MF (UICC)
+    '''
+    if card.select([0x3F, 0x00], read=False) is None:
+        return False
+    if len(path) == 0:
+        return True
+    if isinstance(card, UICC):
+        return card.select(list(path), 'pmf', read=False) is not None
+    for i in range(0, len(path), 2):
+        if card.select(list(path[i:i+2]), read=False) is None:
+            return False
+    return True
+
+def select_application(card):
+    '''
+    select_application(card) -> bool
+
+    selects the USIM ADF again on a UICC (the one selected by
+    USIM.__init__(), or else the first application from EF_DIR);
+    nothing is needed on a SIM, where calls select their DF by name
+    '''
+    if not isinstance(card, UICC):
+        return True
+    AID = getattr(card, 'AID', [])
+    for aid in AID:
+        if tuple(aid[0:5]) == (0xA0, 0x00, 0x00, 0x00, 0x87) \
+        and tuple(aid[5:7]) == (0x10, 0x02):
+            return card.select(aid, 'aid', read=False) is not None
+    if len(AID) > 0:
+        return card.select(AID[0], 'aid', read=False) is not None
+    return card.select([0x3F, 0x00], read=False) is not None
+
+def read_job(card, paths=[]):
+    '''
+    background job: selects and reads each file of paths (under MF)
+    yields (DF path, (path, file dict or None)) for each file
+    '''
+    DF = None
+    for path in paths:
+        path = list(path)
+        if path[:-2] != DF:
+            DF = None
+            if not select_context(card, path[:-2]):
+                yield [], (path, None)
+                continue
+            DF = path[:-2]
+        fil = card.select(path[-2:])
+        if fil is not None and fil.get('Type') == 'DF':
+            # the DF of the file is not the current one anymore
+            DF = None
+        yield DF or [], (path, fil)
+
+def scan_job(card, path=[], hi_addr=(0, 0xff), lo_addr=(0, 0xff)):
+    '''
+    background job: brute forces the file identifiers in the DF at path
+    (under MF), and in its sub-DF found, like ISO7816.recu_files_bf()
+    yields (DF path, file dict with 'Absolut Path', or None) for each FID
+    '''
+    DF_to_explore = [list(path)]
+    while DF_to_explore:
+        DF = DF_to_explore.pop(0)
+        if not select_context(card, DF):
+            continue
+        for i in range(hi_addr[0], hi_addr[1]):
+            for j in range(lo_addr[0], lo_addr[1]):
+                if [i, j] in ([0x3F, 0x00], [0x7F, 0xFF]):
+                    yield DF, None
+                    continue
+                fil = card.select([i, j])
+                if fil is None:
+                    yield DF, None
+                    continue
+                fil['Absolut Path'] = DF + [i, j]
+                if fil.get('Type') == 'DF':
+                    DF_to_explore.append(DF + [i, j])
+                    select_context(card, DF)
+                yield DF, fil
+
+
+class background_job(object):
+    '''
+    background job of a card_scheduler:
+        results: list of the non-None results yielded by the job
+        done: threading.Event set when the job ended
+        error: exception which stopped the job, if any
+    '''
+
+    def __init__(self, func, args, kwargs):
+        self.func, self.args, self.kwargs = func, args, kwargs
+        self.gen = None
+        self.context = []
+        # the card selection was changed by another call
+        self.preempted = False
+        self.results = []
+        self.done = threading.Event()
+        self.error = None
+
+    def step(self, card):
+        '''
+        step(card) -> False when the job ended
+        '''
+        if self.gen is None:
+            self.gen = self.func(card, *self.args, **self.kwargs)
+        elif self.preempted:
+            select_context(card, self.context)
+        self.preempted = False
+        try:
+            self.context, res = next(self.gen)
+        except StopIteration:
+            return False
+        if res is not None:
+            self.results.append(res)
+        return True
+
+
+class urgent_call(object):
+    '''
+    urgent call of a card_scheduler, waited for by the caller
+    '''
+
+    def __init__(self, name, args, kwargs):
+        self.name, self.args, self.kwargs = name, args, kwargs
+        self.result = None
+        self.error = None
+        self.queued = time()
+        self.done = threading.Event()
+
+
+class card_scheduler(object):
+    '''
+    runs urgent calls before background jobs on a card:
+        sched = card_scheduler(card or card_session)
+        job = sched.add_job(read_job, [[0x7F, 0x20, 0x6F, 0x07], ...])
+        res = sched.authenticate(RAND, AUTN)    -> call_result(value, sw)
+        job.done.wait(); job.results
+        sched.stop()
+    latency: list of the last urgent calls waiting times (seconds)
+    '''
+
+    # number of waiting times kept
+    max_latency = 1000
+
+    def __init__(self, card):
+        if isinstance(card, card_session):
+            self.session = card
+        else:
+            self.session = card_session(card)
+        self._urgent = deque()
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._running = True
+        # the application is still selected since the last urgent call
+        self._in_application = False
+        self.latency = deque(maxlen=self.max_latency)
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._running and not self._urgent and not self._jobs:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                if self._urgent:
+                    call, job = self._urgent.popleft(), None
+                else:
+                    call, job = None, self._jobs[0]
+            if call is not None:
+                self._run_call(call)
+            else:
+                self._run_step(job)
+
+    def _run_call(self, call):
+        self.latency.append( time() - call.queued )
+        try:
+            with self.session.transaction() as card:
+                if not self._in_application:
+                    select_application(card)
+                    self._in_application = True
+                call.result = self.session.call(call.name, *call.args,
+                                                **call.kwargs)
+        except Exception as err:
+            call.error = err
+            self._in_application = False
+        # the selection of the background jobs is lost
+        with self._cond:
+            for job in self._jobs:
+                if job.gen is not None:
+                    job.preempted = True
+        call.done.set()
+
+    def _run_step(self, job):
+        self._in_application = False
+        try:
+            with self.session.transaction() as card:
+                more = job.step(card)
+        except Exception as err:
+            job.error, more = err, False
+        with self._cond:
+            if not more:
+                self._jobs.remove(job)
+                job.done.set()
+            elif len(self._jobs) > 1:
+                # round-robin between background jobs,
+                # each one restores its own selection
+                self._jobs.rotate(-1)
+                for other in self._jobs:
+                    if other is not job and other.gen is not None:
+                        other.preempted = True
+
+    def call(self, name, *args, **kwargs):
+        '''
+        call('method name', *args, **kwargs) -> call_result(value, sw)
+
+        runs the card method before any further background work,
+        and waits for its result; exceptions are raised to the caller
+        '''
+        call = urgent_call(name, args, kwargs)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError('scheduler stopped')
+            self._urgent.append(call)
+            self._cond.notify()
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def authenticate(self, *args, **kwargs):
+        return self.call('authenticate', *args, **kwargs)
+
+    def run_gsm_alg(self, RAND=16*[0x00]):
+        return self.call('run_gsm_alg', RAND)
+
+    def get_imsi(self):
+        return self.call('get_imsi')
+
+    def add_job(self, func, *args, **kwargs):
+        '''
+        add_job(job generator function, *args, **kwargs) -> background_job
+
+        func(card, *args, **kwargs) must be a generator yielding
+        (DF path of the current selection, result or None) after each
+        unit of work (see read_job() and scan_job())
+        '''
+        job = background_job(func, args, kwargs)
+        with self._cond:
+            self._jobs.append(job)
+            self._cond.notify()
+        return job
+
+    def stop(self, wait=True):
+        '''
+        stops the worker thread, after the current unit of work
+        (pending urgent calls get an error, pending background jobs
+        are left unfinished)
+        '''
+        with self._cond:
+            self._running = False
+            while self._urgent:
+                call = self._urgent.popleft()
+                call.error = RuntimeError('scheduler stopped')
+                call.done.set()
+            self._cond.notify()
+        if wait:
+            self._thread.join()
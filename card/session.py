@@ -0,0 +1,138 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# card sessions shared between  #
+# threads and processes         #
+#################################
+#
+# a card instance keeps its selection state (cur_DF) and the last
+# responses (coms): a high-level operation, made of several APDU, must
+# not be interleaved with another one
+# card_session runs each operation under a per-session lock, and within
+# a PC/SC transaction, which also keeps out other processes using
+# the same reader
+#
+
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from card.log import log
+
+# result of an operation: the value returned by the card method,
+# and the SW of its last APDU
+call_result = namedtuple('call_result', ['value', 'sw'])
+
+
+def _pcsc_handle(connection):
+    # the PC/SC card handle, under the pyscard connection decorators;
+    # None for connections not using PC/SC (e.g. trace replay)
+    while connection is not None:
+        if hasattr(connection, 'hcard'):
+            return connection.hcard
+        connection = getattr(connection, 'component', None)
+    return None
+
+
+class card_session(object):
+    '''
+    wraps a SIM / USIM / ISO7816 instance, to share it between threads:
+        session = card_session(USIM())
+        res = session.authenticate(RAND, AUTN)    -> call_result(value, sw)
+        with session.transaction() as card:       # for a custom sequence
+            card.select(...)
+            ...
+    '''
+
+    def __init__(self, card):
+        self.card = card
+        self.lock = threading.RLock()
+        self._depth = 0
+        self._hcard = _pcsc_handle(card.cardservice.connection)
+
+    def _begin(self):
+        if self._hcard is None:
+            return
+        from smartcard.scard import SCardBeginTransaction, SCARD_S_SUCCESS
+        hresult = SCardBeginTransaction(self._hcard)
+        if hresult != SCARD_S_SUCCESS:
+            # the lock still serializes the threads of this process
+            log.warning('PC/SC transaction not started: %s', hresult)
+
+    def _end(self):
+        if self._hcard is None:
+            return
+        from smartcard.scard import SCardEndTransaction, SCARD_LEAVE_CARD
+        SCardEndTransaction(self._hcard, SCARD_LEAVE_CARD)
+
+    @contextmanager
+    def transaction(self):
+        '''
+        with session.transaction() as card: ...
+
+        gives exclusive use of the card to the block;
+        transactions can be nested within a thread
+        '''
+        with self.lock:
+            self._depth += 1
+            if self._depth == 1:
+                self._begin()
+            try:
+                yield self.card
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end()
+
+    def call(self, name, *args, **kwargs):
+        '''
+        call('method name', *args, **kwargs) -> call_result(value, sw)
+
+        runs the card method as an atomic operation
+        '''
+        with self.transaction() as card:
+            value = getattr(card, name)(*args, **kwargs)
+            sw = None
+            if len(card.coms.apdu_stack) > 0:
+                sw = card.coms()[2]
+        return call_result(value, sw)
+
+    def get_imsi(self):
+        return self.call('get_imsi')
+
+    def authenticate(self, *args, **kwargs):
+        return self.call('authenticate', *args, **kwargs)
+
+    def run_gsm_alg(self, RAND=16*[0x00]):
+        return self.call('run_gsm_alg', RAND)
+
+    def read_EF(self, fil):
+        return self.call('read_EF', fil)
+
+    def select(self, *args, **kwargs):
+        '''
+        select(...) -> call_result(file dict, sw)
+
+        selection and reading of the file, see ISO7816.select()
+        '''
+        return self.call('select', *args, **kwargs)
+
+    def select_by_name(self, name='', read=True):
+        return self.call('select_by_name', name, read)
@@ -0,0 +1,158 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# SQN tracking and automatic    #
+# resynchronisation             #
+# 3GPP TS 33.102, annex C       #
+#################################
+#
+# SQN = SEQ || IND, with IND the IND_BITS least significant bits:
+# each new vector uses SEQ + 1, and the next IND value
+#
+
+import json
+import os
+import threading
+from card.log import log
+from card.milenage import int_to_bytes, bytes_to_int
+
+IND_BITS = 5
+
+
+class sqn_tracker(object):
+    '''
+    keeps the last SQN used for each card (e.g. by IMSI),
+    and saves them in a JSON file when given, so that later runs
+    start in sync with the cards
+
+    the file is written every save_every new SQN, and on each
+    resynchronisation: call save() before exiting; after a crash, the
+    SQN not saved are used again, and the cards resynchronise them
+    (see authenticate_sync())
+
+    an instance can be shared between threads (e.g. by the card.hlr
+    servers): next(), resync() and save() hold a lock
+    '''
+
+    # number of new SQN between 2 saves of the file
+    save_every = 16
+
+    def __init__(self, filename=None, ind_bits=IND_BITS):
+        self.filename = filename
+        self.ind_bits = ind_bits
+        self.state = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if filename is not None and os.path.exists(filename):
+            self.state = json.load(open(filename))
+
+    def save(self):
+        '''
+        writes the SQN of all cards in the JSON file
+        (through a temporary file, so that it is never left truncated)
+        '''
+        self._lock.acquire()
+        try:
+            self._save()
+        finally:
+            self._lock.release()
+
+    def _save(self):
+        # called with the lock held
+        self._unsaved = 0
+        if self.filename is None:
+            return
+        tmp = self.filename + '.tmp'
+        fd = open(tmp, 'w')
+        json.dump(self.state, fd, sort_keys=True)
+        fd.close()
+        os.rename(tmp, self.filename)
+
+    def get(self, card_id):
+        '''
+        get(card_id) -> last SQN used, integer
+        '''
+        return self.state.get(card_id, 0)
+
+    def next(self, card_id):
+        '''
+        next(card_id) -> SQN for a new vector, list of 6 bytes
+
+        the new SQN is recorded as used (and saved every save_every SQN)
+        '''
+        mask = (1 << self.ind_bits) - 1
+        self._lock.acquire()
+        try:
+            sqn = self.get(card_id)
+            seq, ind = sqn >> self.ind_bits, sqn & mask
+            sqn = ((seq + 1) << self.ind_bits) | ((ind + 1) & mask)
+            self.state[card_id] = sqn
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save()
+        finally:
+            self._lock.release()
+        return int_to_bytes(sqn, 6)
+
+    def resync(self, card_id, SQN_MS=6*[0]):
+        '''
+        resync(card_id, SQN_MS)
+
+        sets the SQN of the card to the one it returned in AUTS,
+        so that the next one is accepted
+        '''
+        self._lock.acquire()
+        try:
+            self.state[card_id] = bytes_to_int(SQN_MS)
+            self._save()
+        finally:
+            self._lock.release()
+
+
+def authenticate_sync(usim, mil, tracker, card_id, RAND=None,
+                      AMF=[0x80, 0x00]):
+    '''
+    authenticate_sync(USIM instance, milenage instance, sqn_tracker instance,
+                      card_id, RAND=None, AMF)
+        -> ([RAND, AUTN, XRES, CK, IK], [RES, CK, IK (, Kc)] or None)
+
+    generates a vector with the next SQN of the card (card_id in the
+    tracker, e.g. its IMSI, read once by the caller) and runs the 3G
+    authentication with it
+    when the card returns AUTS, SQN_MS is recovered with f5* and MAC-S
+    checked with f1*; the tracker is resynchronised and the authentication
+    is run once again, with a new vector
+    the card result is returned only if it matches the expected one,
+    None otherwise
+    '''
+    vec = mil.generate(RAND, tracker.next(card_id), AMF)
+    ret = usim.authenticate(vec[0], vec[1], ctx='3G')
+    if ret is not None and len(ret) == 1:
+        SQN_MS = mil.resync(vec[0], ret[0])
+        if SQN_MS is None:
+            log.warning('AUTS with a wrong MAC-S: bad K / OPc?')
+            return vec, None
+        log.debug('SQN resynchronised to %s', SQN_MS)
+        tracker.resync(card_id, SQN_MS)
+        vec = mil.generate(None, tracker.next(card_id), AMF)
+        ret = usim.authenticate(vec[0], vec[1], ctx='3G')
+    if not mil.check(vec[0], vec[1], ret) or len(ret) < 3:
+        return vec, None
+    return vec, ret
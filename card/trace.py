@@ -0,0 +1,153 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# APDU trace recording and      #
+# deterministic replay          #
+#################################
+#
+# binary trace format, little endian:
+#   header: magic (8 bytes), ATR length (2 bytes), ATR,
+#           reader name length (2 bytes), reader name
+#   then for each command / response pair:
+#           timestamp (double), command length (2 bytes),
+#           response data length (2 bytes), command, response data, SW1, SW2
+#
+
+import struct
+from time import time
+from card.utils import byteToString, stringToByte
+
+TRACE_MAGIC = 'APDUTRC\x01'
+_hdr = struct.Struct('<H')
+_rec = struct.Struct('<dHH')
+
+
+class ReplayError(Exception):
+    '''
+    raised when a replayed card receives a command which is not
+    the one recorded, or when the trace is exhausted
+    '''
+    pass
+
+
+class apdu_recorder(object):
+    '''
+    writes a compact binary trace of all command / response pairs
+    exchanged with a card, see ISO7816.start_trace()
+    '''
+
+    def __init__(self, filename, ATR=[], reader=''):
+        '''
+        creates the trace file, and writes its header
+        '''
+        self.fd = open(filename, 'wb')
+        self.fd.write(TRACE_MAGIC)
+        self.fd.write(_hdr.pack(len(ATR)) + byteToString(ATR))
+        self.fd.write(_hdr.pack(len(reader)) + reader)
+        self.count = 0
+
+    def record(self, apdu, data, sw1, sw2):
+        '''
+        appends a command / response pair to the trace
+        '''
+        self.fd.write(_rec.pack(time(), len(apdu), len(data)) \
+                      + byteToString(apdu) + byteToString(data) \
+                      + chr(sw1) + chr(sw2))
+        self.count += 1
+
+    def close(self):
+        self.fd.close()
+
+
+def read_trace(filename):
+    '''
+    read_trace(filename) -> (ATR, reader, generator of records)
+
+    reads a binary trace written by apdu_recorder
+    each record is a tuple:
+        (timestamp, command, response data, sw1, sw2)
+    '''
+    fd = open(filename, 'rb')
+    if fd.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+        fd.close()
+        raise ReplayError('%s is not an APDU trace' % filename)
+    l, = _hdr.unpack(fd.read(_hdr.size))
+    ATR = stringToByte(fd.read(l))
+    l, = _hdr.unpack(fd.read(_hdr.size))
+    reader = fd.read(l)
+
+    def records():
+        while True:
+            buf = fd.read(_rec.size)
+            if len(buf) < _rec.size:
+                fd.close()
+                return
+            ts, lc, lr = _rec.unpack(buf)
+            apdu = map(ord, fd.read(lc))
+            resp = map(ord, fd.read(lr+2))
+            yield ts, apdu, resp[:-2], resp[-2], resp[-1]
+
+    return ATR, reader, records()
+
+
+class replay_connection(object):
+    '''
+    fake card connection, serving the responses of a recorded trace
+    in the order they were recorded, without any delay
+
+    with strict=True, each command sent must be the recorded one,
+    otherwise ReplayError is raised
+    '''
+
+    def __init__(self, filename, strict=True):
+        self.ATR, self.reader, self.records = read_trace(filename)
+        self.strict = strict
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def getReader(self):
+        return self.reader
+
+    def getATR(self):
+        return self.ATR
+
+    def transmit(self, apdu):
+        try:
+            ts, rec_apdu, data, sw1, sw2 = self.records.next()
+        except StopIteration:
+            raise ReplayError('end of trace reached')
+        if self.strict and list(apdu) != rec_apdu:
+            raise ReplayError('command %s does not match recorded %s' \
+                              % (apdu, rec_apdu))
+        return data, sw1, sw2
+
+
+class replay_cardservice(object):
+    '''
+    card service to pass to a card class instead of a real card, e.g.
+        SIM(cardservice=replay_cardservice('trace.bin'))
+    '''
+
+    def __init__(self, filename, strict=True):
+        self.connection = replay_connection(filename, strict)
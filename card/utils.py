@@ -23,7 +23,6 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 #################################
 
 from collections import deque
-from smartcard.util import toBytes
 
 # from python 2.6, format('b') allows to use 0b10010110 notation: 
 # much convinient
@@ -48,10 +47,17 @@ def stringToByte(string):
     
     converts a string into a list of bytes
     '''
-    bytelist = []
-    for c in string:
-        bytelist.extend( toBytes(c.encode('hex')) )
-    return bytelist
+    return [ord(c) for c in string]
+
+# equivalent to the pyscard function "toHexString"
+# (avoids loading pyscard for displaying bytes)
+def toHexString(bytelist=[]):
+    '''
+    toHexString([0x3B, 0x9F]) -> '3B 9F'
+    
+    converts a list of bytes into a string of hex bytes, space separated
+    '''
+    return ' '.join(['%02X' % b for b in bytelist])
 
 # equivalent to the pyscard function "toASCIIString"
 def byteToString(bytelist):
@@ -107,10 +113,10 @@ def TLV_parser(bytelist):
     '''
     ret = []
     while len(bytelist) > 0:
-        T, L, V = first_TLV_parser(bytelist)
-        if T == 0xFF:
+        if bytelist[0] == 0xFF:
             # padding bytes
             break
+        T, L, V = first_TLV_parser(bytelist)
         ret.append( (T, L, V) )
         # need to manage length of L
         if L > 0xFE: 
@@ -201,12 +207,31 @@ def decode_BCD(data=[]):
     decode_BCD([0x21, 0xFE, 0xA3]) -> '121415310'
     
     to decode serial number (IMSI, ICCID...) from list of bytes
+    (filler nibbles are decoded as '15': see card.codec for decoding
+    identities and numbers)
     '''
-    string = ''
-    for B in data:
-        string += str( B & 0x0F )
-        string += str( B >> 4 )
-    return string 
+    return ''.join([ _BCD_table[B] for B in data ])
+
+# byte -> 2 decimal strings, for decode_BCD()
+_BCD_table = [ str(B & 0x0F) + str(B >> 4) for B in range(256) ]
+
+# conversion functions from UMTS to GSM security context, 3GPP TS 33.102
+def c2(RES=[]):
+    '''
+    c2(RES) -> SRES, list of 4 bytes
+    
+    XOR of the 4 bytes blocks of RES, padded with 0 to 16 bytes
+    '''
+    RES = RES + (16 - len(RES)) * [0x00]
+    return [RES[i] ^ RES[i+4] ^ RES[i+8] ^ RES[i+12] for i in range(4)]
+
+def c3(CK=[], IK=[]):
+    '''
+    c3(CK, IK) -> Kc, list of 8 bytes
+    
+    XOR of both halves of CK and of IK
+    '''
+    return [CK[i] ^ CK[i+8] ^ IK[i] ^ IK[i+8] for i in range(8)]
 
 
 #######################################################
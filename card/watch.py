@@ -0,0 +1,169 @@
+"""
+card: Library adapted to request (U)SIM cards and other types of telco cards.
+Copyright (C) 2010 Benoit Michau
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+
+#################################
+# watching EF content changes   #
+# (location, ciphering keys)    #
+#################################
+#
+# each poll reads only the bytes of interest:
+#   on USIM, with READ BINARY by short file identifier (no selection)
+#   on SIM, DF_GSM stays selected, the EF is selected without GET RESPONSE
+#   (and not at all when a single file is watched), then READ BINARY
+#
+
+import json
+from binascii import b2a_hex
+from time import time, sleep
+
+from card.ICC import UICC
+from card.log import log
+from card.provision import diff_binary
+from card.scheduler import select_application
+from card.utils import byteToString
+
+# SIM files under DF_GSM: length read
+SIM_watch_files = {
+    'EF_LOCI' : 11,
+    'EF_Kc' : 9,
+    }
+
+# USIM files: short file identifier, length read (TS 31.102)
+USIM_watch_files = {
+    'EF_KEYS' : (0x08, 33),
+    'EF_KEYSPS' : (0x09, 33),
+    'EF_LOCI' : (0x0B, 11),
+    'EF_PSLOCI' : (0x0C, 14),
+    }
+
+
+class change_watcher(object):
+    '''
+    polls some EF of a SIM or USIM, and reports their changes:
+        w = change_watcher(card, ['EF_LOCI', 'EF_Kc'])
+        w.run(callback=function, fd=file object)
+    each change event is a dict:
+        time, file, old and new content (hex), changed (offset, length)
+    '''
+
+    def __init__(self, card, names=None):
+        self.card = card
+        self.is_UICC = isinstance(card, UICC)
+        if self.is_UICC:
+            files = USIM_watch_files
+        else:
+            files = SIM_watch_files
+        if names is None:
+            names = sorted(files)
+        for name in names:
+            if name not in files:
+                raise ValueError('%s cannot be watched' % name)
+        self.names = names
+        self.files = files
+        self.values = {}
+        # EF currently selected on the SIM
+        self._cur = None
+
+    def _read_SIM(self, name):
+        if self._cur is None:
+            if self.card.select_by_name('DF_GSM', read=False) is None:
+                return None
+        if self._cur != name:
+            node = self.card.FS_trees[0].get(name)
+            self.card.coms.push( self.card.SELECT_FILE(Data=list(node.fid)) )
+            if self.card.coms()[2][0] != 0x9F:
+                self._cur = None
+                return None
+            self._cur = name
+        self.card.coms.push( self.card.READ_BINARY(Le=self.files[name]) )
+        if self.card.coms()[2] != (0x90, 0x00):
+            self._cur = None
+            return None
+        return self.card.coms()[3]
+
+    def _read_USIM(self, name, retry=True):
+        # EF read by SFI, in the current application
+        sfi, length = self.files[name]
+        self.card.coms.push( self.card.READ_BINARY(P1=0x80 | sfi,
+                                                   Le=length) )
+        if self.card.coms()[2] == (0x90, 0x00):
+            return self.card.coms()[3]
+        if retry:
+            # the USIM ADF may not be selected anymore (e.g. after
+            # other calls on the card): selected again, and read once more
+            if select_application(self.card):
+                return self._read_USIM(name, retry=False)
+            log.warning('%s not read: USIM selection failed', name)
+            return None
+        log.warning('%s not read: SW %02X%02X', name, *self.card.coms()[2])
+        return None
+
+    def read(self, name):
+        '''
+        read(name) -> content of the watched EF, or None on error
+        '''
+        if self.is_UICC:
+            return self._read_USIM(name)
+        return self._read_SIM(name)
+
+    def poll(self):
+        '''
+        poll() -> list of change events
+
+        reads all watched files once, and compares them with
+        their previous content (the first read gives no event)
+        '''
+        events = []
+        for name in self.names:
+            data = self.read(name)
+            if data is None:
+                continue
+            old = self.values.get(name)
+            if old is not None and data != old:
+                events.append( {'time' : round(time(), 6), 'file' : name,
+                    'old' : b2a_hex(byteToString(old)),
+                    'new' : b2a_hex(byteToString(data)),
+                    'changed' : [(off, len(d)) for (off, d) \
+                                 in diff_binary(old, data, gap=0)]} )
+            self.values[name] = data
+        return events
+
+    def run(self, callback=None, fd=None, interval=0.0, count=None):
+        '''
+        run(callback=function(event), fd=file object, interval=0.0,
+            count=None) -> number of events
+
+        polls the files until count polls are done (forever if None),
+        waiting interval seconds between polls (by default, as fast as
+        the card answers); each event is passed to callback, and / or
+        written as a JSON line to fd
+        '''
+        num, polls = 0, 0
+        while count is None or polls < count:
+            for event in self.poll():
+                if callback is not None:
+                    callback(event)
+                if fd is not None:
+                    fd.write(json.dumps(event, sort_keys=True) + '\n')
+                    fd.flush()
+                num += 1
+            polls += 1
+            if interval:
+                sleep(interval)
+        return num
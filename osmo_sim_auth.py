@@ -24,11 +24,24 @@ with this program; if not, write to the Free Software Foundation, Inc.,
 from binascii import *
 from card.utils import *
 from optparse import OptionParser
-from card.USIM import USIM
-from card.SIM import SIM
+import json
 import sys
 
+# the card classes (and pyscard) are only imported by the handlers,
+# once the arguments are checked
+
+# parameters of SIM.caller, for the -p option
+sim_params = ['Kc', 'IMSI', 'LOCI', 'HPLMN', 'PLMN_SEL', 'ICCID', 'SPN',
+	      'ACC', 'FPLMN', 'MSISDN', 'SMSP', 'PRINT_ALL', 'GSM_ALGO']
+
+def is_hex(value, length):
+	try:
+		return len(value) == length and len(a2b_hex(value)) == length/2
+	except TypeError:
+		return False
+
 def handle_usim(options, rand_bin, autn_bin):
+	from card.USIM import USIM
 	u = USIM()
 	if not u:
 		print "Error opening USIM"
@@ -42,24 +55,41 @@ def handle_usim(options, rand_bin, autn_bin):
 
 	print "\nUMTS Authentication"
 	ret = u.authenticate(rand_bin, autn_bin, ctx='3G')
-	if len(ret) == 1:
-		print "AUTS:\t%s" % b2a_hex(byteToString(ret[0]))
+	if ret is None or len(ret) < 3:
+		if ret is not None and len(ret) == 1:
+			print "AUTS:\t%s" % b2a_hex(byteToString(ret[0]))
+		# no 3G keys to derive the GSM ones from
+		gsm = None
 	else:
 		print "RES:\t%s" % b2a_hex(byteToString(ret[0]))
 		print "CK:\t%s" % b2a_hex(byteToString(ret[1]))
 		print "IK:\t%s" % b2a_hex(byteToString(ret[2]))
 		if len(ret) == 4:
 			print "Kc:\t%s" % b2a_hex(byteToString(ret[3]))
+		else:
+			print "Kc:\t%s (c3)" % b2a_hex(byteToString(c3(ret[1], ret[2])))
+		gsm = [c2(ret[0]), c3(ret[1], ret[2])]
+		print "\nGSM Authentication (c2 / c3 from UMTS keys)"
+		print "SRES:\t%s" % b2a_hex(byteToString(gsm[0]))
+		print "Kc:\t%s" % b2a_hex(byteToString(gsm[1]))
 
+	if gsm is not None and not options.check2g:
+		return
 	print "\nGSM Authentication"
 	ret = u.authenticate(rand_bin, autn_bin, ctx='2G')
-	if not len(ret) == 2:
+	if ret is None or not len(ret) == 2:
 		print "Error during 2G authentication"
 		exit(1)
 	print "SRES:\t%s" % b2a_hex(byteToString(ret[0]))
 	print "Kc:\t%s" % b2a_hex(byteToString(ret[1]))
+	if gsm is not None:
+		if ret == gsm:
+			print "card and c2 / c3 results match"
+		else:
+			print "card and c2 / c3 results DIFFER"
 
 def handle_sim(options, rand_bin):
+	from card.SIM import SIM
 	s= SIM()
 	if not s:
 		print "Error opening SIM"
@@ -78,6 +108,7 @@ def handle_sim(options, rand_bin):
 		print "1%s@uma.mnc%s.mcc%s.3gppnetwork.org,%s,%s,%s" % (imsi, imsi[3:6], imsi[0:3], b2a_hex(byteToString(rand_bin)), b2a_hex(byteToString(ret[0])), b2a_hex(byteToString(ret[1])))
 
 def handle_siminfo(options):
+	from card.SIM import SIM
 	s= SIM()
 	if not s:
 		print "Error opening SIM"
@@ -90,6 +121,133 @@ def handle_siminfo(options):
 	else:
 		return s.caller.get(options.param)()
 
+def handle_fleet(options):
+	from card.fleet import run_fleet
+	plan = 'ICCID,IMSI'
+	if options.param is not None:
+		plan = options.param
+	out = sys.stdout
+	if options.output is not None:
+		out = open(options.output, 'w')
+	try:
+		return run_fleet(plan.split(','), out, options.format)
+	except ValueError as err:
+		print err
+		exit(2)
+
+def read_vectors(fd):
+	# readline() rather than iterating over fd: the file iterator reads
+	# ahead, and would wait for more input before a vector is processed
+	for line in iter(fd.readline, ''):
+		fields = line.replace(',', ' ').split()
+		if len(fields) == 0 or fields[0][0] == '#':
+			continue
+		yield fields
+
+def batch_vector(card, fields, sim=False, check2g=False):
+	res = {'rand': fields[0]}
+	if not is_hex(fields[0], 32):
+		res['error'] = 'bad RAND'
+		return res
+	rand_bin = stringToByte(a2b_hex(fields[0]))
+	if sim:
+		ret = card.run_gsm_alg(rand_bin)
+		if ret is None:
+			res['error'] = 'authentication failed'
+		else:
+			res['sres'] = b2a_hex(byteToString(ret[0]))
+			res['kc'] = b2a_hex(byteToString(ret[1]))
+		return res
+
+	if len(fields) < 2 or not is_hex(fields[1], 32):
+		res['error'] = 'bad AUTN'
+		return res
+	res['autn'] = fields[1]
+	autn_bin = stringToByte(a2b_hex(fields[1]))
+	ret = card.authenticate(rand_bin, autn_bin, ctx='3G')
+	if ret is None or len(ret) == 0:
+		res['error'] = 'authentication failed'
+	elif len(ret) == 1:
+		res['auts'] = b2a_hex(byteToString(ret[0]))
+	else:
+		for name, val in zip(('res', 'ck', 'ik', 'kc'), ret):
+			res[name] = b2a_hex(byteToString(val))
+		# GSM SRES / Kc, computed locally from the UMTS keys
+		gsm = [c2(ret[0]), c3(ret[1], ret[2])]
+		res['sres'] = b2a_hex(byteToString(gsm[0]))
+		if len(ret) == 3:
+			res['kc'] = b2a_hex(byteToString(gsm[1]))
+		if check2g:
+			ret = card.authenticate(rand_bin, autn_bin, ctx='2G')
+			res['check_2g'] = ret == gsm
+	return res
+
+def handle_batch(options):
+	if options.batch == '-':
+		fd = sys.stdin
+	else:
+		fd = open(options.batch)
+	out = sys.stdout
+	if options.output is not None:
+		out = open(options.output, 'w')
+
+	if options.sim:
+		from card.SIM import SIM
+		card = SIM()
+	else:
+		from card.USIM import USIM
+		card = USIM()
+	if options.debug:
+		card.dbg = 2
+
+	# one vector at a time, each result is written as soon as
+	# it is available, and the next line is only read afterwards
+	count = 0
+	for fields in read_vectors(fd):
+		res = batch_vector(card, fields, options.sim, options.check2g)
+		out.write(json.dumps(res, sort_keys=True) + '\n')
+		out.flush()
+		count += 1
+	return count
+
+def handle_hlr(options):
+	from card.hlr import hlr_backend, make_server, open_cards
+	if options.sim:
+		from card.SIM import SIM as cls
+	else:
+		from card.USIM import USIM as cls
+	keys, tracker = {}, None
+	if options.keys is not None:
+		# {IMSI: {"K": hex, "OPc": hex (or "OP": hex)}}
+		from card.milenage import milenage
+		from card.sqn import sqn_tracker
+		for imsi, k in json.load(open(options.keys)).items():
+			val = dict((n, stringToByte(a2b_hex(v))) for n, v in k.items())
+			keys[str(imsi)] = milenage(val['K'], val.get('OP'), val.get('OPc'))
+		tracker = sqn_tracker(options.keys + '.sqn')
+
+	cards = open_cards(cls)
+	if not cards:
+		print "No card found"
+		exit(1)
+	backend = hlr_backend(cards, keys, tracker)
+	if options.debug:
+		for session in backend.cards.values():
+			session.card.dbg = 2
+
+	address = options.hlr
+	if ':' in address:
+		host, port = address.rsplit(':', 1)
+		address = (host, int(port))
+	server = make_server(backend, address)
+	print "Serving %s on %s" % (', '.join(backend.cards.keys()), options.hlr)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	if tracker is not None:
+		tracker.save()
+
 def options(parser):
 	parser.add_option("-a", "--autn", dest="autn",
 			  help="AUTN parameter from AuC - 32 hex digits")
@@ -108,13 +266,62 @@ def options(parser):
 	parser.add_option("-p", "--param", dest="param",
 			  help="Kc|IMSI|LOCI|HPLMN|PLMN_SEL|ICCID|SPN|ACC|FPLMN|MSISDN|SMSP|PRINT_ALL|GSM_ALGO")
 	parser.add_option("-w", "--write", dest="write", help="SIM in write mode")
+	parser.add_option("-F", "--fleet", dest="fleet",
+			  help="Fleet mode: run the read plan given with -p "
+			  "(comma separated, default: ICCID,IMSI) on the cards "
+			  "of all readers",
+			  action="store_true", default=False)
+	parser.add_option("-c", "--check-2g", dest="check2g",
+			  help="USIM mode: also run the GSM authentication on the "
+			  "card, and compare with SRES / Kc derived from the UMTS "
+			  "keys (c2 / c3)",
+			  action="store_true", default=False)
+	parser.add_option("-b", "--batch", dest="batch",
+			  help="Batch mode: read RAND AUTN (or RAND only in SIM "
+			  "mode) lines from this file, or from stdin with '-', "
+			  "and write one JSON result per line")
+	parser.add_option("-H", "--hlr", dest="hlr",
+			  help="hlr_auc_gw server mode, on this UNIX socket path, "
+			  "or host:port for UDP, with the cards of all readers")
+	parser.add_option("-k", "--keys", dest="keys",
+			  help="JSON file with K and OPc (or OP) per IMSI, for "
+			  "AKA requests in hlr_auc_gw mode (SQN kept in FILE.sqn)")
+	parser.add_option("-o", "--output", dest="output",
+			  help="Output file for fleet and batch modes "
+			  "(default: stdout)")
+	parser.add_option("-f", "--format", dest="format", default="jsonl",
+			  help="Output format for fleet mode: jsonl|csv")
+
+def check_options(parser, opt):
+	if opt.rand is not None and not is_hex(opt.rand, 32):
+		parser.error("RAND must be 32 hex digits")
+	if opt.autn is not None and not is_hex(opt.autn, 32):
+		parser.error("AUTN must be 32 hex digits")
+	if opt.format not in ('jsonl', 'csv'):
+		parser.error("unknown output format: %s" % opt.format)
+	if opt.param is not None and not opt.fleet \
+	and opt.param not in sim_params:
+		parser.error("unknown parameter: %s" % opt.param)
 
 def execute_options():
 	parser = OptionParser()
 	options(parser)
 	(opt, args) = parser.parse_args()
+	check_options(parser, opt)
+
+	# library messages: on stderr, so that the results on stdout
+	# stay machine-readable
+	import logging
+	from card.log import enable_console
+	enable_console(opt.debug and logging.DEBUG or logging.INFO, sys.stderr)
 
-	if opt.param is not None and opt.sim is True:
+	if opt.fleet:
+		return handle_fleet(opt)
+	elif opt.batch is not None:
+		return handle_batch(opt)
+	elif opt.hlr is not None:
+		return handle_hlr(opt)
+	elif opt.param is not None and opt.sim is True:
 		output = handle_siminfo(opt)
 		if output is not None:
 			print output
@@ -126,7 +333,6 @@ def execute_options():
 	elif opt.param is not None and opt.rand is not None:
 		return handle_siminfo(opt)
 	else:
-		exit(2)
 		if not opt.rand:
 			print "You have to specify RAND"
 			exit(2)
@@ -0,0 +1,45 @@
+"""
+tests of the file-system trees and SIM selection sequences (card.FS)
+"""
+
+import unittest
+
+from card.FS import SIM_FS_tree
+
+
+class select_sequence_test(unittest.TestCase):
+
+    def seq(self, name, cur=None):
+        node = SIM_FS_tree.get(name)
+        if cur is not None:
+            cur = SIM_FS_tree.get(cur)
+        return SIM_FS_tree.select_sequence(node, cur)
+
+    def test_from_nowhere(self):
+        self.assertEqual(self.seq('EF_IMSI'), [[0x3F, 0x00], [0x7F, 0x20],
+                                               [0x6F, 0x07]])
+
+    def test_MF_from_first_level_DF(self):
+        self.assertEqual(self.seq('MF', 'DF_GSM'), [[0x3F, 0x00]])
+
+    def test_parent_DF(self):
+        self.assertEqual(self.seq('DF_TELECOM', 'DF_GRAPHICS'),
+                         [[0x7F, 0x10]])
+
+    def test_sibling_DF(self):
+        self.assertEqual(self.seq('DF_TELECOM', 'DF_GSM'), [[0x7F, 0x10]])
+
+    def test_EF_of_parent(self):
+        self.assertEqual(self.seq('EF_ADN', 'DF_GRAPHICS'),
+                         [[0x7F, 0x10], [0x6F, 0x3A]])
+
+    def test_child_EF(self):
+        self.assertEqual(self.seq('EF_IMSI', 'DF_GSM'), [[0x6F, 0x07]])
+
+    def test_EF_of_sibling_DF(self):
+        self.assertEqual(self.seq('EF_ADN', 'DF_GSM'),
+                         [[0x7F, 0x10], [0x6F, 0x3A]])
+
+
+if __name__ == '__main__':
+    unittest.main()
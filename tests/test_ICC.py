@@ -0,0 +1,91 @@
+import unittest
+
+from card.ICC import UICC
+
+
+class fake_connection(object):
+    '''
+    UICC with PIN 1234 for application 1, answering VERIFY only
+    '''
+
+    def __init__(self):
+        self.attempts, self.verified = 3, False
+        self.apdus = []
+
+    def connect(self):
+        pass
+
+    def getReader(self):
+        return 'fake reader'
+
+    def getATR(self):
+        return [0x3B, 0x00]
+
+    def transmit(self, apdu):
+        self.apdus.append(apdu)
+        if apdu[1] != 0x20 or apdu[3] != 0x01:
+            return [], 0x6D, 0x00
+        if len(apdu) == 4:
+            if self.verified:
+                return [], 0x90, 0x00
+            return [], 0x63, 0xC0 | self.attempts
+        if apdu[5:] == [0x31, 0x32, 0x33, 0x34, 0xFF, 0xFF, 0xFF, 0xFF]:
+            self.attempts, self.verified = 3, True
+            return [], 0x90, 0x00
+        self.attempts -= 1
+        return [], 0x63, 0xC0 | self.attempts
+
+
+class fake_cardservice(object):
+
+    def __init__(self):
+        self.connection = fake_connection()
+
+
+# FCP PIN status template: PIN Appl 1 enabled, ADM1 disabled
+PS_TEMPLATE = [0x90, 0x01, 0x80, 0x83, 0x01, 0x01, 0x83, 0x01, 0x0A]
+
+
+class UICC_access_test(unittest.TestCase):
+
+    def setUp(self):
+        self.card = UICC(cardservice=fake_cardservice())
+        self.conn = self.card.cardservice.connection
+
+    def test_pin_status(self):
+        fil = UICC.parse_pin_status(PS_TEMPLATE, {})
+        self.assertEqual(fil['PIN Enabled'], {0x01 : True, 0x0A : False})
+
+    def test_read_allowed(self):
+        self.card.PIN_enabled = {0x01 : True, 0x0A : False}
+        always = {'Security Attributes compact' : [0x01, 0x00]}
+        never = {'Security Attributes compact' : [0x01, 0xFF]}
+        pin = {'Security Attributes compact' : [0x03, 0x90, 0x90]}
+        self.assertTrue(self.card.read_allowed(always))
+        self.assertFalse(self.card.read_allowed(never))
+        self.assertFalse(self.card.read_allowed(pin))
+        self.card.verified.add('PIN Appl 1')
+        self.assertTrue(self.card.read_allowed(pin))
+        # PIN disabled
+        self.card.verified.clear()
+        self.card.PIN_enabled = {0x01 : False, 0x0A : False}
+        self.assertTrue(self.card.read_allowed(pin))
+
+    def test_verify_clears_denied(self):
+        fil = {'Security Attributes ref to expanded' : [0x6F, 0x06, 0x02]}
+        self.card.denied.add( self.card.access_key(fil) )
+        self.assertFalse(self.card.read_allowed(fil))
+        self.assertTrue(self.card.verify_pin('1234'))
+        self.assertTrue(self.card.read_allowed(fil))
+        # verified once per session
+        self.assertTrue(self.card.verify_pin('1234'))
+        self.assertEqual(len(self.conn.apdus), 2)
+
+    def test_last_attempt(self):
+        self.conn.attempts = 1
+        self.assertFalse(self.card.verify_pin('0000'))
+        self.assertEqual(self.conn.attempts, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import subprocess
+import sys
+import unittest
+
+from card import codec
+
+ICCID = [ codec.encode_iccid(i) for i in ('8933011234567890123',
+                                          '89014103211118510720') ]
+IMSI = [ codec.encode_imsi(i) for i in ('208101234567890', '00101123456789') ]
+# MNC with 2 digits, MNC with 3 digits, unused entry
+PLMN = [ codec.encode_plmn('208', '10'), codec.encode_plmn('310', '260'),
+         [0xFF, 0xFF, 0xFF], codec.encode_plmn('001', '01') ]
+LAI = [ codec.encode_lai('208', '10', 0x1234),
+        codec.encode_lai('310', '260', 0xFFFE), [0xFF, 0xFF, 0xFF, 0, 1] ]
+
+
+class codec_test(unittest.TestCase):
+
+    def test_plmn(self):
+        self.assertEqual(PLMN[0], [0x02, 0xF8, 0x01])
+        self.assertEqual(codec.decode_plmn(PLMN[0]), ('208', '10'))
+        self.assertEqual(codec.decode_plmn(PLMN[1]), ('310', '260'))
+        self.assertEqual(codec.decode_plmn(PLMN[2]), None)
+
+    def test_lai(self):
+        self.assertEqual(codec.decode_lai(LAI[1]), ('310', '260', 0xFFFE))
+
+    def test_imsi(self):
+        self.assertEqual(codec.decode_imsi(IMSI[0]), '208101234567890')
+        self.assertEqual(codec.decode_imsi(IMSI[1]), '00101123456789')
+
+
+class batch_test(unittest.TestCase):
+    '''
+    batch decoding gives the scalar results, with numpy when installed
+    '''
+
+    def test_digits(self):
+        self.assertEqual(codec.decode_iccid_batch(ICCID),
+                         [ codec.decode_iccid(r) for r in ICCID ])
+        self.assertEqual(codec.decode_digits_batch(ICCID),
+                         [ codec.decode_digits(r) for r in ICCID ])
+
+    def test_imsi(self):
+        self.assertEqual(codec.decode_imsi_batch(IMSI),
+                         [ codec.decode_imsi(r) for r in IMSI ])
+
+    def test_plmn(self):
+        data = [ B for p in PLMN for B in p ]
+        self.assertEqual(codec.decode_plmn_batch(data),
+                         codec.decode_plmn_list(data))
+        self.assertEqual(codec.decode_plmn_batch([data, PLMN[1]]),
+                         codec.decode_plmn_list(data + PLMN[1]))
+
+    def test_lai(self):
+        self.assertEqual(codec.decode_lai_batch(LAI),
+                         [ codec.decode_lai(r) for r in LAI ])
+
+
+class batch_fallback_test(batch_test):
+    '''
+    same, without numpy
+    '''
+
+    def setUp(self):
+        self._numpy_module = codec._numpy_module
+        codec._numpy_module = False
+
+    def tearDown(self):
+        codec._numpy_module = self._numpy_module
+
+
+class lazy_import_test(unittest.TestCase):
+
+    def test_no_numpy_import(self):
+        # importing card does not import numpy
+        out = subprocess.check_output([sys.executable, '-c',
+                  'import sys, card; print "numpy" in sys.modules'])
+        self.assertEqual(out.strip(), 'False')
+
+
+if __name__ == '__main__':
+    unittest.main()
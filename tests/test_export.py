@@ -0,0 +1,48 @@
+import unittest
+
+from card.export import decode_adn, decode_sms
+
+
+class decode_adn_test(unittest.TestCase):
+
+    # alpha 'AB', 3 digits, international
+    rec = [0x41, 0x42, 0x03, 0x91, 0x21, 0xF3] + 10*[0xFF]
+
+    def test_no_extension(self):
+        entry = decode_adn(self.rec, lambda num: self.fail(num))
+        self.assertEqual(entry['number'], '+123')
+        self.assertEqual(entry['alpha'], u'AB')
+
+    def test_extension_chain(self):
+        # the extension record is followed whatever the number length
+        rec = self.rec[:-1] + [0x02]
+        exts = {2 : [0x02, 0x01, 0x54] + 9*[0xFF] + [0x05],
+                5 : [0x02, 0x01, 0xF6] + 9*[0xFF] + [0xFF]}
+        read = []
+        def ext(num):
+            read.append(num)
+            return exts.get(num)
+        entry = decode_adn(rec, ext)
+        self.assertEqual(entry['number'], '+123456')
+        self.assertEqual(read, [2, 5])
+
+    def test_empty(self):
+        self.assertEqual(decode_adn(16*[0xFF]), None)
+
+    def test_digit_table(self):
+        # nibble 0xD is a wild value ('w'), as in card.codec
+        rec = [0x41, 0x42, 0x03, 0x81, 0x21, 0xFD] + 10*[0xFF]
+        self.assertEqual(decode_adn(rec)['number'], '12w')
+
+
+class decode_sms_test(unittest.TestCase):
+
+    def test_sc_address(self):
+        rec = [0x01, 0x03, 0x91, 0x21, 0xF3, 0x04, 0x0B] + 169*[0xFF]
+        entry = decode_sms(rec)
+        self.assertEqual(entry['sc_address'], '+123')
+        self.assertEqual(entry['tpdu'], '040b')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import Queue
+import sys
+import types
+import unittest
+
+from card.fleet import reader_worker
+
+
+class reader_error(Exception):
+    pass
+
+
+class timeout_error(Exception):
+    pass
+
+
+class failing_request(object):
+    '''
+    CardRequest of a reader unplugged while waiting for a card
+    '''
+
+    def __init__(self, **kwargs):
+        pass
+
+    def waitforcard(self):
+        raise reader_error('reader unplugged')
+
+
+class reader_worker_test(unittest.TestCase):
+
+    modules = ['smartcard', 'smartcard.CardRequest', 'smartcard.CardType',
+               'smartcard.Exceptions']
+
+    def setUp(self):
+        # pyscard modules, with a reader failing
+        self.saved = dict([ (name, sys.modules.get(name)) \
+                            for name in self.modules ])
+        for name in self.modules:
+            sys.modules[name] = types.ModuleType(name)
+        sys.modules['smartcard.CardRequest'].CardRequest = failing_request
+        sys.modules['smartcard.CardType'].AnyCardType = object
+        sys.modules['smartcard.Exceptions'].CardRequestTimeoutException = \
+            timeout_error
+
+    def tearDown(self):
+        for name, module in self.saved.items():
+            if module is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = module
+
+    def test_reader_error(self):
+        queue = Queue.Queue()
+        reader_worker('reader 0', ['ICCID'], queue, wait=1)
+        self.assertEqual(queue.get_nowait(), {'reader' : 'reader 0',
+                                              'error' : 'reader unplugged'})
+        # the end of the worker, as counted by run_fleet()
+        self.assertEqual(queue.get_nowait(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
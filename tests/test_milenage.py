@@ -0,0 +1,124 @@
+import unittest
+
+from card import codec
+from card.milenage import milenage, make_OPc, TS_35208_sets, self_test, \
+     int_to_bytes, numpy_batch_min
+
+
+def test_set(i):
+    # K, RAND, SQN, AMF, OP, OPc, f1, f1*, f2, f5, f3, f4, f5*
+    return [ map(ord, v.decode('hex')) for v in TS_35208_sets[i-1] ]
+
+
+class TS_35208_test(unittest.TestCase):
+    '''
+    3GPP TS 35.208, test sets 1 to 6
+    '''
+
+    def check_set(self, i):
+        K, RAND, SQN, AMF, OP, OPc, f1, f1s, f2, f5, f3, f4, f5s = test_set(i)
+        self.assertEqual(make_OPc(K, OP), OPc)
+        m = milenage(K, OP=OP)
+        self.assertEqual(m.f1(RAND, SQN, AMF), f1)
+        self.assertEqual(m.f1star(RAND, SQN, AMF), f1s)
+        self.assertEqual(m.f2345(RAND), [f2, f3, f4, f5])
+        self.assertEqual(m.f5star(RAND), f5s)
+
+    def test_set_1(self):
+        self.check_set(1)
+
+    def test_set_2(self):
+        self.check_set(2)
+
+    def test_set_3(self):
+        self.check_set(3)
+
+    def test_set_4(self):
+        self.check_set(4)
+
+    def test_set_5(self):
+        self.check_set(5)
+
+    def test_set_6(self):
+        self.check_set(6)
+
+    def test_self_test(self):
+        self.assertTrue(self_test())
+
+
+class vector_test(unittest.TestCase):
+
+    def setUp(self):
+        K, RAND, SQN, AMF, OP, OPc, f1, f1s, f2, f5, f3, f4, f5s = test_set(1)
+        self.m = milenage(K, OPc=OPc)
+        self.RAND, self.SQN, self.AMF = RAND, SQN, AMF
+        self.f = (f1, f2, f3, f4, f5, f5s)
+
+    def test_generate(self):
+        f1, f2, f3, f4, f5, f5s = self.f
+        RAND, AUTN, XRES, CK, IK = self.m.generate(self.RAND, self.SQN,
+                                                   self.AMF)
+        self.assertEqual(AUTN, [ self.SQN[i] ^ f5[i] for i in range(6) ] \
+                               + self.AMF + f1)
+        self.assertEqual([XRES, CK, IK], [f2, f3, f4])
+        self.assertTrue(self.m.check(RAND, AUTN, [XRES, CK, IK]))
+        self.assertFalse(self.m.check(RAND, AUTN, [XRES, IK, CK]))
+
+    def test_resync(self):
+        f1, f2, f3, f4, f5, f5s = self.f
+        MACS = self.m.f1star(self.RAND, self.SQN, [0, 0])
+        AUTS = [ self.SQN[i] ^ f5s[i] for i in range(6) ] + MACS
+        self.assertEqual(self.m.resync(self.RAND, AUTS), self.SQN)
+        self.assertEqual(self.m.resync(self.RAND, AUTS[:-1] + [0]), None)
+
+    def test_batch(self):
+        vectors = self.m.generate_batch(3, SQN=0x20, step=0x20)
+        for i, (RAND, AUTN, XRES, CK, IK) in enumerate(vectors):
+            SQN = int_to_bytes(0x20*(i+1), 6)
+            self.assertEqual(self.m.generate(RAND, SQN),
+                             [RAND, AUTN, XRES, CK, IK])
+        self.assertEqual(self.m.check_batch([ (v[0], v[1], v[2:]) \
+                                              for v in vectors ]),
+                         3*[True])
+
+    def test_large_batch(self):
+        # from numpy_batch_min vectors, all vectors are computed at once
+        count = numpy_batch_min + 1
+        vectors = self.m.generate_batch(count, SQN=0xFFFFFFFFFFF0, step=8)
+        for i, (RAND, AUTN, XRES, CK, IK) in enumerate(vectors):
+            SQN = int_to_bytes(0xFFFFFFFFFFF0 + 8*i, 6)
+            self.assertEqual(self.m.generate(RAND, SQN),
+                             [RAND, AUTN, XRES, CK, IK])
+        results = [ v[2:] for v in vectors ]
+        # wrong RES, wrong IK, and no result
+        results[0] = [results[0][0][:4], results[0][1], results[0][2]]
+        results[1] = [results[1][0], results[1][1], 16*[0]]
+        results[2] = None
+        self.assertEqual(self.m.check_batch([ (v[0], v[1], r) \
+                                for v, r in zip(vectors, results) ]),
+                         [True, False, False] + (count-3)*[True])
+
+    def test_batch_TS_35208(self):
+        K, RAND, SQN, AMF, OP, OPc, f1, f1s, f2, f5, f3, f4, f5s = test_set(1)
+        m = milenage(K, OPc=OPc)
+        self.assertEqual(m.check_batch(numpy_batch_min * \
+                                       [(RAND, None, [f2, f3, f4])]),
+                         numpy_batch_min * [True])
+
+
+class batch_fallback_test(vector_test):
+    '''
+    same, without numpy
+    '''
+
+    def setUp(self):
+        vector_test.setUp(self)
+        self._numpy_module = codec._numpy_module
+        codec._numpy_module = False
+
+    def tearDown(self):
+        codec._numpy_module = self._numpy_module
+
+
+if __name__ == '__main__':
+    unittest.main()
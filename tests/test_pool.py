@@ -0,0 +1,31 @@
+import unittest
+from Queue import Empty
+
+from card.pool import vector_pool
+
+
+class fake_card(object):
+    dbg = False
+
+
+class vector_pool_test(unittest.TestCase):
+
+    def test_get(self):
+        count = []
+        def producer(card):
+            count.append(1)
+            return {'RAND' : len(count)}
+        pool = vector_pool(fake_card(), size=4, low_watermark=1,
+                           producer=producer)
+        self.assertEqual(pool.get(timeout=5)['RAND'], 1)
+        pool.stop()
+
+    def test_get_after_card_errors(self):
+        # the filler stops after max_errors: get() must not wait forever
+        pool = vector_pool(fake_card(), producer=lambda card: None)
+        self.assertRaises(Empty, pool.get)
+        self.assertFalse(pool.running())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from card.probe import capability_probe, capability_cache
+
+
+class fake_card(object):
+    '''
+    card supporting CLA A0 for all commands, and CLA 00 for SELECT only
+    '''
+    ATR = [0x3B, 0x00]
+    CLA = 0xA0
+
+    def __init__(self):
+        self.apdus = []
+
+    def sr_apdu(self, apdu):
+        self.apdus.append(apdu)
+        if apdu[0] == 0xA0 or (apdu[0] == 0x00 and apdu[1] == 0xA4):
+            return ['', '', (0x90, 0x00), []]
+        return ['', '', (0x6E, 0x00), []]
+
+
+class capability_probe_test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'caps.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cla_cache_per_command(self):
+        card = fake_card()
+        probe = capability_probe(card, self.filename)
+        self.assertEqual(probe.probe_cla(), [0x00, 0xA0])
+        self.assertEqual(len(card.apdus), 256)
+        # same command: nothing is sent again, even from the saved cache
+        probe = capability_probe(card, self.filename)
+        self.assertEqual(probe.probe_cla(), [0x00, 0xA0])
+        self.assertEqual(len(card.apdus), 256)
+        # another command is probed on its own
+        self.assertEqual(probe.probe_cla(param=[0xF2, 0x00, 0x00, 0x16]),
+                         [0xA0])
+        self.assertEqual(len(card.apdus), 512)
+        self.assertEqual(probe.capabilities()['CLA'], [0x00, 0xA0])
+
+    def test_previous_cache(self):
+        # CLA not kept per command: probed with SELECT MF
+        json.dump({'3b00' : {'CLA' : {'a0' : '9000'}, 'INS' : {},
+                             'channels' : None, 'extended_length' : None}},
+                  open(self.filename, 'w'))
+        card = fake_card()
+        probe = capability_probe(card, capability_cache(self.filename))
+        self.assertEqual(probe.probe_cla(0xA0), [0xA0])
+        self.assertEqual(len(card.apdus), 255 - 0xA0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from card.sat import proactive_handler, TLV_parser, TAG_RESULT, \
+     RESULT_OK, RESULT_TERMINAL_UNABLE
+
+
+def command(num, typ):
+    # proactive command with its command details object only
+    return [0xD0, 0x05, 0x81, 0x03, num, typ, 0x00]
+
+
+class fake_card(object):
+    '''
+    card with a list of proactive commands to be fetched, and the SW
+    to end each TERMINAL RESPONSE with (91 XX when a command follows)
+    '''
+
+    def __init__(self, commands, fetch_sw=(0x91, 0x07), last_sw=(0x90, 0x00)):
+        self.commands = list(commands)
+        self.fetch_sw, self.last_sw = fetch_sw, last_sw
+        self.responses = []
+
+    def FETCH(self, Le):
+        if self.fetch_sw[0] not in (0x90, 0x91):
+            return ['', '', self.fetch_sw, []]
+        return ['', '', (0x90, 0x00), self.commands[0]]
+
+    def TERMINAL_RESPONSE(self, data):
+        self.responses.append(data)
+        self.commands.pop(0)
+        if self.commands:
+            return ['', '', (0x91, len(self.commands[0])), []]
+        return ['', '', self.last_sw, []]
+
+
+def result(data):
+    return [ V for (T, CR, V) in TLV_parser(data) if T == TAG_RESULT ][0][0]
+
+
+class proactive_handler_test(unittest.TestCase):
+
+    def test_session_ends_normally(self):
+        card = fake_card([command(1, 0x21), command(2, 0x01)])
+        num, sw = proactive_handler().session(card, 7)
+        self.assertEqual((num, sw), (2, (0x90, 0x00)))
+        # DISPLAY TEXT is performed, REFRESH is not
+        self.assertEqual(map(result, card.responses),
+                         [RESULT_OK, RESULT_TERMINAL_UNABLE])
+
+    def test_fetch_error(self):
+        card = fake_card([command(1, 0x21)], fetch_sw=(0x6F, 0x00))
+        self.assertEqual(proactive_handler().session(card, 7),
+                         (0, (0x6F, 0x00)))
+
+    def test_max_commands(self):
+        card = fake_card(3*[command(1, 0x21)])
+        handler = proactive_handler()
+        handler.max_commands = 2
+        self.assertEqual(handler.session(card, 7), (2, (0x91, 0x07)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+
+from card.ICC import UICC
+from card.utils import apdu_stack
+from card.scheduler import card_scheduler
+
+USIM_AID = [0xA0, 0x00, 0x00, 0x00, 0x87, 0x10, 0x02, 0xFF, 0xFF]
+
+
+class fake_connection(object):
+    component = None
+
+
+class fake_cardservice(object):
+    connection = fake_connection()
+
+
+class fake_USIM(UICC):
+    '''
+    UICC keeping track of its selection, without any reader:
+    EF_IMSI is only found under the USIM ADF
+    '''
+
+    def __init__(self):
+        self.cardservice = fake_cardservice()
+        self.coms = apdu_stack()
+        self.AID = [[0xA0, 0x00, 0x00, 0x00, 0x63], USIM_AID]
+        self.cur_DF = None
+        self.current = ['MF']
+        self.ops = []
+
+    def select(self, Data=[0x3F, 0x00], typ='fid', with_length=True,
+               read=True):
+        if typ == 'aid':
+            self.current = ['ADF']
+        elif Data == [0x3F, 0x00]:
+            self.current = ['MF']
+        elif typ == 'pmf':
+            self.current = ['MF'] + [ tuple(Data[i:i+2]) \
+                                      for i in range(0, len(Data), 2) ]
+        elif Data[0] in (0x7F, 0x5F):
+            self.current = self.current + [tuple(Data)]
+        elif self.current != ['ADF'] or Data != [0x6F, 0x07]:
+            return None
+        return {'Type' : 'DF'}
+
+    def get_imsi(self):
+        self.ops.append( ('get_imsi', self.current) )
+        if self.select([0x6F, 0x07]) is None:
+            return None
+        return '001010123456789'
+
+
+def blocking_job(card, started, release):
+    # unit of work 1: enters DF_TELECOM, then waits for an urgent call
+    card.select([0x7F, 0x10])
+    card.ops.append( ('step', card.current) )
+    started.set()
+    release.wait()
+    yield [0x7F, 0x10], 1
+    # unit of work 2: must find its DF selected again
+    card.ops.append( ('step', card.current) )
+    yield [0x7F, 0x10], 2
+
+
+class card_scheduler_test(unittest.TestCase):
+
+    def setUp(self):
+        self.card = fake_USIM()
+        self.sched = card_scheduler(self.card)
+
+    def tearDown(self):
+        self.sched.stop()
+
+    def test_urgent_call_preempts_job(self):
+        started, release = threading.Event(), threading.Event()
+        job = self.sched.add_job(blocking_job, started, release)
+        self.assertTrue(started.wait(5))
+        res = []
+        caller = threading.Thread(target=lambda: \
+                                  res.append(self.sched.get_imsi()))
+        caller.start()
+        # the call is queued while the 1st unit of work runs
+        while not self.sched._urgent:
+            time.sleep(0.001)
+        release.set()
+        caller.join(5)
+        self.assertTrue(job.done.wait(5))
+        self.assertEqual(job.results, [1, 2])
+        # the urgent call ran between the 2 units of work, in the USIM
+        # ADF, then the job went on in its own DF
+        self.assertEqual(self.card.ops,
+                         [('step', ['MF', (0x7F, 0x10)]),
+                          ('get_imsi', ['ADF']),
+                          ('step', ['MF', (0x7F, 0x10)])])
+        self.assertEqual(res[0].value, '001010123456789')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from card.sqn import sqn_tracker
+
+
+class sqn_tracker_test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'sqn.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def saved(self):
+        if not os.path.exists(self.filename):
+            return None
+        return json.load(open(self.filename))
+
+    def test_next(self):
+        tracker = sqn_tracker()
+        self.assertEqual(tracker.next('001'), [0, 0, 0, 0, 0, 0x21])
+        self.assertEqual(tracker.next('001'), [0, 0, 0, 0, 0, 0x42])
+        tracker.resync('001', [0, 0, 0, 0, 0x01, 0x1F])
+        self.assertEqual(tracker.next('001'), [0, 0, 0, 0, 0x01, 0x20])
+
+    def test_periodic_save(self):
+        tracker = sqn_tracker(self.filename)
+        tracker.save_every = 4
+        for i in range(3):
+            tracker.next('001')
+        self.assertEqual(self.saved(), None)
+        tracker.next('001')
+        self.assertEqual(self.saved(), {'001' : 4 * 0x21})
+        tracker.next('001')
+        tracker.save()
+        self.assertEqual(sqn_tracker(self.filename).get('001'), 5 * 0x21)
+
+    def test_threads(self):
+        # as shared by the card.hlr server threads
+        tracker = sqn_tracker(self.filename, ind_bits=0)
+        tracker.save_every = 1
+        used, errors = [], []
+        def run():
+            try:
+                for i in range(50):
+                    used.append( tracker.next('001') )
+            except Exception as err:
+                errors.append(err)
+        threads = [ threading.Thread(target=run) for i in range(8) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(map(tuple, used))), 400)
+        self.assertEqual(self.saved(), {'001' : 400})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from card.USIM import USIM
+from card.codec import encode_imsi
+from card.trace import replay_cardservice, read_trace, ReplayError
+
+AID = [0xA0, 0x00, 0x00, 0x00, 0x87, 0x10, 0x02, 0xFF, 0xFF, 0xFF, 0xFF,
+       0x89]
+IMSI = '208101234567890'
+
+
+def FCP(descriptor, fid, size=None):
+    # FCP template with file descriptor, identifier, and file size
+    data = [0x82, len(descriptor)] + descriptor + [0x83, 0x02] + fid
+    if size is not None:
+        data += [0x80, 0x02, size >> 8, size & 0xFF]
+    return [0x62, len(data)] + data
+
+
+class fake_connection(object):
+    '''
+    UICC with a USIM application, holding EF_DIR and EF_IMSI
+    '''
+
+    files = {
+        (0x2F, 0x00) : (FCP([0x42, 0x21, 0x00, 0x26, 0x01], [0x2F, 0x00],
+                            0x26),
+                        [[0x61, 0x10, 0x4F, 0x0C] + AID + 22*[0xFF]]),
+        (0x6F, 0x07) : (FCP([0x41, 0x21], [0x6F, 0x07], 9),
+                        encode_imsi(IMSI)),
+        }
+
+    def __init__(self):
+        self.fcp, self.current = None, None
+
+    def connect(self):
+        pass
+
+    def getReader(self):
+        return 'fake reader'
+
+    def getATR(self):
+        return [0x3B, 0x9F, 0x96, 0x80, 0x1F, 0xC7, 0x80, 0x31, 0xE0]
+
+    def transmit(self, apdu):
+        INS, P1 = apdu[1], apdu[2]
+        if INS == 0xA4:
+            data = apdu[5:5+apdu[4]]
+            if P1 == 0x04 and data == AID:
+                self.fcp = FCP([0x78, 0x21], [0x7F, 0xFF])
+                self.current = None
+            elif tuple(data[-2:]) in self.files:
+                self.current = self.files[tuple(data[-2:])]
+                self.fcp = self.current[0]
+            else:
+                return [], 0x6A, 0x82
+            return [], 0x61, len(self.fcp)
+        elif INS == 0xC0:
+            return self.fcp, 0x90, 0x00
+        elif INS == 0xB2 and self.current is not None:
+            return self.current[1][P1-1], 0x90, 0x00
+        elif INS == 0xB0 and self.current is not None:
+            return self.current[1], 0x90, 0x00
+        return [], 0x6D, 0x00
+
+
+class fake_cardservice(object):
+
+    def __init__(self):
+        self.connection = fake_connection()
+
+
+class trace_test(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'usim.trc')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_record_and_replay_USIM(self):
+        card = USIM(cardservice=fake_cardservice(), trace=self.filename)
+        self.assertEqual(card.get_imsi(), IMSI)
+        card.stop_trace()
+        ATR, reader, records = read_trace(self.filename)
+        self.assertEqual(ATR, card.ATR)
+        # the trace starts with the EF_DIR selection of USIM.__init__()
+        records = list(records)
+        self.assertEqual(records[0][1][:5], [0x00, 0xA4, 0x08, 0x04, 0x02])
+        # the whole session, initialization included, is replayed
+        replayed = USIM(cardservice=replay_cardservice(self.filename))
+        self.assertEqual(replayed.AID, [AID])
+        self.assertEqual(replayed.get_imsi(), IMSI)
+        self.assertRaises(ReplayError, replayed.get_imsi)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+from card.ICC import UICC
+from card.watch import change_watcher
+
+AID = [0xA0, 0x00, 0x00, 0x00, 0x87, 0x10, 0x02, 0xFF, 0xFF, 0xFF, 0xFF,
+       0x89]
+# FCP of the USIM ADF
+FCP = [0x62, 0x07, 0x82, 0x02, 0x78, 0x21, 0x83, 0x01, 0x7F]
+
+
+class fake_connection(object):
+    '''
+    UICC reading EF_LOCI by SFI only while the USIM ADF is selected
+    '''
+
+    def __init__(self):
+        self.ADF, self.selections = False, 0
+        self.LOCI = 11*[0x00]
+
+    def connect(self):
+        pass
+
+    def getReader(self):
+        return 'fake reader'
+
+    def getATR(self):
+        return [0x3B, 0x00]
+
+    def transmit(self, apdu):
+        INS, P1 = apdu[1], apdu[2]
+        if INS == 0xA4 and P1 == 0x04 and apdu[5:5+apdu[4]] == AID:
+            self.ADF, self.selections = True, self.selections + 1
+            return [], 0x61, len(FCP)
+        elif INS == 0xC0:
+            return FCP, 0x90, 0x00
+        elif INS == 0xB0 and P1 == 0x80 | 0x0B:
+            if not self.ADF:
+                return [], 0x69, 0x86
+            return self.LOCI, 0x90, 0x00
+        return [], 0x6A, 0x82
+
+
+class fake_cardservice(object):
+
+    def __init__(self):
+        self.connection = fake_connection()
+
+
+class change_watcher_test(unittest.TestCase):
+
+    def setUp(self):
+        self.card = UICC(cardservice=fake_cardservice())
+        self.card.AID = [AID]
+        self.conn = self.card.cardservice.connection
+
+    def test_reselect(self):
+        watcher = change_watcher(self.card, ['EF_LOCI'])
+        # no ADF selected yet
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(self.conn.selections, 1)
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(self.conn.selections, 1)
+        # the ADF is lost, e.g. by another selection on the card
+        self.conn.ADF = False
+        self.conn.LOCI = 11*[0x01]
+        events = watcher.poll()
+        self.assertEqual(self.conn.selections, 2)
+        self.assertEqual(events[0]['new'], 11*'01')
+
+    def test_no_application(self):
+        self.card.AID = []
+        watcher = change_watcher(self.card, ['EF_LOCI'])
+        self.assertEqual(watcher.read('EF_LOCI'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()